@@ -11,7 +11,8 @@ def get_requires():
 
 
 extra_require = {
-    'jury': ['jury']
+    'jury': ['jury'],
+    'onnx': ['onnxruntime'],
 }
 
 
@@ -0,0 +1,174 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+from ..utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# 压测：把 QA 数据集中的问题按固定速率（开环）或固定并发（闭环）发送到 /query，
+# 统计吞吐、延迟分位数和错误率
+
+
+def load_questions(path: str = "") -> List[str]:
+    """
+    读取压测用的问题
+
+    Args:
+        path: generate 生成的 QA json（[{"question": ...}]）、运行文件（.jsonl/.parquet）
+              或每行一个问题的文本文件；为空时使用 config.toml 中的数据集
+    """
+    if not path:
+        from ..config import Config
+        from ..data.qa_loader import get_qa_dataset
+
+        cfg = Config()
+        return list(get_qa_dataset(cfg.dataset, cfg.dataset_path)['test_data']['question'])
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [item["question"] for item in json.load(f)]
+    if path.endswith(".jsonl") or path.endswith(".parquet"):
+        from ..eval.run_file import read_run_file
+
+        return [record["question"] for record in read_run_file(path)[1]]
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.errors: Counter = Counter()
+        self.sent = 0
+        # 开环模式下请求实际发出时间相对计划时间的滞后，滞后大说明压测端本身跟不上
+        self.max_lag_ms = 0.0
+
+    def report(self, seconds: float, mode: dict) -> dict:
+        completed = len(self.latencies_ms)
+        n_errors = sum(self.errors.values())
+        latencies = np.asarray(self.latencies_ms or [0.0])
+        p50, p90, p95, p99 = np.percentile(latencies, [50, 90, 95, 99])
+        return {
+            **mode,
+            "duration_s": round(seconds, 3),
+            "sent": self.sent,
+            "succeeded": completed,
+            "errors": n_errors,
+            "error_rate": round(n_errors / self.sent, 4) if self.sent else 0.0,
+            "error_kinds": dict(self.errors),
+            "throughput_rps": round(completed / seconds, 3) if seconds > 0 else 0.0,
+            "latency_ms": {
+                "p50": round(float(p50), 3),
+                "p90": round(float(p90), 3),
+                "p95": round(float(p95), 3),
+                "p99": round(float(p99), 3),
+                "mean": round(float(latencies.mean()), 3),
+                "max": round(float(latencies.max()), 3),
+            },
+            "max_schedule_lag_ms": round(self.max_lag_ms, 3),
+        }
+
+
+async def _send(client, url: str, question: str, top_k: int, result: LoadResult) -> None:
+    result.sent += 1
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json={"query": question, "top_k": top_k})
+    except Exception as e:
+        result.errors[type(e).__name__] += 1
+        return
+    if response.status_code != 200:
+        result.errors[f"HTTP {response.status_code}"] += 1
+        return
+    result.latencies_ms.append((time.perf_counter() - start) * 1000)
+
+
+async def _fixed_rate(client, url, questions, top_k, rate, n_requests, duration, result):
+    """开环：按计划时间发送，不等待前一个请求完成"""
+    tasks = []
+    start = time.perf_counter()
+    for i, question in enumerate(itertools.cycle(questions)):
+        if (n_requests and i >= n_requests) or (duration and i / rate >= duration):
+            break
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            result.max_lag_ms = max(result.max_lag_ms, -delay * 1000)
+        tasks.append(asyncio.create_task(_send(client, url, question, top_k, result)))
+    await asyncio.gather(*tasks)
+
+
+async def _fixed_concurrency(client, url, questions, top_k, concurrency, n_requests, duration, result):
+    """闭环：concurrency 个 worker，每个收到响应后立即发送下一个问题"""
+    source = enumerate(itertools.cycle(questions))
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        for i, question in source:
+            if (n_requests and i >= n_requests) or (deadline and time.perf_counter() >= deadline):
+                return
+            await _send(client, url, question, top_k, result)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_load(url: str, questions: List[str], rate: float = 0.0, concurrency: int = 1, n_requests: int = 0,
+                   duration: float = 0.0, top_k: int = 3, timeout: float = 120.0, warmup: int = 0) -> dict:
+    import httpx
+
+    if not questions:
+        raise ValueError("no questions to send")
+    if not n_requests and not duration:
+        n_requests = len(questions)
+    mode = {"mode": "rate", "rate": rate} if rate > 0 else {"mode": "concurrency", "concurrency": concurrency}
+    limits = httpx.Limits(max_connections=None if rate > 0 else concurrency, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        if warmup:
+            await _fixed_concurrency(client, url, questions, top_k, min(concurrency, warmup), warmup, 0, LoadResult())
+        result = LoadResult()
+        start = time.perf_counter()
+        if rate > 0:
+            await _fixed_rate(client, url, questions, top_k, rate, n_requests, duration, result)
+        else:
+            await _fixed_concurrency(client, url, questions, top_k, concurrency, n_requests, duration, result)
+        return result.report(time.perf_counter() - start, mode)
+
+
+def run_loadtest(url: str = "http://127.0.0.1:8000/query", questions_path: str = "", rate: float = 0.0,
+                 concurrency: int = 1, n_requests: int = 0, duration: float = 0.0, top_k: int = 3,
+                 timeout: float = 120.0, warmup: int = 0, output: Optional[str] = "") -> dict:
+    """
+    对运行中的 API 服务压测
+
+    Args:
+        url: /query 的地址
+        questions_path: 问题来源，见 load_questions
+        rate: 每秒请求数（开环）；为 0 时使用 concurrency（闭环）
+        concurrency: 闭环模式下的并发请求数
+        n_requests: 发送的请求数，问题循环使用；n_requests 和 duration 都为 0 时每个问题发送一次
+        duration: 压测时长（秒）
+        top_k: 请求中的 top_k
+        timeout: 单个请求的超时（秒）
+        warmup: 正式计时前发送的预热请求数
+        output: 结果 JSON 的路径，为空时只打印
+
+    Returns:
+        压测报告
+    """
+    questions = load_questions(questions_path)
+    logger.info(f"Load testing {url} with {len(questions)} questions")
+    report = asyncio.run(run_load(url, questions, rate, concurrency, n_requests, duration, top_k, timeout, warmup))
+    report["url"] = url
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
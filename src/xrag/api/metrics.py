@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.memory import get_memory_tracker, rss_bytes
+from ..utils.tracing import Tracer
+
+# Prometheus 文本格式的 /metrics：请求计数与进行中的请求数由 ASGI 中间件记录，
+# 各阶段耗时直方图、LLM token 数和缓存命中率来自 utils.tracing 的 Tracer，
+# 在抓取时才拼接文本，请求路径上只有加锁计数的开销
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestMetrics:
+    """HTTP request counters keyed by (method, path, status)."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.counts: Dict[Tuple[str, str, int], int] = {}
+        self.latency_sum: Dict[Tuple[str, str], float] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def begin(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, method: str, path: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            key = (method, path, status)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.latency_sum[(method, path)] = self.latency_sum.get((method, path), 0.0) + seconds
+
+    def snapshot(self):
+        with self._lock:
+            return self.in_flight, dict(self.counts), dict(self.latency_sum)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware counting HTTP requests; only routes in ``paths`` get their own label."""
+
+    def __init__(self, app, metrics: RequestMetrics, paths=("/query", "/health", "/metrics")):
+        self.app = app
+        self.metrics = metrics
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.begin()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.end(scope["method"], path, status, time.perf_counter() - start)
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Exposition:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help_text: str, samples) -> None:
+        """samples: iterable of (suffix, labels dict, value)"""
+        samples = list(samples)
+        if not samples:
+            return
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            self.lines.append(f"{name}{suffix}{_labels(**labels)} {_fmt(value)}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def cache_stats() -> Dict[str, Tuple[int, int]]:
+    """(hits, misses) of the in-process caches that exist in this process."""
+    from ..process import query_cache, transform_cache
+    from ..eval import judge_cache
+    from ..utils import get_model_registry
+
+    stats = {}
+    for name, cache in (("query", query_cache._query_cache),
+                        ("query_transform", transform_cache._transform_cache),
+                        ("judge", judge_cache._judge_cache)):
+        if cache is not None:
+            stats[name] = (cache.hits, cache.misses)
+    from ..retrievers import cache as retrieval_cache
+
+    if retrieval_cache._retrieval_cache is not None:
+        stats["retrieval"] = (retrieval_cache._retrieval_cache.hits, retrieval_cache._retrieval_cache.misses)
+    for key, scorer in get_model_registry().loaded_models("cross-encoder:"):
+        hits, misses = stats.get("rerank", (0, 0))
+        stats["rerank"] = (hits + scorer.cache_hits, misses + scorer.cache_misses)
+    return stats
+
+
+def _node_count(index) -> Optional[int]:
+    # 只数 id，不反序列化 docstore 中的节点
+    nodes_dict = getattr(getattr(index, "index_struct", None), "nodes_dict", None)
+    if nodes_dict is not None:
+        return len(nodes_dict)
+    docstore = getattr(index, "docstore", None)
+    kvstore = getattr(docstore, "_kvstore", None)
+    if kvstore is not None:
+        return len(kvstore.get_all(collection=docstore._node_collection))
+    return None
+
+
+def index_size(index, persist_dir: Optional[str] = None) -> Dict[str, float]:
+    size = {}
+    if index is not None:
+        nodes = _node_count(index)
+        if nodes is not None:
+            size["nodes"] = nodes
+        vector_store = getattr(index, "vector_store", None)
+        if vector_store is not None and hasattr(vector_store, "nbytes"):
+            size["vector_bytes"] = vector_store.nbytes()
+    if persist_dir and os.path.isdir(persist_dir):
+        size["disk_bytes"] = sum(os.path.getsize(os.path.join(root, f))
+                                 for root, _, files in os.walk(persist_dir) for f in files)
+    return size
+
+
+class IndexSizeGauge:
+    """
+    Index size computed once and cached between scrapes.
+
+    A scrape never walks the index or the persist directory: once the cached
+    value is older than ``max_age_s`` it is recomputed in a background thread
+    and the scrape returns the previous value.
+    """
+
+    def __init__(self, max_age_s: float = 300.0):
+        self.max_age_s = max_age_s
+        self.size: Dict[str, float] = {}
+        self.updated = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def refresh(self, index, persist_dir: Optional[str] = None) -> Dict[str, float]:
+        size = index_size(index, persist_dir)
+        with self._lock:
+            self.size, self.updated, self._refreshing = size, time.monotonic(), False
+        return size
+
+    def get(self, index, persist_dir: Optional[str] = None) -> Dict[str, float]:
+        with self._lock:
+            size = self.size
+            stale = time.monotonic() - self.updated > self.max_age_s and not self._refreshing
+            if stale:
+                self._refreshing = True
+        if stale:
+            threading.Thread(target=self._refresh_quietly, args=(index, persist_dir), name="xrag-index-size",
+                             daemon=True).start()
+        return size
+
+    def _refresh_quietly(self, index, persist_dir) -> None:
+        try:
+            self.refresh(index, persist_dir)
+        except Exception:
+            with self._lock:
+                self._refreshing = False
+            raise
+
+
+def render_metrics(request_metrics: RequestMetrics, tracer: Tracer, size: Optional[Dict[str, float]] = None) -> str:
+    """
+    Render all XRAG metrics in the Prometheus text exposition format.
+
+    ``size`` is the (cached) result of ``index_size``; it is not computed here.
+    """
+    out = _Exposition()
+    in_flight, counts, latency_sum = request_metrics.snapshot()
+    out.metric("xrag_http_requests_total", "counter", "HTTP requests handled.",
+               (("", {"method": m, "path": p, "status": s}, v) for (m, p, s), v in sorted(counts.items())))
+    out.metric("xrag_http_requests_in_flight", "gauge", "HTTP requests being handled.", [("", {}, in_flight)])
+    out.metric("xrag_http_request_seconds_total", "counter", "Total time spent handling HTTP requests.",
+               (("", {"method": m, "path": p}, v) for (m, p), v in sorted(latency_sum.items())))
+    out.metric("xrag_process_start_time_seconds", "gauge", "Start time of the API process.",
+               [("", {}, request_metrics.started)])
+    out.metric("xrag_process_resident_memory_bytes", "gauge", "Resident set size of the API process.",
+               [("", {}, rss_bytes())])
+    tracker = get_memory_tracker()
+    if tracker is not None:
+        out.metric("xrag_phase_peak_resident_memory_bytes", "gauge", "Peak RSS seen during each pipeline phase.",
+                   (("", {"phase": phase}, peak) for phase, peak in tracker.peaks().items()))
+        out.metric("xrag_memory_budget_events_total", "counter", "Times RSS exceeded the soft memory budget.",
+                   [("", {}, tracker.budget_events)])
+
+    histograms = tracer.histograms()
+    samples = []
+    for stage, hist in histograms.items():
+        for upper_ms, count in hist["buckets"]:
+            le = "+Inf" if upper_ms == float("inf") else _fmt(upper_ms / 1000)
+            samples.append(("_bucket", {"stage": stage, "le": le}, count))
+        samples.append(("_sum", {"stage": stage}, hist["sum_ms"] / 1000))
+        samples.append(("_count", {"stage": stage}, hist["count"]))
+    out.metric("xrag_stage_duration_seconds", "histogram",
+               "Latency of pipeline stages (retrieval, postprocess, synthesis, llm, ...).", samples)
+
+    # token 数在父 span 上会累加，只统计 llm 阶段避免重复
+    llm = histograms.get("llm")
+    if llm is not None:
+        out.metric("xrag_llm_tokens_total", "counter", "LLM tokens processed; rate() gives the token throughput.",
+                   [("", {"type": "prompt"}, llm["prompt_tokens"]),
+                    ("", {"type": "completion"}, llm["completion_tokens"])])
+
+    caches = cache_stats()
+    out.metric("xrag_cache_hits_total", "counter", "Cache hits.",
+               (("", {"cache": name}, hits) for name, (hits, _) in sorted(caches.items())))
+    out.metric("xrag_cache_misses_total", "counter", "Cache misses.",
+               (("", {"cache": name}, misses) for name, (_, misses) in sorted(caches.items())))
+    out.metric("xrag_cache_hit_ratio", "gauge", "Cache hit ratio since start.",
+               (("", {"cache": name}, hits / (hits + misses) if hits + misses else 0.0)
+                for name, (hits, misses) in sorted(caches.items())))
+
+    size = size or {}
+    out.metric("xrag_index_nodes", "gauge", "Nodes in the index docstore.",
+               [("", {}, size["nodes"])] if "nodes" in size else [])
+    out.metric("xrag_index_vector_bytes", "gauge", "Memory held by the compressed vectors.",
+               [("", {}, size["vector_bytes"])] if "vector_bytes" in size else [])
+    out.metric("xrag_index_disk_bytes", "gauge", "Size of the persisted index on disk.",
+               [("", {}, size["disk_bytes"])] if "disk_bytes" in size else [])
+    return out.text()
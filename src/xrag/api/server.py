@@ -1,4 +1,6 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
@@ -7,12 +9,20 @@ from ..launcher.launch import build_index, build_query_engine
 from ..config import Config
 from ..process.query_transform import transform_and_query_async
 from ..data.qa_loader import get_qa_dataset, get_dataset
+from ..utils.memory import memory_phase, report_memory
+from ..utils.profiling import PROFILE_MODES, capture_profile, dump_profiles, get_profiler, profile_phase
+from ..utils.tracing import get_tracer
+from .metrics import CONTENT_TYPE, IndexSizeGauge, MetricsMiddleware, RequestMetrics, render_metrics
 
 app = FastAPI(
     title="XRAG API",
     description="RAG (Retrieval-Augmented Generation) API Service",
     version="0.1.0"
 )
+request_metrics = RequestMetrics()
+# 索引大小在启动时计算一次，之后只在后台刷新
+index_size_gauge = IndexSizeGauge()
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
 
 class QueryRequest(BaseModel):
     query: str
@@ -23,9 +33,12 @@ class QueryResponse(BaseModel):
     sources: List[dict]
 
 query_engine = None
+index = None
 config = None
 json_path = ''
 dataset_folder = ''
+# 同一时间只采集一个线上 profile
+profile_lock = asyncio.Lock()
 
 def init_app(_json_path: str = '', _dataset_folder: str = ''):
     global json_path, dataset_folder
@@ -35,7 +48,7 @@ def init_app(_json_path: str = '', _dataset_folder: str = ''):
 
 @app.on_event("startup")
 async def startup_event():
-    global query_engine, config
+    global query_engine, index, config
     config = Config()
     
     # 如果提供了 json_path，设置为自定义数据集
@@ -48,13 +61,18 @@ async def startup_event():
         config.dataset_path = dataset_folder
         
     # 获取数据集并构建索引
-    if config.dataset == 'custom':
-        documents = get_qa_dataset(config.dataset, config.dataset_path)['documents']
-    elif config.dataset == 'folder':
-        documents = get_dataset(config.dataset_path)
-    else:
-        documents = get_qa_dataset(config.dataset)['documents']
-    index, hierarchical_storage_context = build_index(documents)
+    with memory_phase("dataset_load"):
+        if config.dataset == 'custom':
+            documents = get_qa_dataset(config.dataset, config.dataset_path)['documents']
+        elif config.dataset == 'folder':
+            documents = get_dataset(config.dataset_path)
+        else:
+            documents = get_qa_dataset(config.dataset)['documents']
+    with profile_phase("index_build"):
+        index, hierarchical_storage_context = build_index(documents)
+    report_memory()
+    dump_profiles()
+    index_size_gauge.refresh(index, getattr(config, "persist_dir", None))
     # 构建查询引擎，使用异步模式
     query_engine = build_query_engine(index, hierarchical_storage_context, use_async=True)
 
@@ -83,6 +101,30 @@ async def query(request: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的运行指标"""
+    text = render_metrics(request_metrics, get_tracer(),
+                          index_size_gauge.get(index, getattr(config, "persist_dir", None)))
+    return Response(content=text, media_type=CONTENT_TYPE)
+
+@app.post("/admin/profile")
+async def admin_profile(seconds: float = 10.0, mode: str = "sampling"):
+    """采集接下来 seconds 秒线上流量的 profile，仅在以 --profile 启动时可用"""
+    profiler = get_profiler()
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled, start the server with --profile")
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {PROFILE_MODES}")
+    if not 0 < seconds <= 600:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 600]")
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    async with profile_lock:
+        path, summary = await capture_profile(seconds, mode, profiler.output_dir, profiler.top_n,
+                                              profiler.interval_ms)
+    return {"mode": mode, "seconds": seconds, "path": path, "summary": summary}
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "engine_status": "initialized" if query_engine else "not_initialized"}
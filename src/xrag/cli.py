@@ -15,6 +15,10 @@ USAGE = (
     + "\n"
     + "| Usage:                                                             |\n"
     + "|   xrag-cli run -h: launch an eval experiment       |\n"
+    + "|   xrag-cli run|bench|api --profile [--profile_mode sampling]: write per-phase profiles to profile_dir |\n"
+    + "|   xrag-cli score -f <run_file> [--metrics ...]: score a saved run file |\n"
+    + "|   xrag-cli bench [--corpus synthetic sample] [-o <output>]: benchmark indexing, retrieval and queries |\n"
+    + "|   xrag-cli loadtest --url <url> [--rate <rps> | --concurrency <n>]: load test the API server |\n"
     + "|   xrag-cli webui: launch XRAGBoard                        |\n"
     + "|   xrag-cli version: show version info                      |\n"
     + "|   xrag-cli generate -i <input_file> -o <output_file> -n <num_questions> -s <sentence_length>: generate QA pairs from a folder |\n"
@@ -42,6 +46,23 @@ class Command(str, Enum):
     GENERATE = "generate"
     HELP = "help"
     API = "api"
+    SCORE = "score"
+    BENCH = "bench"
+    LOADTEST = "loadtest"
+
+def add_profile_arguments(subparser):
+    subparser.add_argument('--profile', action='store_true',
+                           help='Profile index build, query and evaluation phases (see profile_* in config.toml)')
+    subparser.add_argument('--profile_mode', choices=['cprofile', 'sampling'], default='',
+                           help='cProfile of the calling thread, or a sampling profiler over all threads')
+
+def enable_profiling(args):
+    if not args.profile:
+        return
+    config = Config()
+    config.profile = True
+    if args.profile_mode:
+        config.profile_mode = args.profile_mode
 
 def main():
     # Initialize the argument parser
@@ -54,6 +75,44 @@ def main():
     run_parser = subparsers.add_parser('run', help='Run the application')
     run_parser.add_argument('--override', nargs='*', help='Override config values (e.g., --override key1=value1 key2=value2)')
     run_parser.add_argument('-c', '--custom_dataset', default='', type=str, help='Custom dataset json path')
+    run_parser.add_argument('--run_file', default='', type=str, help='Record responses to this run file (.jsonl/.parquet) before scoring')
+    run_parser.add_argument('--record_only', action='store_true', help='Only record the run file, do not score it')
+    add_profile_arguments(run_parser)
+
+    # 'score' command
+    score_parser = subparsers.add_parser('score', help='Score a saved run file')
+    score_parser.add_argument('-f', '--run_file', type=str, required=True, help='Run file written by run --run_file')
+    score_parser.add_argument('-m', '--metrics', nargs='*', help='Metrics to compute (default: metrics in config)')
+    score_parser.add_argument('-j', '--concurrency', type=int, default=0, help='Questions scored concurrently')
+
+    # 'bench' command
+    bench_parser = subparsers.add_parser('bench', help='Benchmark indexing, retrieval and end-to-end query latency')
+    bench_parser.add_argument('--corpus', nargs='*', default=['synthetic', 'sample'],
+                              help='Corpora: synthetic, sample (examples/data) or a document folder')
+    bench_parser.add_argument('--n_docs', type=int, default=1000, help='Documents in the synthetic corpus')
+    bench_parser.add_argument('--doc_words', type=int, default=200, help='Words per synthetic document')
+    bench_parser.add_argument('--n_queries', type=int, default=200, help='Timed queries per retriever')
+    bench_parser.add_argument('--warmup', type=int, default=10, help='Untimed warmup queries')
+    bench_parser.add_argument('--e2e_queries', type=int, default=50, help='Timed end-to-end queries (stub LLM)')
+    bench_parser.add_argument('--retrievers', nargs='*', help='Retriever types (default: BM25 Vector Hybrid)')
+    bench_parser.add_argument('--embeddings', type=str, default='', help='Embedding model, stub:<dim> for no model')
+    bench_parser.add_argument('--seed', type=int, default=42, help='Random seed of the synthetic corpus')
+    bench_parser.add_argument('-o', '--output', type=str, default='', help='Result JSON path')
+    add_profile_arguments(bench_parser)
+
+    # 'loadtest' command
+    loadtest_parser = subparsers.add_parser('loadtest', help='Replay dataset questions against a running API server')
+    loadtest_parser.add_argument('--url', type=str, default='http://127.0.0.1:8000/query', help='/query endpoint URL')
+    loadtest_parser.add_argument('-f', '--questions', type=str, default='',
+                                 help='QA json, run file or text file with one question per line (default: config dataset)')
+    loadtest_parser.add_argument('--rate', type=float, default=0.0, help='Requests per second (open loop)')
+    loadtest_parser.add_argument('--concurrency', type=int, default=1, help='Concurrent requests when --rate is 0')
+    loadtest_parser.add_argument('-n', '--requests', type=int, default=0, help='Number of requests (questions are reused)')
+    loadtest_parser.add_argument('-d', '--duration', type=float, default=0.0, help='Test duration in seconds')
+    loadtest_parser.add_argument('--top_k', type=int, default=3, help='top_k sent with each query')
+    loadtest_parser.add_argument('--timeout', type=float, default=120.0, help='Request timeout in seconds')
+    loadtest_parser.add_argument('--warmup', type=int, default=0, help='Untimed warmup requests')
+    loadtest_parser.add_argument('-o', '--output', type=str, default='', help='Report JSON path')
 
     # Other commands
     subparsers.add_parser('webui', help='Run the web UI')
@@ -66,12 +125,16 @@ def main():
     api_parser.add_argument('--port', type=int, default=8000, help='API server port')
     api_parser.add_argument('--json_path', type=str, default='', help='JSON file path')
     api_parser.add_argument('--dataset_folder', type=str, default='', help='Dataset folder path')
+    add_profile_arguments(api_parser)
 
     generate_parser = subparsers.add_parser('generate', help='Generate QA pairs')
     generate_parser.add_argument('-i', '--input', type=str, help='Input file path')
     generate_parser.add_argument('-o', '--output', type=str, help='Output file path')
     generate_parser.add_argument('-n', '--num', type=int, help='Number of questions per file', default=3)
     generate_parser.add_argument('-s', '--sentence_length', type=int, help='Sentence length, -1 means no split', default=-1)
+    generate_parser.add_argument('-c', '--concurrency', type=int, help='Number of concurrent LLM requests', default=1)
+    generate_parser.add_argument('-r', '--max_retries', type=int, help='Retries when the LLM returns invalid JSON', default=2)
+    generate_parser.add_argument('--no_resume', action='store_true', help='Ignore previously generated partial results')
     # Parse the arguments
     args = parser.parse_args()
 
@@ -91,10 +154,14 @@ def main():
             # Update the Config instance
             config = Config()
             config.update_config(config_overrides)
+            enable_profiling(args)
+            if args.record_only and not args.run_file:
+                logger.error("--record_only requires --run_file")
+                sys.exit(1)
             if args.custom_dataset:
-                run(custom_dataset=args.custom_dataset)
+                run(custom_dataset=args.custom_dataset, run_file=args.run_file, record_only=args.record_only)
             else:
-                run()
+                run(run_file=args.run_file, record_only=args.record_only)
         elif args.command == Command.WEBUI:
             run_web_ui()
         elif args.command == Command.VER:
@@ -102,9 +169,26 @@ def main():
         elif args.command == Command.HELP or args.command is None:
             parser.print_help()
         elif args.command == Command.GENERATE:
-            generate_qa_from_folder(args.input, args.output, args.num, args.sentence_length)
+            generate_qa_from_folder(args.input, args.output, args.num, args.sentence_length,
+                                    concurrency=args.concurrency, max_retries=args.max_retries,
+                                    resume=not args.no_resume)
+        elif args.command == Command.SCORE:
+            from .launcher import score_run
+            score_run(args.run_file, metrics=args.metrics or None, concurrency=args.concurrency or None)
+        elif args.command == Command.BENCH:
+            from .launcher.bench import run_bench
+            enable_profiling(args)
+            run_bench(corpora=args.corpus, n_docs=args.n_docs, doc_words=args.doc_words, n_queries=args.n_queries,
+                      warmup=args.warmup, e2e_queries=args.e2e_queries, retrievers=args.retrievers,
+                      embeddings=args.embeddings or None, seed=args.seed, output=args.output)
+        elif args.command == Command.LOADTEST:
+            from .api.loadtest import run_loadtest
+            run_loadtest(url=args.url, questions_path=args.questions, rate=args.rate, concurrency=args.concurrency,
+                         n_requests=args.requests, duration=args.duration, top_k=args.top_k, timeout=args.timeout,
+                         warmup=args.warmup, output=args.output)
         elif args.command == Command.API:
             from .api.server import run_api_server
+            enable_profiling(args)
             run_api_server(host=args.host, port=args.port, json_path=args.json_path, dataset_folder=args.dataset_folder)
         else:
             logger.error(f"Unknown command: {args.command}")
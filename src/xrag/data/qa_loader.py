@@ -1,5 +1,8 @@
+import asyncio
+import hashlib
 import json
 import os
+import time
 os.environ['HF_ENDPOINT']='https://hf-mirror.com'
 from datasets import load_dataset
 import random
@@ -814,17 +817,135 @@ def get_qa_dataset(dataset_name:str,files=None):
         golden_sources=golden_sources,
         dataset=dataset)
 
-def generate_qa_from_folder(folder_path: str, output_file: str, num_questions_per_file: int = 3, sentence_length: int = -1):
+QA_GENERATION_PROMPT = """You are a helpful AI assistant that generates high-quality question-answer pairs from given text.
+            Please generate {num_questions} different question-answer pairs based on the following text.
+            The questions should:
+            1. Be diverse and cover different aspects of the content
+            2. Include both factual and analytical questions
+            3. Be clear and specific
+            4. Have answers that can be found in the text
+
+            TEXT:
+            {text}
+
+            Please format your response as a valid JSON array of objects, where each object has 'question' and 'answer' fields.
+            Example format:
+            [
+                {{"question": "What is X?", "answer": "X is Y."}},
+                {{"question": "How does Z work?", "answer": "Z works by..."}}
+            ]
+
+            Generate only the JSON array, no other text."""
+
+
+def _truncate_text(text, max_length=5000):
+    # 限制文本长度并确保完整句子
+    text = text[:max_length]
+    last_period = text.rfind('.')
+    if last_period > 0:
+        text = text[:last_period + 1]
+    return text
+
+
+def _doc_key(doc, text):
+    """文档的稳定标识，用于断点续跑时跳过已生成的文档"""
+    source = doc.metadata.get('file_path', '')
+    return hashlib.sha1((source + '\n' + text).encode('utf-8')).hexdigest()
+
+
+def _parse_qa_response(response_text, doc, text):
+    # 清理响应文本，确保它是有效的 JSON
+    response_text = response_text.strip()
+    if not response_text.startswith('['):
+        response_text = response_text[response_text.find('['):]
+    if not response_text.endswith(']'):
+        response_text = response_text[:response_text.rfind(']')+1]
+
+    qa_list = json.loads(response_text)
+    if not isinstance(qa_list, list):
+        raise json.JSONDecodeError("LLM response is not a JSON array", response_text, 0)
+
+    # 验证生成的问答对的格式
+    valid_qa_list = []
+    for qa in qa_list:
+        if isinstance(qa, dict) and 'question' in qa and 'answer' in qa:
+            qa['file_paths'] = doc.metadata.get('file_path', '')
+            qa['source_text'] = text
+            valid_qa_list.append(qa)
+    return valid_qa_list
+
+
+def _load_progress(progress_file):
+    """读取增量输出文件，返回 {doc_key: qa_pairs}，忽略崩溃时写了一半的最后一行"""
+    done = {}
+    if not os.path.exists(progress_file):
+        return done
+    with open(progress_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping truncated record in {progress_file}")
+                continue
+            done[record['doc_key']] = record['qa_pairs']
+    return done
+
+
+def _generate_for_doc(llm, doc, text, prompt, max_retries, retry_backoff):
+    file_path = doc.metadata.get('file_path', '')
+    for attempt in range(max_retries + 1):
+        response = llm.complete(prompt)
+        try:
+            return _parse_qa_response(response.text, doc, text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Error parsing LLM response for file {file_path} "
+                           f"(attempt {attempt + 1}/{max_retries + 1}): {str(e)}")
+            logger.warning(f"Response text: {response.text}")
+            if attempt < max_retries:
+                time.sleep(retry_backoff * (2 ** attempt))
+    return None
+
+
+async def _agenerate_for_doc(llm, doc, text, prompt, max_retries, retry_backoff, semaphore):
+    file_path = doc.metadata.get('file_path', '')
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            response = await llm.acomplete(prompt)
+        try:
+            return _parse_qa_response(response.text, doc, text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Error parsing LLM response for file {file_path} "
+                           f"(attempt {attempt + 1}/{max_retries + 1}): {str(e)}")
+            logger.warning(f"Response text: {response.text}")
+            if attempt < max_retries:
+                await asyncio.sleep(retry_backoff * (2 ** attempt))
+    return None
+
+
+def generate_qa_from_folder(folder_path: str, output_file: str, num_questions_per_file: int = 3, sentence_length: int = -1,
+                            concurrency: int = 1, max_retries: int = 2, retry_backoff: float = 1.0, resume: bool = True):
     """
     从文件夹中读取所有文件，使用 LLM 生成问答对，并保存为指定格式的 JSON 文件
-    
+
+    每个文档的结果会立即追加写入 ``<output_file>.partial.jsonl``，进程崩溃后重新运行时
+    会跳过已经生成过的文档，最终再汇总写出 ``output_file``。
+
     Args:
         folder_path: 包含文档的文件夹路径
         output_file: 输出的 JSON 文件路径
         num_questions_per_file: 每个文件生成的问题数量
+        sentence_length: 切分长度，-1 表示按文件为单位
+        concurrency: 并发请求数，大于 1 时使用 ``acomplete`` 异步并发生成
+        max_retries: LLM 返回无法解析的 JSON 时的重试次数
+        retry_backoff: 重试的初始等待秒数，之后按指数退避
+        resume: 是否复用增量文件中已生成的结果
     """
     # 转换为绝对路径
     output_file = os.path.abspath(output_file)
+    progress_file = output_file + '.partial.jsonl'
 
     docs = get_dataset(folder_path)
 
@@ -841,85 +962,76 @@ def generate_qa_from_folder(folder_path: str, output_file: str, num_questions_pe
 
     logger.info(f"Successfully loaded {len(docs)} documents from {folder_path}")
 
+    # 确保输出目录存在
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    if not resume and os.path.exists(progress_file):
+        os.remove(progress_file)
+    done = _load_progress(progress_file)
+
+    # 构建待生成的任务，跳过已完成的文档
+    jobs = []
+    doc_keys = []
+    for doc in docs:
+        text = _truncate_text(doc.text)
+        key = _doc_key(doc, text)
+        doc_keys.append(key)
+        if key in done:
+            continue
+        # 构建提示
+        prompt = QA_GENERATION_PROMPT.format(num_questions=num_questions_per_file, text=text)
+        jobs.append((key, doc, text, prompt))
+    if done:
+        logger.info(f"Resuming: {len(docs) - len(jobs)} documents already generated, {len(jobs)} remaining")
+
     # 初始化 LLM
-    llm = get_llm(cfg.llm)
+    llm = get_llm(cfg.llm) if jobs else None
+
+    with open(progress_file, 'a', encoding='utf-8') as progress:
+        def record(key, doc, qa_list):
+            if qa_list is None:
+                return
+            done[key] = qa_list
+            progress.write(json.dumps({'doc_key': key, 'qa_pairs': qa_list}, ensure_ascii=False) + '\n')
+            progress.flush()
+            logger.info(f"Generated {len(qa_list)} QA pairs for {doc.metadata.get('file_path', '')}")
+
+        if concurrency > 1:
+            async def run_all():
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def run_one(key, doc, text, prompt):
+                    try:
+                        qa_list = await _agenerate_for_doc(llm, doc, text, prompt, max_retries, retry_backoff, semaphore)
+                    except Exception as e:
+                        logger.warning(f"Error generating QA pairs for file {doc.metadata.get('file_path', '')}: {str(e)}")
+                        return
+                    record(key, doc, qa_list)
+
+                tasks = [asyncio.ensure_future(run_one(*job)) for job in jobs]
+                for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Generating QA pairs"):
+                    await task
+
+            asyncio.run(run_all())
+        else:
+            # 为每个文档生成问答对
+            for key, doc, text, prompt in tqdm(jobs, desc="Generating QA pairs"):
+                try:
+                    qa_list = _generate_for_doc(llm, doc, text, prompt, max_retries, retry_backoff)
+                except Exception as e:
+                    logger.warning(f"Error generating QA pairs for file {doc.metadata.get('file_path', '')}: {str(e)}")
+                    continue
+                record(key, doc, qa_list)
 
+    # 按文档原始顺序汇总
     qa_pairs = []
-    # 为每个文档生成问答对
-    for doc in tqdm(docs, desc="Generating QA pairs"):
-        try:
-            # 限制文本长度并确保完整句子
-            text = doc.text[:5000]
-            last_period = text.rfind('.')
-            if last_period > 0:
-                text = text[:last_period + 1]
-            
-            # 构建提示
-            prompt = """You are a helpful AI assistant that generates high-quality question-answer pairs from given text.
-            Please generate {num_questions} different question-answer pairs based on the following text.
-            The questions should:
-            1. Be diverse and cover different aspects of the content
-            2. Include both factual and analytical questions
-            3. Be clear and specific
-            4. Have answers that can be found in the text
-
-            TEXT:
-            {text}
-
-            Please format your response as a valid JSON array of objects, where each object has 'question' and 'answer' fields.
-            Example format:
-            [
-                {{"question": "What is X?", "answer": "X is Y."}},
-                {{"question": "How does Z work?", "answer": "Z works by..."}}
-            ]
-
-            Generate only the JSON array, no other text.""".format(
-                num_questions=num_questions_per_file,
-                text=text
-            )
-            
-            # 获取 LLM 响应
-            response = llm.complete(prompt)
-            
-            # 解析响应中的 JSON
-            try:
-                # 清理响应文本，确保它是有效的 JSON
-                response_text = response.text.strip()
-                if not response_text.startswith('['):
-                    response_text = response_text[response_text.find('['):]
-                if not response_text.endswith(']'):
-                    response_text = response_text[:response_text.rfind(']')+1]
-                
-                qa_list = json.loads(response_text)
-                
-                # 验证生成的问答对的格式
-                valid_qa_list = []
-                for qa in qa_list:
-                    if isinstance(qa, dict) and 'question' in qa and 'answer' in qa:
-                        qa['file_paths'] = doc.metadata.get('file_path', '')
-                        qa['source_text'] = text
-                        valid_qa_list.append(qa)
-                    
-                qa_pairs.extend(valid_qa_list)
-                logger.info(f"Generated {len(valid_qa_list)} QA pairs for {doc.metadata.get('file_path', '')}")
-                
-            except json.JSONDecodeError as e:
-                logger.warning(f"Error parsing LLM response for file {doc.metadata.get('file_path', '')}: {str(e)}")
-                logger.warning(f"Response text: {response.text}")
-                continue
-                
-        except Exception as e:
-            logger.warning(f"Error generating QA pairs for file {doc.metadata.get('file_path', '')}: {str(e)}")
-            continue
+    for key in doc_keys:
+        qa_pairs.extend(done.get(key, []))
 
     if len(qa_pairs) == 0:
         raise Exception("No QA pairs were generated. Please check the error messages above.")
 
     # 保存生成的问答对到文件
     try:
-        # 确保输出目录存在
-        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
-        
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(qa_pairs, f, ensure_ascii=False, indent=2)
         logger.info(f"Successfully generated {len(qa_pairs)} QA pairs and saved to {output_file}")
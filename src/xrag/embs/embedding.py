@@ -1,12 +1,54 @@
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 # from llama_index.legacy.embeddings import HuggingFaceEmbedding
+from ..utils import get_model_registry
+from .stub import get_stub_embedding, is_stub_embedding
 
-def get_embedding(name,embed_batch_size=16):
-    return HuggingFaceEmbedding(
-        model_name=name,
-        embed_batch_size=embed_batch_size,
-        # cache_folder="./embedding_model"
+
+def _with_batch_size(embed_model, embed_batch_size):
+    # the registry instance is shared: each caller gets a shallow copy with its own batch size,
+    # the weights (private attributes) are not copied
+    return embed_model.model_copy(update={"embed_batch_size": embed_batch_size})
+
+
+def get_embedding(name,embed_batch_size=16,device=None,backend="torch",onnx_cache_dir="onnx_models"):
+    # backend: torch (fp32), int8 (dynamic quantization on CPU), onnx (ONNX Runtime on CPU)
+    if is_stub_embedding(name):
+        # stub / stub:<dim>: deterministic hashed vectors, no model is loaded
+        return get_stub_embedding(name, embed_batch_size)
+    if backend == "int8":
+        from .quantized import quantize_embedding_int8
+        embed_model = get_model_registry().get(
+            name,
+            lambda: quantize_embedding_int8(HuggingFaceEmbedding(model_name=name, embed_batch_size=embed_batch_size,
+                                                                 device="cpu")),
+            dtype="int8",
+            device="cpu",
+        )
+        return _with_batch_size(embed_model, embed_batch_size)
+    elif backend == "onnx":
+        from .quantized import OnnxEmbedding, export_onnx_model
+        embed_model = get_model_registry().get(
+            name,
+            lambda: OnnxEmbedding(model_dir=export_onnx_model(name, onnx_cache_dir), embed_batch_size=embed_batch_size),
+            dtype="onnx",
+            device="cpu",
+        )
+        return _with_batch_size(embed_model, embed_batch_size)
+    elif backend != "torch":
+        raise ValueError(f"embedding backend {backend} not supported.")
+    # the same embedding weights are shared by indexing, retrieval and evaluation
+    embed_model = get_model_registry().get(
+        name,
+        lambda: HuggingFaceEmbedding(
+            model_name=name,
+            embed_batch_size=embed_batch_size,
+            device=device,
+            # cache_folder="./embedding_model"
+        ),
+        dtype="float32",
+        device=device,
     )
+    return _with_batch_size(embed_model, embed_batch_size)
 
 '''
 from langchain.embeddings.huggingface import HuggingFaceEmbeddings
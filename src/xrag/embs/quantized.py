@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional, List, Any
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from ..utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# pip install onnxruntime, or examinationrag[onnx] (only needed for embedding_backend = "onnx")
+
+
+def quantize_embedding_int8(embed_model):
+    """
+    Apply PyTorch dynamic int8 quantization to the Linear layers of a HuggingFaceEmbedding.
+
+    The weights are quantized once, activations are quantized on the fly, so no
+    calibration data is needed. Only meaningful on CPU.
+    """
+    import torch
+
+    st_model = embed_model._model
+    st_model.to("cpu")
+    torch.quantization.quantize_dynamic(st_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return embed_model
+
+
+def _onnx_model_dir(model_name, cache_dir):
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+def export_onnx_model(model_name: str, cache_dir: str = "onnx_models", max_length: int = 512) -> str:
+    """
+    Export a sentence-transformers model to ONNX once and cache it on disk.
+
+    Args:
+        model_name: HuggingFace model name, e.g. BAAI/bge-large-en-v1.5
+        cache_dir: Root directory for exported models
+        max_length: Maximum sequence length used when encoding
+
+    Returns:
+        The directory containing model.onnx, the tokenizer and pooling metadata
+    """
+    model_dir = _onnx_model_dir(model_name, cache_dir)
+    if all(os.path.exists(os.path.join(model_dir, f)) for f in ("model.onnx", "xrag_onnx.json")):
+        return model_dir
+
+    logger.info(f"Exporting {model_name} to ONNX at {model_dir}")
+    # export into a temporary directory and rename it into place, so an interrupted
+    # export never leaves a partial model behind
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(model_dir) + ".", dir=cache_dir)
+    try:
+        _export_onnx_model(model_name, tmp_dir, max_length)
+        if os.path.exists(model_dir):
+            shutil.rmtree(model_dir)
+        os.replace(tmp_dir, model_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return model_dir
+
+
+def _export_onnx_model(model_name: str, model_dir: str, max_length: int) -> None:
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    onnx_path = os.path.join(model_dir, "model.onnx")
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    pooling_mode = "cls"
+    normalize = False
+    for module in st_model:
+        if isinstance(module, Pooling):
+            pooling_mode = module.get_pooling_mode_str()
+        elif isinstance(module, Normalize):
+            normalize = True
+
+    dummy = tokenizer(["XRAG onnx export"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(dummy[n] for n in input_names),
+            onnx_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, "xrag_onnx.json"), "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "pooling_mode": pooling_mode, "normalize": normalize,
+                   "input_names": input_names, "max_length": min(max_length, st_model.max_seq_length or max_length)}, f)
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """Embedding model running an exported sentence-transformers model with ONNX Runtime on CPU."""
+    model_dir: str = Field(description="Directory produced by export_onnx_model.")
+    pooling_mode: str = Field(default="cls", description="cls or mean pooling.")
+    normalize: bool = Field(default=True, description="L2 normalize the embeddings.")
+    max_length: int = Field(default=512, description="Maximum number of tokens per text.")
+    num_threads: int = Field(default=0, description="ONNX Runtime intra-op threads, 0 lets ORT decide.")
+
+    _session: Optional[Any] = PrivateAttr()
+    _tokenizer: Optional[Any] = PrivateAttr()
+    _input_names: List[str] = PrivateAttr()
+
+    def __init__(
+        self,
+        model_dir: str,
+        num_threads: int = 0,
+        **kwargs: Any,
+    ) -> None:
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, "xrag_onnx.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        super().__init__(
+            model_dir=model_dir,
+            model_name=meta["model_name"],
+            pooling_mode=meta["pooling_mode"],
+            normalize=meta["normalize"],
+            max_length=meta["max_length"],
+            num_threads=num_threads,
+            **kwargs,
+        )
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self._session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                             providers=["CPUExecutionProvider"])
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = meta["input_names"]
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        encoded = self._tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                  return_tensors="np")
+        feeds = {n: encoded[n].astype(np.int64) for n in self._input_names}
+        hidden = self._session.run(["last_hidden_state"], feeds)[0]
+        if self.pooling_mode == "mean":
+            mask = encoded["attention_mask"][..., None].astype(hidden.dtype)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        else:
+            vectors = hidden[:, 0]
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        """Get query embedding."""
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        """The asynchronous version of _get_query_embedding."""
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        """Get text embedding."""
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Get text embeddings."""
+        return self._embed(texts)
+
+
+def check_embedding_accuracy(reference_model, candidate_model, texts: List[str], threshold: float = 0.98) -> dict:
+    """
+    Compare a quantized/ONNX embedder against the fp32 reference on sample texts.
+
+    Args:
+        reference_model: fp32 embedding model
+        candidate_model: Quantized or ONNX embedding model
+        texts: Sample texts to embed with both models
+        threshold: Minimum acceptable cosine similarity
+
+    Returns:
+        dict with mean and min cosine similarity, number of samples and whether the check passed
+    """
+    texts = [t for t in texts if t and t.strip()]
+    if not texts:
+        return {"samples": 0, "mean_cosine": None, "min_cosine": None, "passed": True}
+    ref = np.asarray(reference_model.get_text_embedding_batch(texts), dtype=np.float32)
+    cand = np.asarray(candidate_model.get_text_embedding_batch(texts), dtype=np.float32)
+    ref /= np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    cand /= np.clip(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12, None)
+    cosine = (ref * cand).sum(axis=1)
+    report = {
+        "samples": len(texts),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        "passed": bool(cosine.min() >= threshold),
+    }
+    if report["passed"]:
+        logger.info(f"Embedding accuracy check passed: {report}")
+    else:
+        logger.warning(f"Embedding accuracy check below threshold {threshold}: {report}")
+    return report
@@ -0,0 +1,97 @@
+"""
+Deterministic embedding stub for benchmarks, load tests and offline runs.
+
+Vectors are feature-hashed bags of words, so texts sharing words get similar
+vectors and retrieval still returns plausible nodes without any model.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+from typing import List
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class StubEmbedding(BaseEmbedding):
+    """
+    Hashed bag-of-words embedding with configurable latency.
+
+    Every call takes ``latency_ms + ms_per_text * len(texts)``.
+    """
+
+    dim: int = Field(default=384, description="Embedding dimension.")
+    latency_ms: float = Field(default=0.0, description="Fixed latency per call in milliseconds.")
+    ms_per_text: float = Field(default=0.0, description="Additional latency per embedded text in milliseconds.")
+    seed: int = Field(default=0, description="Changes the hash, and therefore every vector.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(f"{self.seed}:{token}".encode("utf-8"), digest_size=8).digest()
+            h = int.from_bytes(digest, "big")
+            vector[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def _delay_seconds(self, n: int) -> float:
+        return (self.latency_ms + self.ms_per_text * n) / 1000.0
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        delay = self._delay_seconds(len(texts))
+        if delay > 0:
+            time.sleep(delay)
+        return [self._vector(text) for text in texts]
+
+    async def _aembed(self, texts: List[str]) -> List[List[float]]:
+        delay = self._delay_seconds(len(texts))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return [self._vector(text) for text in texts]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._aembed([query]))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aembed([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed(texts)
+
+
+def is_stub_embedding(name: str) -> bool:
+    return name == "stub" or name.startswith("stub:")
+
+
+def get_stub_embedding(name: str, embed_batch_size: int = 16) -> StubEmbedding:
+    """``stub`` or ``stub:<dim>``; latency comes from ``config.toml``."""
+    from ..config import Config
+
+    cfg = Config()
+    dim = int(name.split(":", 1)[1]) if ":" in name else 384
+    return StubEmbedding(dim=dim, embed_batch_size=embed_batch_size,
+                         latency_ms=getattr(cfg, "stub_embedding_latency_ms", 0.0),
+                         ms_per_text=getattr(cfg, "stub_embedding_ms_per_text", 0.0),
+                         seed=getattr(cfg, "stub_seed", 0),
+                         model_name=name)
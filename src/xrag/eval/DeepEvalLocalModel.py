@@ -1,35 +1,102 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+
 import torch
 from llama_index.llms.huggingface import HuggingFaceLLM
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from deepeval.models.base_model import DeepEvalBaseLLM
 
 class DeepEvalLocalModel(DeepEvalBaseLLM):
+    """
+    DeepEval 的本地评测模型
+
+    本地模型只在构造时放到设备上一次；并发的 DeepEval 指标调用会进入同一个队列，
+    由一个工作线程按 batch_size 做 padding 后批量生成。tokenizer 为 "" 时 model 是
+    langchain 的 ChatOpenAI，直接调用 invoke / ainvoke。
+    """
+
     def __init__(
         self,
         model,
-        tokenizer
+        tokenizer,
+        batch_size=8,
+        batch_wait_ms=10.0,
+        max_new_tokens=100,
     ):
         self.model = model
         self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self.max_new_tokens = max_new_tokens
+        self._queue = None
+        if self.tokenizer != "":
+            self.device = self._pin_model()
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            # decoder-only 模型批量生成需要左侧 padding
+            self.tokenizer.padding_side = "left"
+            self._queue = Queue()
+            self._worker = threading.Thread(target=self._run, name="xrag-deepeval-local", daemon=True)
+            self._worker.start()
+
+    def _pin_model(self):
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        # 已经用 device_map 分配好的模型（如 GPTQ）不再移动
+        if getattr(self.model, "hf_device_map", None):
+            return next(self.model.parameters()).device
+        if next(self.model.parameters()).device != device:
+            self.model.to(device)
+        return device
 
     def load_model(self):
         return self.model
 
-    def generate(self, prompt: str) -> str:
-        model = self.load_model()
+    def _submit(self, prompt: str) -> Future:
+        future: Future = Future()
+        self._queue.put((prompt, future))
+        return future
 
-        if self.tokenizer == "":
-            return model.invoke(prompt).content
+    def _run(self) -> None:
+        while True:
+            requests = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait_ms / 1000.0
+            while len(requests) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                requests.append(item)
+            try:
+                outputs = self._generate_batch([prompt for prompt, _ in requests])
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(requests, outputs):
+                future.set_result(output)
 
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        model_inputs = self.tokenizer([prompt], return_tensors="pt").to(device)
-        model.to(device)
+    def _generate_batch(self, prompts):
+        model_inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        with torch.no_grad():
+            generated_ids = self.model.generate(**model_inputs, max_new_tokens=self.max_new_tokens, do_sample=True,
+                                                pad_token_id=self.tokenizer.pad_token_id)
+        # 只解码新生成的部分
+        new_tokens = generated_ids[:, model_inputs["input_ids"].shape[1]:]
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
 
-        generated_ids = model.generate(**model_inputs, max_new_tokens=100, do_sample=True)
-        return self.tokenizer.batch_decode(generated_ids)[0]
+    def generate(self, prompt: str) -> str:
+        if self.tokenizer == "":
+            return self.model.invoke(prompt).content
+        return self._submit(prompt).result()
 
     async def a_generate(self, prompt: str) -> str:
-        return self.generate(prompt)
+        if self.tokenizer == "":
+            return (await self.model.ainvoke(prompt)).content
+        return await asyncio.wrap_future(self._submit(prompt))
 
     def get_model_name(self):
-        return "Custom model"
\ No newline at end of file
+        return "Custom model"
@@ -10,6 +10,9 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 from deepeval.models.base_model import DeepEvalBaseLLM
 from uptrain import Settings
 from .DeepEvalLocalModel import DeepEvalLocalModel
+from ..embs.embedding import get_embedding
+from ..llms.huggingface_model import get_judge_model_and_tokenizer
+from ..llms.stub import get_stub_llm
 from ..utils import get_module_logger
 
 logger = get_module_logger(__name__)
@@ -41,11 +44,15 @@ class EvalModelAgent():
         logger.info(api_name)
         logger.info("EvalModelAPI:")
         logger.info(api_key)
-        if api_name == "":
-            self._llama_model = AutoModelForCausalLM.from_pretrained(llamaIndex_LocalmodelName,
-                                                     torch_dtype=torch.float16,
-                                                     device_map="auto").eval()
-            self._llama_tokenizer = AutoTokenizer.from_pretrained(llamaIndex_LocalmodelName)
+        self._embedModel = None
+        # llm = "stub" 时评测模型也使用桩 LLM，不加载模型、不访问网络
+        stub = getattr(self.args, "llm", "") == "stub"
+        if stub:
+            # 评测模式的输出能被 llama_index 的打分、YES/NO 和 [RESULT] 解析
+            self.llamaModel = get_stub_llm(self.args, judge=True)
+        elif api_name == "":
+            # local judges go through the model registry, so a judge that is also the generator is loaded once
+            self._llama_tokenizer, self._llama_model = get_judge_model_and_tokenizer(llamaIndex_LocalmodelName)
             load_tokenizer.append(self._llama_tokenizer)
             self.llamaModel = HuggingFaceLLM(context_window=llm_args["context_window"],
                               max_new_tokens=llm_args["max_new_tokens"],
@@ -57,17 +64,15 @@ class EvalModelAgent():
         else:
             self.llamaModel = OpenAI(api_key=api_key, api_base=api_base,
                       model=api_name)
-        if api_name == "":
-            if deepEval_LocalModelName == llamaIndex_LocalmodelName:
-                self._deepEval_model = self._llama_model
-                self._deepEval_tokenizer = self._llama_tokenizer
-            else:
-                self._deepEval_model = AutoModelForCausalLM.from_pretrained(deepEval_LocalModelName,
-                                                     torch_dtype=torch.float16,
-                                                     device_map="auto").eval()
-                self._deepEval_tokenizer = AutoTokenizer.from_pretrained(deepEval_LocalModelName)
+        if stub:
+            # 评测模式对 DeepEval 的提示词返回其要求的 JSON
+            self.deepEvalModel = StubDeepEvalModel(get_stub_llm(self.args, judge=True))
+        elif api_name == "":
+            self._deepEval_tokenizer, self._deepEval_model = get_judge_model_and_tokenizer(deepEval_LocalModelName)
             self.deepEvalModel = DeepEvalLocalModel(model=self._deepEval_model,
-                                                    tokenizer=self._deepEval_tokenizer)
+                                                    tokenizer=self._deepEval_tokenizer,
+                                                    batch_size=getattr(self.args, "deepeval_local_batch_size", 8),
+                                                    batch_wait_ms=getattr(self.args, "deepeval_local_batch_wait_ms", 10.0))
         else:
             # 不再有效了
             # deepeval.api.API_BASE_URL = 'https://uiuiapi.com/v1'
@@ -84,4 +89,30 @@ class EvalModelAgent():
                     model=api_name,
                     openai_api_key=api_key,
                     base_url=api_base,
-                )
\ No newline at end of file
+                )
+
+    @property
+    def embedModel(self):
+        # 只有 Llama_response_semanticSimilarity 用到，首次访问时才加载；与索引共用同一个模型
+        if self._embedModel is None:
+            self._embedModel = get_embedding(self.args.embeddings, getattr(self.args, "embed_batch_size", 16))
+        return self._embedModel
+
+
+class StubDeepEvalModel(DeepEvalBaseLLM):
+    """DeepEval wrapper around StubLLM."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def load_model(self):
+        return self.model
+
+    def generate(self, prompt: str) -> str:
+        return self.model.complete(prompt).text
+
+    async def a_generate(self, prompt: str) -> str:
+        return (await self.model.acomplete(prompt)).text
+
+    def get_model_name(self):
+        return "stub"
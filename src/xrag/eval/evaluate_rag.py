@@ -1,4 +1,12 @@
+import contextlib
+import contextvars
+import copy
+import functools
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from deepeval.metrics import (
     ContextualPrecisionMetric,
@@ -29,6 +37,10 @@ from uptrain.framework.evalllm import EvalLLM
 
 import nest_asyncio
 
+from .judge_cache import contexts_hash, get_judge_cache, judge_model_id
+from ..utils.memory import memory_pressure
+from ..utils.tracing import get_tracer
+
 ppl_bug_number = 0
 
 LLAMA_CUSTOM_FAITHFULNESS_TEMPLATE = PromptTemplate(
@@ -108,6 +120,8 @@ class EvaluationResult:
         metrics.append("IDCG")
 
         self.metrics = metrics
+        # 各阶段耗时统计，由 set_stage_latency 在一次运行结束时填入
+        self.stage_latency = {}
 
     def add(self, evaluate_result):
         for key in self.results.keys():
@@ -133,6 +147,20 @@ class EvaluationResult:
                 else:
                     print(f"{key}: {value['score']/value['count']}, valid number : {value['count']}")
 
+    def set_stage_latency(self, summary):
+        """记录各阶段的耗时统计（utils.tracing.Tracer.stage_summary 的结果）"""
+        self.stage_latency = summary
+
+    def print_stage_latency(self):
+        if not self.stage_latency:
+            return
+        print(f"{'stage':<32}{'count':>8}{'p50_ms':>12}{'p95_ms':>12}{'p99_ms':>12}{'cache_hit':>11}{'tokens':>10}")
+        for stage, row in self.stage_latency.items():
+            hit_rate = "-" if row["cache_hit_rate"] is None else f"{row['cache_hit_rate']:.2%}"
+            tokens = row["prompt_tokens"] + row["completion_tokens"]
+            print(f"{stage:<32}{row['count']:>8}{row['p50_ms']:>12.1f}{row['p95_ms']:>12.1f}{row['p99_ms']:>12.1f}"
+                  f"{hit_rate:>11}{tokens:>10}")
+
     def get_results_str(self):
         ans = ''
         cur = 0
@@ -186,14 +214,29 @@ def upTrain_evaluate_self(
     schema: t.Union[DataSchema, dict[str, str], None] = None,
     metadata: t.Optional[dict[str, str]] = None,
 ):
-    client = EvalLLM(settings)
-
-    nest_asyncio.apply()
+    client = get_uptrain_client(settings)
 
     results = client.evaluate(
         data=data, checks=checks, schema=schema, metadata=metadata
     )
     return results
+_uptrain_clients = {}
+_uptrain_lock = threading.Lock()
+_nest_asyncio_applied = False
+
+
+def get_uptrain_client(settings):
+    """每个 uptrain Settings 只构造一次 EvalLLM，nest_asyncio 只 apply 一次"""
+    global _nest_asyncio_applied
+    with _uptrain_lock:
+        if not _nest_asyncio_applied:
+            nest_asyncio.apply()
+            _nest_asyncio_applied = True
+        client = _uptrain_clients.get(id(settings))
+        if client is None or client[0] is not settings:
+            client = (settings, EvalLLM(settings))
+            _uptrain_clients[id(settings)] = client
+        return client[1]
 # 咱们定义的指标对应Uptrain中的指标
 Map_Uptrain_metrics_truth_val = {
     "UpTrain_Response_Completeness": Evals.RESPONSE_COMPLETENESS,
@@ -283,8 +326,7 @@ def NLGEvaluate(questions, actual_responses, expect_answers, golden_context_ids,
     scores["cer"] = score["cer"]["score"]
     return scores
 
-def UptrainEvaluate(evalModelAgent,question, actual_response, retrieval_context, expected_answer, gold_context, checks, local_model="qwen:7b-chat-v1.5-q8_0"):
-    data = list()
+def uptrain_row(question, actual_response, retrieval_context, expected_answer, gold_context):
     # 这块我把Uptrain里面的评测函数提取出来了，retrieval_context是拼接成字符串作为参数的
     retrieval_context_str = "\n".join(
         [c for c in retrieval_context]
@@ -292,16 +334,97 @@ def UptrainEvaluate(evalModelAgent,question, actual_response, retrieval_context,
     golden_context_str = "\n".join(
         [c for c in gold_context]
     )
-    data.append({"question":question,
-                 "response":actual_response,
-                 "context":retrieval_context_str,
-                 "concise_context":golden_context_str,
-                 "ground_truth":expected_answer
-                 })
+    return {"question":question,
+            "response":actual_response,
+            "context":retrieval_context_str,
+            "concise_context":golden_context_str,
+            "ground_truth":expected_answer
+            }
+
+def UptrainEvaluate(evalModelAgent,question, actual_response, retrieval_context, expected_answer, gold_context, checks, local_model="qwen:7b-chat-v1.5-q8_0"):
+    data = [uptrain_row(question, actual_response, retrieval_context, expected_answer, gold_context)]
     # 指标所需要的变量会在实现中自己取得
     # settings是使用model的设置， data是指标所需的数据， checks 是需要检测的指标的list
     results = upTrain_evaluate_self(settings=evalModelAgent.uptrainSetting, data=data, checks=checks)
     return results
+
+
+class UptrainBatchEvaluator:
+    """
+    跨问题批量的 UpTrain 评测：累积多个问题的数据，每 chunk_size 条调用一次 EvalLLM.evaluate，
+    再通过 Map_Uptrain_metrics_score_name 把得分写回每个问题的 EvaluationResult，
+    并（可选）累加到整体的 EvaluationResult 上。
+
+    设置了 aggregate 时，问题的 EvaluationResult 会先被 aggregate.add，add 不会自行评测，
+    由调用方在 aggregate.add 之后调用 maybe_flush，避免同一得分被累加两次。
+    """
+
+    def __init__(self, evalModelAgent, metrics, chunk_size=16, aggregate=None):
+        self.evalModelAgent = evalModelAgent
+        self.upTrain_metrics = [i for i in metrics if i in Map_Uptrain_metrics_truth_val.keys()]
+        self.chunk_size = max(1, chunk_size)
+        self.aggregate = aggregate
+        self._rows = []
+        self._results = []
+        self._cache_keys = []
+        self._row_metrics = []
+        self._lock = threading.Lock()
+
+    def add(self, eval_result, question, actual_response, retrieval_context, expected_answer, golden_context,
+            metrics=None):
+        """metrics: 该问题需要评测的 UpTrain 指标（未命中评测缓存的），默认全部"""
+        metrics = [i for i in (self.upTrain_metrics if metrics is None else metrics) if i in self.upTrain_metrics]
+        if not metrics:
+            return
+        with self._lock:
+            self._rows.append(uptrain_row(question, actual_response, retrieval_context, expected_answer,
+                                          golden_context))
+            self._results.append(eval_result)
+            self._cache_keys.append((question, str(actual_response),
+                                     contexts_hash(retrieval_context, golden_context, expected_answer)))
+            self._row_metrics.append(tuple(metrics))
+        if self.aggregate is None:
+            self.maybe_flush()
+
+    def maybe_flush(self):
+        """批次已满，或超出软内存预算（提前评测，不再继续累积）时评测"""
+        with self._lock:
+            pending = len(self._rows)
+        if pending >= self.chunk_size or (pending and memory_pressure()):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, results, cache_keys, row_metrics = self._rows, self._results, self._cache_keys, self._row_metrics
+            self._rows, self._results, self._cache_keys, self._row_metrics = [], [], [], []
+        if not rows:
+            return
+        # 按需要评测的指标集合分组，每组只请求缺少的指标，命中缓存的指标不重新评测
+        groups = {}
+        for i, metrics in enumerate(row_metrics):
+            groups.setdefault(metrics, []).append(i)
+        for metrics, indices in groups.items():
+            self._evaluate_group(list(metrics), [rows[i] for i in indices], [results[i] for i in indices],
+                                 [cache_keys[i] for i in indices])
+
+    def _evaluate_group(self, metrics, rows, results, cache_keys):
+        checks = [Map_Uptrain_metrics_truth_val[i] for i in metrics]
+        with get_judge_semaphore("uptrain"), get_tracer().span("eval.UpTrain_batch", rows=len(rows)):
+            scored = _with_retry("UpTrain", lambda: {"rows": upTrain_evaluate_self(
+                settings=self.evalModelAgent.uptrainSetting, data=rows, checks=checks)})
+        judge_cache = get_judge_cache()
+        judge_model = judge_model_id(self.evalModelAgent, "uptrain")
+        for eval_result, row, cache_key in zip(results, scored.get("rows", []), cache_keys):
+            updates = _uptrain_scores(metrics, row)
+            if judge_cache is not None:
+                judge_cache.store(updates, judge_model, *cache_key)
+            for name, (score, count) in updates.items():
+                eval_result.metrics_results[name]["score"] = score
+                eval_result.metrics_results[name]["count"] = count
+                if self.aggregate is not None and name in self.aggregate.metrics:
+                    self.aggregate.metrics_results[name]["score"] += score
+                    self.aggregate.metrics_results[name]["count"] += count
+
 def get_DeepEval_Metrices(evalModelAgent,model_name="DeepEval_retrieval_contextualPrecision"):
     match model_name:
         case "DeepEval_retrieval_contextualPrecision":
@@ -335,12 +458,241 @@ def get_llama_evaluator(evalModelAgent,model_name="Llama_retrieval_Faithfulness"
         case "Llama_response_correctness":
             return CorrectnessEvaluator(llm=evalModelAgent.llamaModel)
         case "Llama_response_semanticSimilarity":
-            return SemanticSimilarityEvaluator()
+            return SemanticSimilarityEvaluator(embed_model=evalModelAgent.embedModel)
         case "Llama_response_answerRelevancy":
             return AnswerRelevancyEvaluator(llm=evalModelAgent.llamaModel)
 
+# region evaluator registry
+class EvaluatorRegistry:
+    """
+    评测器注册表：根据 cfg.metrics 和 EvalModelAgent 在整个评测过程中只构造一次评测对象
+
+    LlamaIndex 评测器是无状态的，所有问题共享一个实例；DeepEval 指标在 measure 时会写入
+    score/verdicts 等状态，所以按指标维护一个空闲实例池，并发的问题各自借用一个实例，用完归还。
+    """
+
+    def __init__(self, evalModelAgent, metrics):
+        self.evalModelAgent = evalModelAgent
+        self.metrics = list(metrics)
+        self._llama = {}
+        self._deepeval_free = {}
+        self._lock = threading.Lock()
+        for name in self.metrics:
+            if name.startswith("Llama_"):
+                self._llama[name] = get_llama_evaluator(evalModelAgent, name)
+            elif name.startswith("DeepEval_"):
+                self._deepeval_free[name] = [get_DeepEval_Metrices(evalModelAgent, name)]
+        if any(name in Map_Uptrain_metrics_truth_val for name in self.metrics):
+            get_uptrain_client(evalModelAgent.uptrainSetting)
+
+    def llama_evaluator(self, name):
+        evaluator = self._llama.get(name)
+        if evaluator is None:
+            with self._lock:
+                evaluator = self._llama.setdefault(name, get_llama_evaluator(self.evalModelAgent, name))
+        return evaluator
+
+    @contextlib.contextmanager
+    def deepeval_metric(self, name):
+        with self._lock:
+            free = self._deepeval_free.setdefault(name, [])
+            metric = free.pop() if free else None
+        if metric is None:
+            metric = get_DeepEval_Metrices(self.evalModelAgent, name)
+        try:
+            yield metric
+        finally:
+            with self._lock:
+                self._deepeval_free[name].append(metric)
+
+
+def get_evaluator_registry(evalModelAgent, metrics):
+    """EvaluatorRegistry 挂在 EvalModelAgent 上，指标集合变化时重建"""
+    registry = getattr(evalModelAgent, "_evaluator_registry", None)
+    if registry is None or set(registry.metrics) != set(metrics):
+        registry = EvaluatorRegistry(evalModelAgent, metrics)
+        evalModelAgent._evaluator_registry = registry
+    return registry
+
+
+def benchmark_evaluator_overhead(evalModelAgent, metrics, n=20):
+    """
+    对比每个问题重新构造评测对象（旧做法）与使用 EvaluatorRegistry 的单题开销（不调用评测模型）
+
+    Returns:
+        dict: per_question_ms_before, per_question_ms_after, registry_build_ms
+    """
+    metrics = [m for m in metrics if m.startswith("Llama_") or m.startswith("DeepEval_")
+               or m in Map_Uptrain_metrics_truth_val]
+    uptrain = any(m in Map_Uptrain_metrics_truth_val for m in metrics)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        for name in metrics:
+            if name.startswith("Llama_"):
+                get_llama_evaluator(evalModelAgent, name)
+            elif name.startswith("DeepEval_"):
+                get_DeepEval_Metrices(evalModelAgent, name)
+        if uptrain:
+            EvalLLM(evalModelAgent.uptrainSetting)
+            nest_asyncio.apply()
+    before = (time.perf_counter() - start) * 1000 / n
+
+    start = time.perf_counter()
+    registry = EvaluatorRegistry(evalModelAgent, metrics)
+    build = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for _ in range(n):
+        for name in metrics:
+            if name.startswith("Llama_"):
+                registry.llama_evaluator(name)
+            elif name.startswith("DeepEval_"):
+                with registry.deepeval_metric(name):
+                    pass
+        if uptrain:
+            get_uptrain_client(evalModelAgent.uptrainSetting)
+    after = (time.perf_counter() - start) * 1000 / n
+
+    report = {"metrics": len(metrics), "questions": n, "per_question_ms_before": before,
+              "per_question_ms_after": after, "registry_build_ms": build}
+    print(f"Evaluator overhead: {report}")
+    return report
+# endregion
+
+
+# region concurrent judge execution
+# 各评测后端（llamaindex / uptrain / deepeval / nlg）各有一个线程池和全局并发上限，某个后端排队不会占满
+# 其他后端的线程；同一个问题的各个指标并发执行，耗时接近最慢的单个指标而不是所有指标之和
+_judge_semaphores = {}
+_judge_executors = {}
+_judge_lock = threading.Lock()
+
+
+def _judge_concurrency(backend):
+    try:
+        from ..config import Config
+
+        return max(1, int(getattr(Config(), backend + "_judge_concurrency", 4)))
+    except Exception:
+        return 4
+
+
+def get_judge_semaphore(backend):
+    with _judge_lock:
+        if backend not in _judge_semaphores:
+            _judge_semaphores[backend] = threading.BoundedSemaphore(_judge_concurrency(backend))
+        return _judge_semaphores[backend]
+
+
+def get_judge_executor(backend):
+    with _judge_lock:
+        if backend not in _judge_executors:
+            _judge_executors[backend] = ThreadPoolExecutor(max_workers=_judge_concurrency(backend),
+                                                           thread_name_prefix="xrag-judge-" + backend)
+        return _judge_executors[backend]
+
+
+def _with_retry(name, fn, retries=2):
+    # 这里要记录一下数量，因为由于种种原因这个过程会报错，就会导致无效的记录
+    for _ in range(retries):
+        try:
+            return fn()
+        except Exception as e:
+            logging.exception(e)
+            print("error ")
+    print(name + " error")
+    return {}
+
+
+def _golden_response(response, golden_context):
+    # 这块要评测golden_context和其他的关系，相当于在原基础上更换retrieval_context
+    # 在Relevancy的实现中，会取出node里面的文本，所以我们构建的时候只传文本就好
+    # 复制一份 response，避免并发执行的其他指标看到被替换的 source_nodes
+    golden = copy.copy(response)
+    golden.source_nodes = [NodeWithScore(node=TextNode(text=context)) for context in golden_context]
+    return golden
+
+
+def _llama_metric(name, question, response, expected_answer, golden_context, registry):
+    print("now run " + name)
+    evaluator = registry.llama_evaluator(name)
+    if name == "Llama_retrieval_FaithfulnessG":
+        # 这块跟prompt相关（LLAMA_CUSTOM_FAITHFULNESS_TEMPLATE）
+        query_str = f"Question: {question}\nInformation: {response.response}"
+        # Faithfulness.evaluate_response的实现中会把query的值传给上面prompt的query_str
+        # 实现的功能和文档中相同，这里试用了一下gpt生成的prompt
+        res = evaluator.evaluate_response(query=query_str, response=_golden_response(response, golden_context))
+    elif name == "Llama_retrieval_RelevancyG":
+        # 这块语义差不多所以就没更换prompt
+        res = evaluator.evaluate_response(query=question, response=_golden_response(response, golden_context))
+    else:
+        # 这里的传参主要是想要使用系统自带的函数，在实现中会自动提取所需的内容
+        res = evaluator.evaluate_response(query=question, response=response, reference=expected_answer)
+    if res.passing:
+        return {name: (1, 1)}
+    elif 0 <= res.score and res.score <= 1:
+        return {name: (res.score, 1)}
+    return {name: (0, 1)}
+
+
+def _uptrain_scores(upTrain_metrics, row):
+    updates = {}
+    for i in upTrain_metrics:
+        try:
+            #TODO: fix NONETYPE
+            if row[Map_Uptrain_metrics_score_name[i]] >= 0 and row[Map_Uptrain_metrics_score_name[i]] <= 1:
+                updates[i] = (row[Map_Uptrain_metrics_score_name[i]], 1)
+        except Exception as e:
+            logging.exception(e)
+    return updates
+
+
+def _uptrain_metrics(upTrain_metrics, question, actual_response, retrieval_context, expected_answer,
+                     golden_context, evalModelAgent):
+    # upTrain 可以进行多个指标的评测（传入要评测指标的list）,因此我们将要测的指标封装成一个list
+    upTrain_metrics_val = [Map_Uptrain_metrics_truth_val[i] for i in upTrain_metrics]
+    result = UptrainEvaluate(evalModelAgent, question, actual_response, retrieval_context, expected_answer,
+                             golden_context, upTrain_metrics_val)
+    return _uptrain_scores(upTrain_metrics, result[0])
+
+
+def _deepeval_metric(name, question, actual_response, retrieval_context, expected_answer, golden_context,
+                     registry):
+    # 构建评测的参数
+    test_case = LLMTestCase(
+        input=question,
+        actual_output=actual_response,
+        retrieval_context=retrieval_context,
+        expected_output=expected_answer,
+        context=golden_context,
+    )
+    with registry.deepeval_metric(name) as deepeval_metric:
+        deepeval_metric.measure(test_case)
+        if len(deepeval_metric.verdicts) == 0:
+            raise Exception("deepeval verdicts is zero")
+        return {name: (1 if deepeval_metric.score else 0, 1)}
+
+
+def _nlg_metrics(NLG_metrics, question, actual_response, expected_answer, golden_context_ids):
+    result = NLGEvaluate(question, actual_response, expected_answer, golden_context_ids, NLG_metrics)
+    return {"NLG_" + i: (result[i], 1) for i in NLG_EVALUATION_METRICS}
+
+
+def _run_judge(backend, name, fn, retry=True):
+    with get_judge_semaphore(backend), get_tracer().span("eval." + name, backend=backend):
+        return _with_retry(name, fn) if retry else fn()
+# endregion
+
+
 # response evaluate
-def evaluating(question, response, actual_response, retrieval_context, retrieval_ids, expected_answer, golden_context, golden_context_ids, metrics, evalModelAgent):
+# uptrain_batch: 传入 UptrainBatchEvaluator 时，UpTrain 指标累积到批次中稍后统一评测
+def evaluating(question, response, actual_response, retrieval_context, retrieval_ids, expected_answer, golden_context, golden_context_ids, metrics, evalModelAgent, uptrain_batch=None):
+    with get_tracer().span("evaluate") as span:
+        return _evaluating(question, response, actual_response, retrieval_context, retrieval_ids, expected_answer,
+                           golden_context, golden_context_ids, metrics, evalModelAgent, uptrain_batch, span)
+
+
+def _evaluating(question, response, actual_response, retrieval_context, retrieval_ids, expected_answer, golden_context, golden_context_ids, metrics, evalModelAgent, uptrain_batch, span):
 
     # 创建一个新类，主要是用来记录各个指标有效的个数以及得分
     eval_result = EvaluationResult()
@@ -355,127 +707,73 @@ def evaluating(question, response, actual_response, retrieval_context, retrieval
     eval_result.results["DCG"] = DCG(retrieval_ids, golden_context_ids)
     eval_result.results["IDCG"] = IDCG(retrieval_ids, golden_context_ids)
     # endregion
-    # 由于upTrain可以一次计算多个指标，所以这个变量之后会从upTrain的多个指标
-    upTrain_metrics = list()
+    registry = get_evaluator_registry(evalModelAgent, metrics)
+    # 提交到评测线程池时复制当前上下文，各指标的 span 挂在本次 evaluate 之下
+    futures = []
+    # 已经评测过的 (指标, 评测模型, 问题, 回答, 上下文) 直接使用缓存结果
+    judge_cache = get_judge_cache()
+    ctx_hash = contexts_hash(retrieval_context, golden_context, expected_answer)
+
+    def cached(name, backend):
+        if judge_cache is None:
+            return False
+        hit = judge_cache.lookup(name, judge_model_id(evalModelAgent, backend), question, str(actual_response),
+                                 ctx_hash)
+        span.add("cache_lookups", 1)
+        if hit is None:
+            return False
+        span.add("cache_hits", 1)
+        eval_result.metrics_results[name]["score"], eval_result.metrics_results[name]["count"] = hit
+        return True
+
     # region llama_index evaluation
     for i in eval_result.evaluationName:
-        if i in metrics and i[0:8] != "DeepEval" and i[0:7] != "UpTrain" and i[0:3] != "NLG":
-            print("now run " + i)
-
-            count = 2
-            while True:
-                try:
-                    evaluator = get_llama_evaluator(evalModelAgent, i)
-                    res = EvaluationResult()
-                    res.passing = False
-                    if i == "Llama_retrieval_FaithfulnessG":
-                        # 这块跟prompt相关（LLAMA_CUSTOM_FAITHFULNESS_TEMPLATE）
-                        query_str = f"Question: {question}\nInformation: {response.response}"
-                        # Faithfulness.evaluate_response的实现中会把query的值传给上面prompt的query_str
-                        # 实现的功能和文档中相同，这里试用了一下gpt生成的prompt
-                        res = evaluator.evaluate_response(query=query_str, response=response)
-                    elif i == "Llama_retrieval_RelevancyG":
-                        # 这块要评测golden_context和其他的关系，相当于在原基础上更换retrieval_context
-                        # 在Relevancy的实现中，会取出node里面的文本，所以我们构建的时候只传文本就好
-                        # 这块语义差不多所以就没更换prompt
-                        response.source_nodes.clear()
-                        for context in golden_context:
-                            node = TextNode()
-                            node.text = context
-                            temp = NodeWithScore(node=node)
-                            response.source_nodes.append(temp)
-                        res = evaluator.evaluate_response(query=question, response=response)
-                    else:
-                        # 这里的传参主要是想要使用系统自带的函数，在实现中会自动提取所需的内容
-                        res = evaluator.evaluate_response(query=question, response=response, reference=expected_answer)
-                    if res.passing:
-                        eval_result.metrics_results[i]["score"] = 1
-                    elif 0 <= res.score and res.score <= 1:
-                        eval_result.metrics_results[i]["score"] = res.score
-                    # 这里要记录一下数量，因为由于种种原因这个过程会报错，就会导致无效的记录
-                    eval_result.metrics_results[i]["count"] = 1
-                    break
-                except Exception as e:
-                    count = count - 1
-
-                    logging.exception(e)
-                    print("error ")
-                    if count == 0:
-                        print(i + " error")
-                        break
+        if i in metrics and i[0:8] != "DeepEval" and i[0:7] != "UpTrain" and i[0:3] != "NLG" \
+                and not cached(i, "llamaindex"):
+            futures.append(("llamaindex", get_judge_executor("llamaindex").submit(
+                contextvars.copy_context().run, _run_judge, "llamaindex", i,
+                functools.partial(_llama_metric, i, question, response, expected_answer, golden_context,
+                                  registry))))
     # endregion
     # region uptrain evaluation
-    for i in metrics:
-        if i in Map_Uptrain_metrics_truth_val.keys():
-            upTrain_metrics.append(i)
-    if upTrain_metrics.__len__() != 0:
-        # upTrain 可以进行多个指标的评测（传入要评测指标的list）,因此我们将要测的指标封装成一个list
-        upTrain_metrics_val = list()
-        for i in upTrain_metrics:
-            upTrain_metrics_val.append(Map_Uptrain_metrics_truth_val[i])
-        count = 2
-        while True:
-            try:
-                result = UptrainEvaluate(evalModelAgent, question,actual_response,retrieval_context,expected_answer,golden_context,upTrain_metrics_val)
-                for i in upTrain_metrics:
-                    try:
-                        #TODO: fix NONETYPE
-                        if result[0][Map_Uptrain_metrics_score_name[i]] >= 0 and result[0][Map_Uptrain_metrics_score_name[i]] <= 1:
-                            eval_result.metrics_results[i]["score"] = result[0][Map_Uptrain_metrics_score_name[i]]
-                            eval_result.metrics_results[i]["count"] = 1
-                    except Exception as e:
-                        logging.exception(e)
-                break
-            except Exception as e:
-                count = count - 1
-                logging.exception(e)
-                if count == 0:
-                    break
+    # 由于upTrain可以一次计算多个指标，所以这个变量之后会从upTrain的多个指标
+    upTrain_metrics = [i for i in metrics if i in Map_Uptrain_metrics_truth_val.keys() and not cached(i, "uptrain")]
+    if upTrain_metrics.__len__() != 0 and uptrain_batch is not None:
+        uptrain_batch.add(eval_result, question, actual_response, retrieval_context, expected_answer, golden_context,
+                          upTrain_metrics)
+    elif upTrain_metrics.__len__() != 0:
+        futures.append(("uptrain", get_judge_executor("uptrain").submit(
+            contextvars.copy_context().run, _run_judge, "uptrain", "UpTrain",
+            functools.partial(_uptrain_metrics, upTrain_metrics, question, actual_response, retrieval_context,
+                              expected_answer, golden_context, evalModelAgent))))
     # endregion
     # region deepEval evaluation
     for i in eval_result.evaluationName:
-        if i in metrics and i[0:8] == "DeepEval":
-            count = 2
-            while True:
-                try:
-                    # 构建评测的参数
-                    test_case = LLMTestCase(
-                        input=question,
-                        actual_output=actual_response,
-                        retrieval_context=retrieval_context,
-                        expected_output=expected_answer,
-                        context=golden_context,
-                    )
-                    deepeval_metric = get_DeepEval_Metrices(evalModelAgent, i)
-                    deepeval_metric.measure(test_case)
-                    if len(deepeval_metric.verdicts) == 0:
-                        raise Exception("deepeval verdicts is zero")
-
-                    if deepeval_metric.score:
-                        eval_result.metrics_results[i]["score"] = 1
-                    eval_result.metrics_results[i]["count"] = 1
-                    break
-                except Exception as e:
-                    count = count - 1
-
-                    logging.exception(e)
-                    #   file2.write(traceback.format_exc())
-                    print("error ")
-                    if count == 0:
-                        print(i + " error")
-                        break
+        if i in metrics and i[0:8] == "DeepEval" and not cached(i, "deepeval"):
+            futures.append(("deepeval", get_judge_executor("deepeval").submit(
+                contextvars.copy_context().run, _run_judge, "deepeval", i,
+                functools.partial(_deepeval_metric, i, question, actual_response, retrieval_context,
+                                  expected_answer, golden_context, registry))))
+    # endregion
     # region NLG evaluation
     NLG_metrics = []
     for i in metrics:
         if i[0:3] == "NLG":
             NLG_metrics.append(i[4:])
     if NLG_metrics.__len__() != 0:
-        result = NLGEvaluate(question, actual_response, expected_answer, golden_context_ids, NLG_metrics)
-        for i in NLG_EVALUATION_METRICS:
-            eval_result.metrics_results["NLG_"+i]["score"] = result[i]
-            eval_result.metrics_results["NLG_"+i]["count"] = 1
-
+        futures.append(("nlg", get_judge_executor("nlg").submit(
+            contextvars.copy_context().run, _run_judge, "nlg", "NLG",
+            functools.partial(_nlg_metrics, NLG_metrics, question, actual_response, expected_answer,
+                              golden_context_ids), False)))
     # endregion
+    for backend, future in futures:
+        updates = future.result()
+        if judge_cache is not None and backend != "nlg":
+            judge_cache.store(updates, judge_model_id(evalModelAgent, backend), question, str(actual_response),
+                              ctx_hash)
+        for name, (score, count) in updates.items():
+            eval_result.metrics_results[name]["score"] = score
+            eval_result.metrics_results[name]["count"] = count
     return eval_result
 
 # region commonly used indicators
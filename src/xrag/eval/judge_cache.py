@@ -0,0 +1,86 @@
+import hashlib
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+from ..utils.sqlite_cache import SqliteLRUCache
+
+# 评测结果缓存：同一个 (指标, 评测模型, 问题, 回答, 上下文) 只调用一次评测模型，
+# 在已保存的运行结果上增加新指标时，只需为新指标付费
+
+
+def contexts_hash(retrieval_context, golden_context, expected_answer) -> str:
+    raw = json.dumps([list(retrieval_context or []), list(golden_context or []), expected_answer or ""],
+                     ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def judge_model_id(evalModelAgent, backend: str) -> str:
+    """评测模型标识：使用 API 时为 api_base + api_name，否则为各后端的本地模型名"""
+    args = evalModelAgent.args
+    if getattr(args, "llm", "") == "stub":
+        return "stub"
+    if getattr(args, "api_name", ""):
+        return f"{getattr(args, 'api_base', '')}:{args.api_name}"
+    local = {
+        "llamaindex": "llamaIndexEvaluateModel",
+        "deepeval": "deepEvalEvaluateModel",
+        "uptrain": "upTrainEvaluateModel",
+    }.get(backend, "")
+    return "local:" + str(getattr(args, local, ""))
+
+
+class JudgeCache(SqliteLRUCache):
+    """(score, count) of one judge metric for one question/response, persisted in SQLite."""
+
+    def __init__(self, path: Optional[str] = "cache/judge.sqlite", max_entries: int = 0,
+                 memory_entries: int = 10000):
+        super().__init__(path, table="judge_results", max_entries=max_entries, memory_entries=memory_entries)
+
+    @staticmethod
+    def make_key(metric: str, judge_model: str, question: str, response: str, ctx_hash: str) -> str:
+        raw = json.dumps([metric, judge_model, question, response, ctx_hash], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, metric: str, judge_model: str, question: str, response: str,
+               ctx_hash: str) -> Optional[Tuple[float, int]]:
+        value = self.get(self.make_key(metric, judge_model, question, response, ctx_hash))
+        if value is None:
+            return None
+        score, count = json.loads(value)
+        return score, count
+
+    def store(self, updates: Dict[str, Tuple[float, int]], judge_model: str, question: str, response: str,
+              ctx_hash: str) -> None:
+        for metric, (score, count) in updates.items():
+            # 只缓存有效的结果，出错的指标下次重新评测
+            if count:
+                self.put(self.make_key(metric, judge_model, question, response, ctx_hash),
+                         json.dumps([score, count]))
+
+
+_judge_cache: Optional[JudgeCache] = None
+_judge_cache_lock = threading.Lock()
+
+
+def get_judge_cache() -> Optional[JudgeCache]:
+    """
+    进程内共享的评测结果缓存，由 config.toml 配置
+
+    Returns:
+        JudgeCache，judge_cache = false 时返回 None
+    """
+    global _judge_cache
+    if _judge_cache is None:
+        with _judge_cache_lock:
+            if _judge_cache is None:
+                from ..config import Config
+
+                cfg = Config()
+                if not getattr(cfg, "judge_cache", True):
+                    return None
+                _judge_cache = JudgeCache(
+                    path=getattr(cfg, "judge_cache_path", "cache/judge.sqlite") or None,
+                    max_entries=getattr(cfg, "judge_cache_max_entries", 0),
+                )
+    return _judge_cache
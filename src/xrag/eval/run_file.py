@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+
+# 运行文件：第一阶段把 RAG 的回答、检索 id 和上下文写入运行文件（JSONL 或 Parquet），
+# 第二阶段可以用任意指标集合对任意运行文件打分，两个阶段可以分别扩展和重跑
+
+RUN_FIELDS = ["question", "expected_answer", "golden_context", "golden_context_ids", "response",
+              "retrieval_ids", "retrieval_context", "retrieval_scores", "latency_ms"]
+
+
+def run_meta(cfg) -> dict:
+    """记录生成该运行文件的主要配置"""
+    keys = ["dataset", "llm", "embeddings", "retriever", "query_transform", "postprocess_rerank",
+            "responce_synthsizer", "chunk_size", "split_type"]
+    meta = {k: getattr(cfg, k, None) for k in keys}
+    meta["created_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return meta
+
+
+def make_record(question, expected_answer, golden_context, golden_context_ids, response, latency_ms=0.0) -> dict:
+    retrieval_ids = []
+    retrieval_context = []
+    retrieval_scores = []
+    for source_node in response.source_nodes:
+        retrieval_ids.append(source_node.metadata.get('id'))
+        retrieval_context.append(source_node.get_content())
+        retrieval_scores.append(source_node.score)
+    return {
+        "question": question,
+        "expected_answer": expected_answer,
+        "golden_context": list(golden_context),
+        "golden_context_ids": list(golden_context_ids),
+        "response": response.response,
+        "retrieval_ids": retrieval_ids,
+        "retrieval_context": retrieval_context,
+        "retrieval_scores": retrieval_scores,
+        "latency_ms": latency_ms,
+    }
+
+
+def record_to_response(record: dict) -> Response:
+    """从运行文件的记录重建 llama_index 的 Response，供需要 source_nodes 的评测器使用"""
+    scores = record.get("retrieval_scores") or [None] * len(record["retrieval_context"])
+    source_nodes = [
+        NodeWithScore(node=TextNode(text=text, metadata={"id": node_id}), score=score)
+        for node_id, text, score in zip(record["retrieval_ids"], record["retrieval_context"], scores)
+    ]
+    return Response(response=record["response"], source_nodes=source_nodes)
+
+
+def _is_parquet(path: str) -> bool:
+    return path.endswith(".parquet")
+
+
+class RunFileWriter:
+    """逐条写入运行文件；JSONL 每条记录立即落盘，Parquet 在 close 时一次写入"""
+
+    def __init__(self, path: str, meta: Optional[dict] = None):
+        self.path = path
+        self.meta = meta or {}
+        self._records: List[dict] = []
+        self._f = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not _is_parquet(path):
+            self._f = open(path, "w", encoding="utf-8")
+            self._f.write(json.dumps({"_meta": self.meta}, ensure_ascii=False) + "\n")
+
+    def write(self, record: dict) -> None:
+        if self._f is not None:
+            self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._f.flush()
+        else:
+            self._records.append(record)
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        elif _is_parquet(self.path):
+            import polars as pl
+
+            pl.DataFrame(self._records, schema_overrides={"latency_ms": pl.Float64}).write_parquet(self.path)
+            with open(self.path + ".meta.json", "w", encoding="utf-8") as f:
+                json.dump(self.meta, f, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_run_file(path: str, records: Iterable[dict], meta: Optional[dict] = None) -> None:
+    with RunFileWriter(path, meta) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def read_run_file(path: str) -> Tuple[dict, List[dict]]:
+    """
+    读取运行文件
+
+    Returns:
+        (meta, records)
+    """
+    if _is_parquet(path):
+        import polars as pl
+
+        records = pl.read_parquet(path).to_dicts()
+        meta = {}
+        if os.path.exists(path + ".meta.json"):
+            with open(path + ".meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        return meta, records
+    meta = {}
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "_meta" in item:
+                meta = item["_meta"]
+            else:
+                records.append(item)
+    return meta, records
@@ -1 +1 @@
-from .index import get_index
\ No newline at end of file
+from .index import get_index, index_version
\ No newline at end of file
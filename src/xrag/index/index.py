@@ -1,4 +1,4 @@
-from llama_index.core import VectorStoreIndex
+from llama_index.core import Settings, VectorStoreIndex
 from llama_index.core import (
     StorageContext,
     load_index_from_storage,
@@ -7,47 +7,111 @@ from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.storage.docstore import SimpleDocumentStore
 
 from ..data.qa_loader import get_documents
+import hashlib
 import os
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from llama_index.core.node_parser import LangchainNodeParser
 from llama_index.core.node_parser import HierarchicalNodeParser
+from ..utils import get_module_logger
+from ..utils.memory import get_memory_tracker, memory_phase
+from .vector_store import QuantizedVectorStore, is_quantized_persist_dir
 
-def get_index(documents, persist_dir, split_type="sentence", chunk_size=1024,chunk_overlap=20,chunk_sizes=[2048, 512, 128]):
+logger = get_module_logger(__name__)
+
+
+def build_vector_index(nodes, vector_store_dtype="float32", rescore_multiplier=4):
+    # float32 keeps the default SimpleVectorStore, float16/int8 store compressed vectors
+    storage_context = None
+    if vector_store_dtype != "float32":
+        vector_store = QuantizedVectorStore(dtype=vector_store_dtype, rescore=rescore_multiplier > 0,
+                                            rescore_multiplier=max(rescore_multiplier, 1),
+                                            keep_full_precision=rescore_multiplier > 0)
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    tracker = get_memory_tracker()
+    if tracker is not None and tracker.budget_mb:
+        return build_vector_index_within_budget(nodes, storage_context, tracker)
+    return VectorStoreIndex(nodes, storage_context=storage_context, show_progress=True)
+
+
+def build_vector_index_within_budget(nodes, storage_context, tracker, insert_batch_size=2048, min_batch_size=16):
+    # embed and insert in slices; above the soft memory budget, halve the slice and the embedding batch size.
+    # The index embeds with its own shallow copy of Settings.embed_model, so halving the batch size does not
+    # change the shared instance
+    embed_model = Settings.embed_model.model_copy()
+    index = VectorStoreIndex([], storage_context=storage_context, embed_model=embed_model)
+    start = 0
+    while start < len(nodes):
+        batch = nodes[start:start + insert_batch_size]
+        index.insert_nodes(batch)
+        start += len(batch)
+        logger.info(f"Embedded {start}/{len(nodes)} nodes")
+        if tracker.over_budget():
+            tracker.reclaim("embedding")
+            if insert_batch_size > min_batch_size:
+                insert_batch_size = max(min_batch_size, insert_batch_size // 2)
+                embed_model.embed_batch_size = max(1, embed_model.embed_batch_size // 2)
+                logger.warning(f"Reduced insert batch to {insert_batch_size} nodes and embedding batch to "
+                               f"{embed_model.embed_batch_size}")
+    return index
+
+
+def get_node_parser(split_type="sentence", chunk_size=1024, chunk_overlap=20, chunk_sizes=[2048, 512, 128]):
+    if split_type == "sentence":
+        return SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    elif split_type == "character":
+        return LangchainNodeParser(RecursiveCharacterTextSplitter())
+    elif split_type == "hierarchical":
+        return HierarchicalNodeParser.from_defaults(
+            chunk_sizes=chunk_sizes
+        )
+    raise ValueError(f"split_type {split_type} not supported.")
+
+
+def index_version(persist_dir):
+    """
+    Version of a persisted index: a hash of its files' names, sizes and
+    modification times, so it changes whenever the index is rebuilt.
+    """
+    entries = []
+    for directory in (persist_dir, persist_dir + "-hierarchical"):
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append(f"{directory}/{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("\n".join(entries).encode("utf-8")).hexdigest()[:16]
+
+
+def get_index(documents, persist_dir, split_type="sentence", chunk_size=1024,chunk_overlap=20,chunk_sizes=[2048, 512, 128],
+              vector_store_dtype="float32", rescore_multiplier=4):
     hierarchical_storage_context = None
     if not os.path.exists(persist_dir):
         # load the documents and create the index
-        if split_type == "sentence":
-            parser = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        parser = get_node_parser(split_type, chunk_size, chunk_overlap, chunk_sizes)
+        with memory_phase("node_parsing"):
             nodes = parser.get_nodes_from_documents(documents, show_progress=True)
-            print("nodes: " + str(nodes.__len__()))
-            index = VectorStoreIndex(nodes,show_progress=True)
-        elif split_type == "character":
-            parser = LangchainNodeParser(RecursiveCharacterTextSplitter())
-            nodes = parser.get_nodes_from_documents(documents, show_progress=True)
-            print("nodes: " + str(nodes.__len__()))
-            index = VectorStoreIndex(nodes,show_progress=True)
-        elif split_type == "hierarchical":
-            parser = HierarchicalNodeParser.from_defaults(
-                chunk_sizes=chunk_sizes
-            )
-            nodes = parser.get_nodes_from_documents(documents, show_progress=True)
-            print("nodes: " + str(nodes.__len__()))
-            index = VectorStoreIndex(nodes,show_progress=True)
-        else:
-            raise ValueError(f"split_type {split_type} not supported.")
+        print("nodes: " + str(nodes.__len__()))
+        with memory_phase("embedding"):
+            index = build_vector_index(nodes, vector_store_dtype, rescore_multiplier)
         # store it for later
-        if split_type == "hierarchical":
-            docstore = SimpleDocumentStore()
-            docstore.add_documents(nodes)
-            hierarchical_storage_context = StorageContext.from_defaults(docstore=docstore)
-            # save
-            hierarchical_storage_context.persist(persist_dir=persist_dir+"-hierarchical")
-
-        index.storage_context.persist(persist_dir=persist_dir)
+        with memory_phase("persistence"):
+            if split_type == "hierarchical":
+                docstore = SimpleDocumentStore()
+                docstore.add_documents(nodes)
+                hierarchical_storage_context = StorageContext.from_defaults(docstore=docstore)
+                # save
+                hierarchical_storage_context.persist(persist_dir=persist_dir+"-hierarchical")
+
+            index.storage_context.persist(persist_dir=persist_dir)
     else:
         # load the existing index
-        if split_type == "hierarchical":
-            hierarchical_storage_context = StorageContext.from_defaults(persist_dir=persist_dir + "-hierarchical")
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-        index = load_index_from_storage(storage_context)
+        with memory_phase("index_load"):
+            if split_type == "hierarchical":
+                hierarchical_storage_context = StorageContext.from_defaults(persist_dir=persist_dir + "-hierarchical")
+            if is_quantized_persist_dir(persist_dir):
+                vector_store = QuantizedVectorStore.from_persist_dir(persist_dir, rescore=rescore_multiplier > 0)
+                storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+            else:
+                storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
+            index = load_index_from_storage(storage_context)
     return index, hierarchical_storage_context
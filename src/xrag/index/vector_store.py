@@ -0,0 +1,302 @@
+import json
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from ..utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+DATA_FNAME = "quantized_vector_store.npz"
+FULL_PRECISION_FNAME = "quantized_vector_store.fp32.npy"
+META_FNAME = "default__vector_store.json"
+SUPPORTED_DTYPES = ("float16", "int8")
+# pending embeddings are encoded once this many have been added, so a build never buffers all of them
+CONSOLIDATE_EVERY = 4096
+
+
+class QuantizedVectorStore(BasePydanticVectorStore):
+    """
+    In-memory vector store keeping embeddings as float16 or per-dimension scalar-quantized int8.
+
+    Search runs over the compressed vectors. With ``rescore`` enabled the top
+    ``similarity_top_k * rescore_multiplier`` candidates are re-ranked with the
+    float32 vectors, which are persisted next to the compressed data and
+    memory-mapped from disk instead of being held in RAM.
+    """
+    stores_text: bool = False
+    dtype: str = Field(default="int8", description="float16 or int8.")
+    rescore: bool = Field(default=True, description="Rescore candidates with full-precision vectors.")
+    rescore_multiplier: int = Field(default=4, description="Candidates per requested result to rescore.")
+    keep_full_precision: bool = Field(default=True, description="Persist float32 vectors for rescoring.")
+
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _codes: Optional[np.ndarray] = PrivateAttr(default=None)
+    _norms: Optional[np.ndarray] = PrivateAttr(default=None)
+    _offset: Optional[np.ndarray] = PrivateAttr(default=None)
+    _scale: Optional[np.ndarray] = PrivateAttr(default=None)
+    _full: Optional[np.ndarray] = PrivateAttr(default=None)
+    _pending: List[np.ndarray] = PrivateAttr(default_factory=list)
+    # encoded (codes, norms, full) batches not yet concatenated into the arrays above
+    _chunks: List[tuple] = PrivateAttr(default_factory=list)
+
+    def __init__(self, dtype: str = "int8", rescore: bool = True, rescore_multiplier: int = 4,
+                 keep_full_precision: bool = True, **kwargs: Any) -> None:
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"vector store dtype {dtype} not supported, use one of {SUPPORTED_DTYPES}.")
+        if rescore and not keep_full_precision:
+            raise ValueError("rescore requires keep_full_precision.")
+        super().__init__(dtype=dtype, rescore=rescore, rescore_multiplier=rescore_multiplier,
+                         keep_full_precision=keep_full_precision, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "QuantizedVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    # region storage
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == "float16":
+            return vectors.astype(np.float16)
+        codes = np.rint((vectors - self._offset) / self._scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.dtype == "float16":
+            return codes.astype(np.float32)
+        return codes.astype(np.float32) * self._scale + self._offset
+
+    def _norms_of(self, codes: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(self._decode(codes), axis=1).astype(np.float32)
+
+    def _calibrate(self, vectors: np.ndarray) -> None:
+        """Per-dimension min/max range for int8; widened (and stored vectors re-encoded) when vectors fall outside it."""
+        lo = vectors.min(axis=0)
+        hi = vectors.max(axis=0)
+        if self._offset is None:
+            self._offset = lo.astype(np.float32)
+            self._scale = np.maximum((hi - lo) / 255.0, 1e-12).astype(np.float32)
+            return
+        old_hi = self._offset + self._scale * 255.0
+        # values within half a step of the range round to the end codes without loss
+        if (lo >= self._offset - self._scale / 2).all() and (hi <= old_hi + self._scale / 2).all():
+            return
+        self._merge()
+        stored = None
+        if self._codes is not None and len(self._codes):
+            # re-encode from the float32 vectors when kept, otherwise from the old codes
+            stored = np.asarray(self._full, dtype=np.float32) if self._full is not None else self._decode(self._codes)
+        new_lo = np.minimum(lo, self._offset)
+        new_hi = np.maximum(hi, old_hi)
+        self._offset = new_lo.astype(np.float32)
+        self._scale = np.maximum((new_hi - new_lo) / 255.0, 1e-12).astype(np.float32)
+        if stored is not None:
+            self._codes = self._encode(stored)
+            self._norms = self._norms_of(self._codes)
+        logger.info(f"Vectors outside the int8 calibration range: widened the range and re-encoded "
+                    f"{0 if stored is None else len(stored)} stored vectors")
+
+    def _flush_pending(self) -> None:
+        if not self._pending:
+            return
+        vectors = np.stack(self._pending)
+        self._pending = []
+        if self.dtype == "int8":
+            self._calibrate(vectors)
+        codes = self._encode(vectors)
+        self._chunks.append((codes, self._norms_of(codes), vectors if self.keep_full_precision else None))
+
+    def _merge(self) -> None:
+        if not self._chunks:
+            return
+        chunks, self._chunks = self._chunks, []
+        codes = [c for c, _, _ in chunks]
+        norms = [n for _, n, _ in chunks]
+        if self._codes is not None:
+            codes.insert(0, self._codes)
+            norms.insert(0, self._norms)
+        self._codes = np.concatenate(codes)
+        self._norms = np.concatenate(norms)
+        if self.keep_full_precision:
+            full = [f for _, _, f in chunks]
+            if self._full is not None:
+                full.insert(0, np.asarray(self._full))
+            self._full = np.concatenate(full)
+
+    def _consolidate(self) -> None:
+        self._flush_pending()
+        self._merge()
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        for node in nodes:
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "")
+            self._pending.append(np.asarray(node.get_embedding(), dtype=np.float32))
+        if len(self._pending) >= CONSOLIDATE_EVERY:
+            self._flush_pending()
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._consolidate()
+        keep = np.array([r != ref_doc_id for r in self._ref_doc_ids], dtype=bool)
+        if keep.all():
+            return
+        self._ids = [i for i, k in zip(self._ids, keep) if k]
+        self._ref_doc_ids = [r for r, k in zip(self._ref_doc_ids, keep) if k]
+        self._codes = self._codes[keep]
+        self._norms = self._norms[keep]
+        if self._full is not None:
+            self._full = np.asarray(self._full)[keep]
+
+    def nbytes(self) -> int:
+        """Bytes held in memory by the compressed vectors."""
+        self._consolidate()
+        if self._codes is None:
+            return 0
+        return self._codes.nbytes + self._norms.nbytes
+    # endregion
+
+    # region search
+    def _compressed_scores(self, query: np.ndarray) -> np.ndarray:
+        if self.dtype == "float16":
+            dots = self._codes.astype(np.float32) @ query
+        else:
+            # q . (offset + scale * code) without materializing the dequantized matrix
+            dots = self._codes.astype(np.float32) @ (query * self._scale) + float(query @ self._offset)
+        return dots / (np.clip(self._norms, 1e-12, None) * max(np.linalg.norm(query), 1e-12))
+
+    def _exact_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        full = self._full if rows is None else np.asarray(self._full[rows])
+        norms = np.linalg.norm(full, axis=1)
+        return (full @ query) / (np.clip(norms, 1e-12, None) * max(np.linalg.norm(query), 1e-12))
+
+    def _search(self, query: np.ndarray, k: int, rescore: bool, mask: Optional[np.ndarray] = None) -> tuple:
+        scores = self._compressed_scores(query)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        n_candidates = min(len(scores), k * self.rescore_multiplier if rescore else k)
+        if n_candidates <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        candidates = candidates[np.isfinite(scores[candidates])]
+        if rescore:
+            candidates = np.sort(candidates)
+            scores = self._exact_scores(query, candidates)
+            order = np.argsort(-scores)[:k]
+            return candidates[order], scores[order]
+        order = np.argsort(-scores[candidates])[:k]
+        return candidates[order], scores[candidates[order]]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("Metadata filters not implemented for QuantizedVectorStore.")
+        self._consolidate()
+        if self._codes is None or len(self._ids) == 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        mask = None
+        if query.node_ids:
+            wanted = set(query.node_ids)
+            mask = np.array([i in wanted for i in self._ids], dtype=bool)
+        elif query.doc_ids:
+            wanted = set(query.doc_ids)
+            mask = np.array([r in wanted for r in self._ref_doc_ids], dtype=bool)
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        rows, scores = self._search(q, query.similarity_top_k, self.rescore and self._full is not None, mask)
+        return VectorStoreQueryResult(similarities=scores.tolist(), ids=[self._ids[r] for r in rows])
+
+    def recall_report(self, query_embeddings: List[List[float]], k: int = 10) -> dict:
+        """
+        Recall@k of compressed search (with and without rescoring) against exact float32 search.
+
+        Args:
+            query_embeddings: Query vectors to evaluate with
+            k: Number of results per query
+
+        Returns:
+            dict with recall@k for compressed-only and rescored search and the compression ratio
+        """
+        self._consolidate()
+        if self._full is None:
+            raise ValueError("recall_report requires keep_full_precision.")
+        k = min(k, len(self._ids))
+        compressed_hits = 0
+        rescored_hits = 0
+        for q in query_embeddings:
+            q = np.asarray(q, dtype=np.float32)
+            exact = set(np.argsort(-self._exact_scores(q))[:k].tolist())
+            compressed_hits += len(exact & set(self._search(q, k, rescore=False)[0].tolist()))
+            rescored_hits += len(exact & set(self._search(q, k, rescore=True)[0].tolist()))
+        total = max(len(query_embeddings) * k, 1)
+        report = {
+            "dtype": self.dtype,
+            "k": k,
+            "queries": len(query_embeddings),
+            "recall_compressed": compressed_hits / total,
+            "recall_rescored": rescored_hits / total,
+            "compression_ratio": 4 / self._codes.itemsize,
+        }
+        logger.info(f"Vector store recall report: {report}")
+        return report
+    # endregion
+
+    # region persistence
+    def persist(self, persist_path: str, fs: Optional[Any] = None) -> None:
+        self._consolidate()
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+        with open(persist_path, "w", encoding="utf-8") as f:
+            json.dump({"class_name": self.class_name(), "dtype": self.dtype,
+                       "rescore_multiplier": self.rescore_multiplier,
+                       "keep_full_precision": self.keep_full_precision}, f)
+        arrays = {
+            "ids": np.asarray(self._ids, dtype=object),
+            "ref_doc_ids": np.asarray(self._ref_doc_ids, dtype=object),
+            "codes": self._codes if self._codes is not None else np.zeros((0, 0), dtype=np.uint8),
+            "norms": self._norms if self._norms is not None else np.zeros(0, dtype=np.float32),
+        }
+        if self._offset is not None:
+            arrays["offset"] = self._offset
+            arrays["scale"] = self._scale
+        np.savez(os.path.join(persist_dir, DATA_FNAME), **arrays)
+        if self._full is not None:
+            full_path = os.path.join(persist_dir, FULL_PRECISION_FNAME)
+            if not (isinstance(self._full, np.memmap) and os.path.abspath(self._full.filename) == os.path.abspath(full_path)):
+                np.save(full_path, np.asarray(self._full, dtype=np.float32))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, rescore: bool = True) -> "QuantizedVectorStore":
+        with open(os.path.join(persist_dir, META_FNAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        full_path = os.path.join(persist_dir, FULL_PRECISION_FNAME)
+        has_full = os.path.exists(full_path)
+        store = cls(dtype=meta["dtype"], rescore=rescore and has_full,
+                    rescore_multiplier=meta.get("rescore_multiplier", 4), keep_full_precision=has_full)
+        data = np.load(os.path.join(persist_dir, DATA_FNAME), allow_pickle=True)
+        store._ids = data["ids"].tolist()
+        store._ref_doc_ids = data["ref_doc_ids"].tolist()
+        if len(store._ids):
+            store._codes = data["codes"]
+            store._norms = data["norms"]
+        if "offset" in data:
+            store._offset = data["offset"]
+            store._scale = data["scale"]
+        if has_full:
+            # float32 vectors stay on disk and are paged in only for the rescored candidates
+            store._full = np.load(full_path, mmap_mode="r")
+        return store
+    # endregion
+
+
+def is_quantized_persist_dir(persist_dir: str) -> bool:
+    return os.path.exists(os.path.join(persist_dir, DATA_FNAME))
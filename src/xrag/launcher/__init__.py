@@ -1 +1 @@
-from .launch import run, build_index, build_query_engine, eval_cli
\ No newline at end of file
+from .launch import run, build_index, build_query_engine, eval_cli, record_cli, score_run
\ No newline at end of file
@@ -0,0 +1,229 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core import Document, Settings
+
+from ..config import Config
+from ..data.qa_loader import get_dataset
+from ..embs.embedding import get_embedding
+from ..eval.run_file import run_meta
+from ..index import get_index
+from ..llms.stub import get_stub_llm
+from ..process.query_transform import transform_and_query
+from ..retrievers.retriever import get_retriver
+from ..utils import get_module_logger
+from ..utils.memory import get_memory_tracker
+from ..utils.profiling import dump_profiles, profile_phase
+from ..utils.tracing import get_tracer
+from .launch import build_query_engine
+
+logger = get_module_logger(__name__)
+
+# 基准测试：在可复现的语料上测量建索引吞吐、从 persist_dir 加载耗时、各检索器的 QPS 与延迟分位数，
+# 以及使用桩 LLM 的端到端查询延迟，结果写成 JSON 便于跨提交比较
+
+DEFAULT_RETRIEVERS = ["BM25", "Vector", "Hybrid"]
+SAMPLE_DATA_DIR = "examples/data"
+SAMPLE_QA_PATH = "examples/generated_qa.json"
+
+
+def synthetic_corpus(n_docs=1000, doc_words=200, n_queries=200, seed=42, vocab_size=5000):
+    """
+    生成可复现的合成语料
+
+    Returns:
+        (documents, queries)；每个查询取自某个文档中连续的 8 个词
+    """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocab = ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(vocab_size)]
+    # Zipf 分布的词频更接近真实文本，BM25 的倒排表长度也更真实
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    documents = []
+    for i in range(n_docs):
+        words = rng.choices(vocab, weights=weights, k=doc_words)
+        sentences = [" ".join(words[j:j + 20]).capitalize() + "." for j in range(0, doc_words, 20)]
+        documents.append(Document(text=" ".join(sentences), metadata={"id": f"doc-{i}"}))
+    queries = []
+    for _ in range(n_queries):
+        words = documents[rng.randrange(n_docs)].text.replace(".", "").split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + 8]).lower())
+    return documents, queries
+
+
+def sample_corpus(data_dir=SAMPLE_DATA_DIR, qa_path=SAMPLE_QA_PATH, n_queries=200):
+    """examples/data 下的示例文档，查询使用 examples/generated_qa.json 中的问题（循环到 n_queries 个）"""
+    documents = get_dataset(data_dir)
+    questions = []
+    if qa_path and os.path.exists(qa_path):
+        with open(qa_path, "r", encoding="utf-8") as f:
+            questions = [item["question"] for item in json.load(f)]
+    if not questions:
+        questions = [doc.text[:100] for doc in documents]
+    return documents, [questions[i % len(questions)] for i in range(n_queries)]
+
+
+def latency_stats(latencies_ms, total_seconds):
+    latencies = np.asarray(latencies_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "n": int(len(latencies)),
+        "qps": round(len(latencies) / total_seconds, 3) if total_seconds > 0 else None,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "max_ms": round(float(latencies.max()), 3),
+    }
+
+
+def time_calls(fn, queries, warmup=10):
+    for query in queries[:warmup]:
+        fn(query)
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        t = time.perf_counter()
+        fn(query)
+        latencies.append((time.perf_counter() - t) * 1000)
+    return latency_stats(latencies, time.perf_counter() - start)
+
+
+def bench_embedding(name, cfg):
+    """``stub:<dim>`` 不加载模型，只测框架本身的开销"""
+    return get_embedding(name, cfg.embed_batch_size, backend=getattr(cfg, 'embedding_backend', 'torch'),
+                         onnx_cache_dir=getattr(cfg, 'onnx_cache_dir', 'onnx_models'))
+
+
+def bench_corpus(documents, queries, cfg, retrievers, warmup=10, e2e_queries=50):
+    result = {"n_docs": len(documents), "n_queries": len(queries)}
+    with tempfile.TemporaryDirectory(prefix="xrag-bench-") as tmp:
+        persist_dir = os.path.join(tmp, "index")
+        index_args = dict(split_type=cfg.split_type, chunk_size=cfg.chunk_size, chunk_overlap=cfg.chunk_overlap,
+                          chunk_sizes=cfg.chunk_sizes,
+                          vector_store_dtype=getattr(cfg, 'vector_store_dtype', 'float32'),
+                          rescore_multiplier=getattr(cfg, 'rescore_multiplier', 4))
+
+        start = time.perf_counter()
+        with profile_phase("index_build"):
+            index, hierarchical_storage_context = get_index(documents, persist_dir, **index_args)
+        build_seconds = time.perf_counter() - start
+        # 每个节点计算一个向量，nodes_per_s 即向量化吞吐；只数 id，不反序列化 docstore
+        n_nodes = len(index.index_struct.nodes_dict)
+        result["build"] = {
+            "seconds": round(build_seconds, 3),
+            "nodes": n_nodes,
+            "docs_per_s": round(len(documents) / build_seconds, 3),
+            "nodes_per_s": round(n_nodes / build_seconds, 3),
+        }
+        logger.info(f"index build: {result['build']}")
+
+        start = time.perf_counter()
+        with profile_phase("index_load"):
+            index, hierarchical_storage_context = get_index(documents, persist_dir, **index_args)
+        result["load"] = {"seconds": round(time.perf_counter() - start, 3)}
+        logger.info(f"index load: {result['load']}")
+
+        result["retrieval"] = {}
+        for name in retrievers:
+            try:
+                retriever = get_retriver(name, index, hierarchical_storage_context=hierarchical_storage_context,
+                                         cfg=cfg)
+                with profile_phase("retrieval"):
+                    result["retrieval"][name] = time_calls(retriever.retrieve, queries, warmup)
+            except Exception as e:
+                logger.warning(f"retriever {name} failed: {e!r}")
+                result["retrieval"][name] = {"error": repr(e)}
+            logger.info(f"retrieval {name}: {result['retrieval'][name]}")
+
+        tracer = get_tracer()
+        tracer.reset()
+        query_engine = build_query_engine(index, hierarchical_storage_context)
+        with profile_phase("query"):
+            result["e2e"] = time_calls(lambda q: transform_and_query(q, cfg, query_engine), queries[:e2e_queries],
+                                       min(warmup, e2e_queries))
+        result["e2e"]["retriever"] = cfg.retriever
+        result["e2e_stages"] = tracer.stage_summary()
+        logger.info(f"end-to-end: {result['e2e']}")
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def run_bench(corpora=("synthetic", "sample"), n_docs=1000, doc_words=200, n_queries=200, warmup=10,
+              e2e_queries=50, retrievers=None, embeddings=None, seed=42, output=""):
+    """
+    运行基准测试
+
+    Args:
+        corpora: synthetic（合成语料）、sample（examples/data）或其他文档文件夹路径
+        n_docs, doc_words: 合成语料的文档数和每篇词数
+        n_queries: 每个检索器计时的查询数
+        warmup: 计时前的预热查询数
+        e2e_queries: 端到端计时的查询数（使用桩 LLM）
+        retrievers: 要测量的检索器类型，默认 BM25 / Vector / Hybrid
+        embeddings: 嵌入模型，默认使用 cfg.embeddings；stub:<dim> 只测框架开销
+        seed: 合成语料的随机种子
+        output: 结果 JSON 的路径，默认 bench_results/bench-<时间>.json
+
+    Returns:
+        结果字典
+    """
+    cfg = Config()
+    embeddings = embeddings or cfg.embeddings
+    retrievers = list(retrievers or DEFAULT_RETRIEVERS)
+    Settings.chunk_size = cfg.chunk_size
+    Settings.embed_model = bench_embedding(embeddings, cfg)
+    # 端到端延迟使用桩 LLM（延迟和输出长度见 config.toml 的 stub_llm_*），只测 RAG 流程本身
+    Settings.llm = get_stub_llm(cfg)
+    # 重复的查询不能命中查询结果缓存和检索结果缓存，否则测到的是缓存延迟
+    cfg.query_cache = False
+    cfg.retrieval_cache = False
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "embeddings": embeddings,
+            "llm": "stub",
+            "config": run_meta(cfg),
+        },
+        "corpora": {},
+    }
+    for corpus in corpora:
+        if corpus == "synthetic":
+            documents, queries = synthetic_corpus(n_docs, doc_words, n_queries, seed)
+        elif corpus == "sample":
+            documents, queries = sample_corpus(n_queries=n_queries)
+        else:
+            documents, queries = sample_corpus(corpus, qa_path="", n_queries=n_queries)
+        logger.info(f"benchmarking corpus {corpus}: {len(documents)} documents, {len(queries)} queries")
+        results["corpora"][corpus] = bench_corpus(documents, queries, cfg, retrievers, warmup, e2e_queries)
+
+    tracker = get_memory_tracker()
+    if tracker is not None:
+        # 各阶段（node_parsing / embedding / persistence / index_load ...）的 RSS 峰值
+        results["memory"] = tracker.report()
+
+    output = output or os.path.join("bench_results", time.strftime("bench-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Benchmark results saved to {output}")
+    dump_profiles()
+    return results
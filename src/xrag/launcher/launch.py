@@ -3,18 +3,27 @@ os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core import Settings, PromptTemplate
 from ..llms import get_llm
-from ..index import get_index
-from ..eval.evaluate_rag import evaluating
+from ..index import get_index, index_version
+from ..index.vector_store import QuantizedVectorStore
+from ..eval.evaluate_rag import evaluating, benchmark_evaluator_overhead, UptrainBatchEvaluator
 from ..embs.embedding import get_embedding
+from ..embs.quantized import check_embedding_accuracy
 from ..data.qa_loader import get_qa_dataset
 from ..config import Config
 from ..retrievers.retriever import get_retriver, query_expansion, response_synthesizer
 import warnings
 from ..eval.evaluate_rag import EvaluationResult
 from ..eval.EvalModelAgent import EvalModelAgent
+from ..eval.run_file import RunFileWriter, make_record, read_run_file, record_to_response, run_meta
 from ..process.postprocess_rerank import get_postprocessor
 from ..process.query_transform import transform_and_query
+from ..utils import get_model_registry
+from ..utils.memory import memory_phase, memory_pressure, get_memory_tracker, report_memory
+from ..utils.profiling import dump_profiles, profile_phase
+from ..utils.tracing import export_trace
 import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 def seed_everything(seed):
@@ -28,7 +37,15 @@ def build_index(documents):
     cfg = Config()
     llm = get_llm(cfg.llm)
     # Create and dl embeddings instance
-    embeddings = get_embedding(cfg.embeddings,cfg.embed_batch_size)
+    embedding_backend = getattr(cfg, 'embedding_backend', 'torch')
+    embeddings = get_embedding(cfg.embeddings, cfg.embed_batch_size, backend=embedding_backend,
+                               onnx_cache_dir=getattr(cfg, 'onnx_cache_dir', 'onnx_models'))
+    if embedding_backend != 'torch' and getattr(cfg, 'embedding_accuracy_samples', 0) > 0:
+        # compare against the fp32 vectors on a sample of the corpus, then release the fp32 model
+        sample_texts = [doc.text[:2000] for doc in documents[:cfg.embedding_accuracy_samples]]
+        check_embedding_accuracy(get_embedding(cfg.embeddings, cfg.embed_batch_size), embeddings, sample_texts,
+                                 threshold=getattr(cfg, 'embedding_accuracy_threshold', 0.98))
+        get_model_registry().evict(cfg.embeddings, dtype="float32")
 
     Settings.chunk_size = cfg.chunk_size
     Settings.llm = llm
@@ -37,13 +54,33 @@ def build_index(documents):
 
     cfg.persist_dir = cfg.persist_dir + '-' + cfg.dataset + '-' + cfg.embeddings + '-' + cfg.split_type + '-' + str(
         cfg.chunk_size)
+    if embedding_backend != 'torch':
+        # quantized vectors are not interchangeable with fp32 ones
+        cfg.persist_dir = cfg.persist_dir + '-' + embedding_backend
 
+    vector_store_dtype = getattr(cfg, 'vector_store_dtype', 'float32')
+    if vector_store_dtype != 'float32':
+        cfg.persist_dir = cfg.persist_dir + '-' + vector_store_dtype
     index, hierarchical_storage_context = get_index(documents, cfg.persist_dir, split_type=cfg.split_type,
-                                                    chunk_size=cfg.chunk_size,chunk_overlap=cfg.chunk_overlap,chunk_sizes=cfg.chunk_sizes)
-
+                                                    chunk_size=cfg.chunk_size,chunk_overlap=cfg.chunk_overlap,chunk_sizes=cfg.chunk_sizes,
+                                                    vector_store_dtype=vector_store_dtype,
+                                                    rescore_multiplier=getattr(cfg, 'rescore_multiplier', 4))
+    # 查询结果缓存的键包含索引版本，重建索引后旧的缓存项不再命中
+    cfg.index_version = index_version(cfg.persist_dir)
 
     return index, hierarchical_storage_context
 
+def vector_store_recall_report(index, qa_dataset):
+    # compare compressed search against exact float32 search on the test questions
+    cfg = Config()
+    n = getattr(cfg, 'vector_store_recall_queries', 0)
+    vector_store = index.vector_store
+    if n <= 0 or not isinstance(vector_store, QuantizedVectorStore) or not vector_store.keep_full_precision:
+        return None
+    questions = qa_dataset['test_data']['question'][:n]
+    query_embeddings = [Settings.embed_model.get_query_embedding(q) for q in questions]
+    return vector_store.recall_report(query_embeddings, k=getattr(cfg, 'similarity_top_k_VECTOR', 10))
+
 def build_query_engine(index, hierarchical_storage_context, use_async=False):
     cfg = Config()
     query_engine = RetrieverQueryEngine(
@@ -72,6 +109,11 @@ def eval_cli(qa_dataset, query_engine):
     all_num = 0
     evaluateResults = EvaluationResult(metrics=cfg.metrics)
     evalAgent = EvalModelAgent(cfg)
+    if getattr(cfg, "benchmark_evaluator_overhead", False):
+        benchmark_evaluator_overhead(evalAgent, cfg.metrics)
+    uptrain_batch = None
+    if getattr(cfg, "uptrain_batch_size", 1) > 1:
+        uptrain_batch = UptrainBatchEvaluator(evalAgent, cfg.metrics, cfg.uptrain_batch_size, aggregate=evaluateResults)
     if cfg.experiment_1:
         if len(qa_dataset) < cfg.test_init_total_number_documents:
             warnings.filterwarnings('default')
@@ -84,7 +126,8 @@ def eval_cli(qa_dataset, query_engine):
             qa_dataset['test_data']['golden_context'][:cfg.test_init_total_number_documents],
             qa_dataset['test_data']['golden_context_ids'][:cfg.test_init_total_number_documents]
     ):
-        response = transform_and_query(question, cfg, query_engine)
+        with profile_phase("query"), memory_phase("query"):
+            response = transform_and_query(question, cfg, query_engine)
         # 返回node节点
         retrieval_ids = []
         retrieval_context = []
@@ -92,28 +135,127 @@ def eval_cli(qa_dataset, query_engine):
             retrieval_ids.append(source_node.metadata['id'])
             retrieval_context.append(source_node.get_content())
         actual_response = response.response
-        eval_result = evaluating(question, response, actual_response, retrieval_context, retrieval_ids,
-                                 expected_answer, golden_context, golden_context_ids, evaluateResults.metrics,
-                                 evalAgent)
+        with profile_phase("eval"), memory_phase("eval"):
+            eval_result = evaluating(question, response, actual_response, retrieval_context, retrieval_ids,
+                                     expected_answer, golden_context, golden_context_ids, evaluateResults.metrics,
+                                     evalAgent, uptrain_batch)
         evaluateResults.add(eval_result)
+        # UpTrain 得分直接累加到 evaluateResults，必须在 add 之后评测批次
+        if uptrain_batch is not None:
+            with profile_phase("eval"), memory_phase("eval"):
+                uptrain_batch.maybe_flush()
+        if memory_pressure():
+            # 超出软内存预算：先评测已累积的 UpTrain 批次，再释放缓存
+            if uptrain_batch is not None:
+                uptrain_batch.flush()
+            get_memory_tracker().reclaim("evaluation")
         all_num = all_num + 1
         evaluateResults.print_results()
         print("总数：" + str(all_num))
+    if uptrain_batch is not None:
+        with profile_phase("eval"), memory_phase("eval"):
+            uptrain_batch.flush()
+        evaluateResults.print_results()
+    evaluateResults.set_stage_latency(export_trace())
+    evaluateResults.print_stage_latency()
     return evaluateResults
-def run(cli=True, custom_dataset=None):
+def record_cli(qa_dataset, query_engine, run_file):
+    """第一阶段：对测试集跑 RAG，把回答、检索 id 和上下文写入运行文件，不做评测"""
+    cfg = Config()
+    n = cfg.test_init_total_number_documents if cfg.experiment_1 else cfg.n
+    test_data = qa_dataset['test_data']
+    with RunFileWriter(run_file, run_meta(cfg)) as writer:
+        for all_num, (question, expected_answer, golden_context, golden_context_ids) in enumerate(zip(
+                test_data['question'][:n], test_data['expected_answer'][:n],
+                test_data['golden_context'][:n], test_data['golden_context_ids'][:n]), start=1):
+            start = time.perf_counter()
+            with profile_phase("query"), memory_phase("query"):
+                response = transform_and_query(question, cfg, query_engine)
+            latency_ms = (time.perf_counter() - start) * 1000
+            writer.write(make_record(question, expected_answer, golden_context, golden_context_ids, response,
+                                     latency_ms))
+            print("总数：" + str(all_num))
+    print(f"Run file saved to {run_file}")
+    export_trace()
+    return run_file
+
+
+def score_run(run_file, metrics=None, concurrency=None, evalAgent=None):
+    """
+    第二阶段：用任意指标集合对运行文件打分，多个问题并发评测，UpTrain 按批评测
+
+    Args:
+        run_file: record_cli 生成的运行文件（.jsonl 或 .parquet）
+        metrics: 评测指标，默认使用 cfg.metrics
+        concurrency: 同时评测的问题数，默认使用 cfg.score_concurrency
+        evalAgent: 已有的 EvalModelAgent，默认新建
+
+    Returns:
+        EvaluationResult
+    """
+    cfg = Config()
+    metrics = list(cfg.metrics if metrics is None else metrics)
+    concurrency = concurrency or getattr(cfg, "score_concurrency", 4)
+    _, records = read_run_file(run_file)
+    evaluateResults = EvaluationResult(metrics=metrics)
+    evalAgent = evalAgent or EvalModelAgent(cfg)
+    # 打分阶段总是批量评测 UpTrain，未配置批大小时每 16 个问题一批
+    uptrain_batch_size = getattr(cfg, "uptrain_batch_size", 1)
+    uptrain_batch = UptrainBatchEvaluator(evalAgent, metrics, uptrain_batch_size if uptrain_batch_size > 1 else 16)
+
+    def score(record):
+        return evaluating(record["question"], record_to_response(record), record["response"],
+                          list(record["retrieval_context"]), list(record["retrieval_ids"]),
+                          record["expected_answer"], list(record["golden_context"]),
+                          list(record["golden_context_ids"]), evaluateResults.metrics, evalAgent, uptrain_batch)
+
+    # cprofile 模式只统计主线程，评测线程池内的调用需要 sampling 模式才能看到
+    with profile_phase("eval"), memory_phase("eval"):
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="xrag-score") as pool:
+            eval_results = list(pool.map(score, records))
+        uptrain_batch.flush()
+    # UpTrain 的批量得分写回后再汇总
+    for eval_result in eval_results:
+        evaluateResults.add(eval_result)
+    evaluateResults.print_results()
+    print("总数：" + str(len(eval_results)))
+    evaluateResults.set_stage_latency(export_trace())
+    evaluateResults.print_stage_latency()
+    return evaluateResults
+
+
+def run(cli=True, custom_dataset=None, run_file=None, record_only=False):
 
     seed_everything(42)
     cfg = Config()
-    if cfg.dataset_type == 'local':
-        print('Using local dataset')
-        qa_dataset = get_qa_dataset(cfg.dataset, cfg.dataset_path)
-    else:
-        print('Using huggingface dataset')
-        qa_dataset = get_qa_dataset(cfg.dataset, cfg.dataset_path)
-    index, hierarchical_storage_context = build_index(qa_dataset['documents'])
+    with memory_phase("dataset_load"):
+        if cfg.dataset_type == 'local':
+            print('Using local dataset')
+            qa_dataset = get_qa_dataset(cfg.dataset, cfg.dataset_path)
+        else:
+            print('Using huggingface dataset')
+            qa_dataset = get_qa_dataset(cfg.dataset, cfg.dataset_path)
+    with profile_phase("index_build"):
+        index, hierarchical_storage_context = build_index(qa_dataset['documents'])
+    vector_store_recall_report(index, qa_dataset)
     query_engine = build_query_engine(index, hierarchical_storage_context)
     if cli:
-        evaluateResults = eval_cli(qa_dataset, query_engine)
+        run_file = run_file or getattr(cfg, "run_file", "")
+        if run_file:
+            # 先记录再评测
+            record_cli(qa_dataset, query_engine, run_file)
+            if record_only:
+                report_memory()
+                dump_profiles()
+                return None
+            evaluateResults = score_run(run_file)
+        else:
+            evaluateResults = eval_cli(qa_dataset, query_engine)
+        if hasattr(query_engine.retriever, "stage_metrics"):
+            print(f"Cascade stage latency: {query_engine.retriever.stage_metrics()}")
+        get_model_registry().log_memory_report()
+        report_memory()
+        dump_profiles()
         return evaluateResults
     else:
         return query_engine, qa_dataset
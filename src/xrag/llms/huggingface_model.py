@@ -6,7 +6,7 @@ from transformers.generation.utils import GenerationConfig
 from llama_index.llms.huggingface import HuggingFaceLLM
 # pip install llama-index-llms-huggingface
 from ..config import Config
-from ..utils import get_module_logger
+from ..utils import get_module_logger, get_model_registry
 
 cfg = Config()
 logger = get_module_logger(__name__)
@@ -201,9 +201,45 @@ llm_argument_dict = {
     "01-ai/Yi-6B-Chat": {"context_window": 4096, "generate_kwargs": {"temperature": 0}},
 }
 
+# precision each loader above uses, part of the model registry key
+llm_dtype_dict = {
+    "meta-llama/Llama-2-7b-chat-hf": "int8",
+    "tiiuae/falcon-7b-instruct": "auto",
+    "mosaicml/mpt-7b-chat": "auto",
+}
+
+
+def causal_lm_model_and_tokenizer(name):
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    model = AutoModelForCausalLM.from_pretrained(name,
+                                                 torch_dtype=torch.float16,
+                                                 device_map="auto").eval()
+    return tokenizer, model
+
+
+def get_huggingface_model_and_tokenizer(name):
+    """Load (tokenizer, model) for ``name`` through the shared model registry."""
+    loader = tokenizer_and_model_fn_dict[name]
+    return get_model_registry().get(name, lambda: loader(name),
+                                    dtype=llm_dtype_dict.get(name, "float16"), device="auto")
+
+
+def get_judge_model_and_tokenizer(name):
+    """
+    Load a local judge model through the shared model registry.
+
+    Supported generators reuse their own loader, so a judge that is also the
+    generator is loaded once; any other causal LM is loaded in float16.
+    """
+    if name in tokenizer_and_model_fn_dict:
+        return get_huggingface_model_and_tokenizer(name)
+    return get_model_registry().get(name, lambda: causal_lm_model_and_tokenizer(name),
+                                    dtype="float16", device="auto")
+
+
 def get_huggingfacellm(name):
     logger.info("name is " + name)
-    tokenizer, model = tokenizer_and_model_fn_dict[name](name)
+    tokenizer, model = get_huggingface_model_and_tokenizer(name)
 
     # Create a HF LLM using the llama index wrapper
     llm = HuggingFaceLLM(context_window=llm_argument_dict[name]["context_window"],
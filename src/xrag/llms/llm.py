@@ -1,6 +1,7 @@
 from llama_index.llms.openai import OpenAI
 from llama_index.llms.ollama import Ollama
 from .huggingface_model import get_huggingfacellm
+from .stub import get_stub_llm
 from ..config import Config
 
 
@@ -30,6 +31,8 @@ def get_llm(name):
         return get_openai(api_base=Config().api_base, api_key=Config().api_key, temperature=Config().temperature, model=Config().api_name)
     elif name == 'ollama':
         return Ollama(model=Config().ollama_model, request_timeout=Config().ollama_request_timeout)
+    elif name == 'stub':
+        return get_stub_llm(Config())
     else:
         raise ValueError(f"no model name: {name}.")
 
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any
+
+from llama_index.core.llms import (
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+# 桩 LLM：不加载模型、不访问网络，输出只由 prompt 决定，
+# 延迟和输出 token 数可配置，用于基准测试、压测和离线跑通整个流程
+
+
+def _rng(text: str, seed: int) -> random.Random:
+    digest = hashlib.sha256(f"{seed}:{text}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+class StubLLM(CustomLLM):
+    """
+    Deterministic LLM stub.
+
+    Every completion takes ``latency_ms + ms_per_token * output_tokens`` and
+    returns ``output_tokens`` pseudo-words derived from a hash of the prompt.
+    With ``judge`` set, the words are wrapped in output the judge parsers accept
+    (see ``judge_output``). Token usage is reported in ``raw["usage"]`` like the
+    OpenAI backend does.
+    """
+
+    latency_ms: float = 0.0
+    ms_per_token: float = 0.0
+    output_tokens: int = 32
+    judge: bool = False
+    seed: int = 0
+    context_window: int = 32768
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.output_tokens, model_name="stub")
+
+    def _delay_seconds(self) -> float:
+        return (self.latency_ms + self.ms_per_token * self.output_tokens) / 1000.0
+
+    def _response(self, prompt: str) -> CompletionResponse:
+        rng = _rng(prompt, self.seed)
+        words = ["".join(rng.choice("etaoinshrdlu") for _ in range(rng.randint(2, 8)))
+                 for _ in range(self.output_tokens)]
+        text = " ".join(words)
+        if self.judge:
+            text = judge_output(prompt, text)
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": self.output_tokens}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return CompletionResponse(text=text, raw={"usage": usage})
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        delay = self._delay_seconds()
+        if delay > 0:
+            time.sleep(delay)
+        return self._response(prompt)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        delay = self._delay_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._response(prompt)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        response = self._response(prompt)
+        token_delay = self.ms_per_token / 1000.0
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for i, word in enumerate(response.text.split(" ")):
+                if token_delay > 0:
+                    time.sleep(token_delay)
+                delta = word if i == 0 else " " + word
+                text += delta
+                yield CompletionResponse(text=text, delta=delta, raw=response.raw)
+
+        return gen()
+
+
+def judge_output(prompt: str, reason: str) -> str:
+    """
+    Judge answer in a format the evaluation parsers accept.
+
+    DeepEval prompts ask for JSON (statements, truths, claims, opinions and
+    verdicts, depending on the metric), so they get one object carrying every key
+    with a single "yes" verdict. The LlamaIndex evaluators get a score on the
+    first line (Correctness), YES (Faithfulness, Relevancy) and a
+    ``[RESULT] n`` line (AnswerRelevancy).
+    """
+    if "JSON" in prompt:
+        return json.dumps({
+            "statements": [reason], "truths": [reason], "claims": [reason], "opinions": [reason],
+            "verdicts": [{"verdict": "yes", "reason": reason}], "verdict": "yes", "reason": reason,
+        })
+    return f"4.0\nYES {reason}\n[RESULT] 2"
+
+
+def get_stub_llm(cfg, judge: bool = False) -> StubLLM:
+    return StubLLM(latency_ms=getattr(cfg, "stub_llm_latency_ms", 0.0),
+                   ms_per_token=getattr(cfg, "stub_llm_ms_per_token", 0.0),
+                   output_tokens=getattr(cfg, "stub_llm_output_tokens", 32),
+                   seed=getattr(cfg, "stub_seed", 0),
+                   judge=judge)
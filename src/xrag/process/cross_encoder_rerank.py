@@ -0,0 +1,168 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Any, List, Optional, Tuple
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from ..utils import get_module_logger, get_model_registry
+
+logger = get_module_logger(__name__)
+
+
+class CrossEncoderScorer:
+    """
+    A resident cross-encoder shared by every query engine in the process.
+
+    Pair scores are cached by (query hash, node id). Requests coming from
+    concurrent queries are queued and scored together in padded batches by a
+    single worker thread, so the model sees full batches instead of one small
+    batch per query.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, cache_size: int = 10000,
+                 batch_wait_ms: float = 0.0, device: Optional[str] = None, max_length: int = 512):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.batch_wait_ms = batch_wait_ms
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: Queue = Queue()
+        self._worker = threading.Thread(target=self._run, name="xrag-rerank", daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def query_hash(query: str) -> str:
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    def score(self, query: str, nodes: List[Tuple[str, str]]) -> List[float]:
+        """
+        Score (node id, node text) pairs against one query.
+
+        Args:
+            query: The query string
+            nodes: List of (node_id, text) tuples
+
+        Returns:
+            One relevance score per node, in input order
+        """
+        qh = self.query_hash(query)
+        scores: List[Optional[float]] = [None] * len(nodes)
+        missing = []
+        with self._cache_lock:
+            for i, (node_id, _) in enumerate(nodes):
+                cached = self._cache.get((qh, node_id))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end((qh, node_id))
+                    scores[i] = cached
+            self.cache_hits += len(nodes) - len(missing)
+            self.cache_misses += len(missing)
+
+        if missing:
+            future: Future = Future()
+            self._queue.put(([(query, nodes[i][1]) for i in missing], future))
+            new_scores = future.result()
+            with self._cache_lock:
+                for i, s in zip(missing, new_scores):
+                    scores[i] = s
+                    self._cache[(qh, nodes[i][0])] = s
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def _run(self) -> None:
+        while True:
+            requests = [self._queue.get()]
+            n_pairs = len(requests[0][0])
+            deadline = time.monotonic() + self.batch_wait_ms / 1000.0
+            # gather whatever other queries are waiting, up to one full batch
+            while n_pairs < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                requests.append(item)
+                n_pairs += len(item[0])
+
+            pairs = [pair for req_pairs, _ in requests for pair in req_pairs]
+            try:
+                flat = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+                flat = [float(s) for s in flat]
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for req_pairs, future in requests:
+                future.set_result(flat[offset:offset + len(req_pairs)])
+                offset += len(req_pairs)
+
+
+def get_cross_encoder_scorer(model_name: str, batch_size: int = 32, cache_size: int = 10000,
+                             batch_wait_ms: float = 0.0, device: Optional[str] = None) -> CrossEncoderScorer:
+    return get_model_registry().get(
+        "cross-encoder:" + model_name,
+        lambda: CrossEncoderScorer(model_name, batch_size=batch_size, cache_size=cache_size,
+                                   batch_wait_ms=batch_wait_ms, device=device),
+        dtype="float32",
+        device=device,
+    )
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """Rerank nodes with a resident, batched and cached cross-encoder."""
+    model: str = Field(default="BAAI/bge-reranker-base", description="Cross-encoder model name.")
+    top_n: int = Field(default=3, description="Number of nodes to return.")
+    max_candidates: int = Field(default=0, description="Only rerank the best N nodes by first-stage score (0 = all).")
+    min_first_stage_score: Optional[float] = Field(default=None, description="Drop nodes below this first-stage score before reranking.")
+
+    _scorer: CrossEncoderScorer = PrivateAttr()
+
+    def __init__(self, model: str = "BAAI/bge-reranker-base", top_n: int = 3, max_candidates: int = 0,
+                 min_first_stage_score: Optional[float] = None, batch_size: int = 32, cache_size: int = 10000,
+                 batch_wait_ms: float = 0.0, device: Optional[str] = None, **kwargs: Any) -> None:
+        super().__init__(model=model, top_n=top_n, max_candidates=max_candidates,
+                         min_first_stage_score=min_first_stage_score, **kwargs)
+        self._scorer = get_cross_encoder_scorer(model, batch_size=batch_size, cache_size=cache_size,
+                                                batch_wait_ms=batch_wait_ms, device=device)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if len(nodes) == 0:
+            return []
+
+        # early cut-off on the cheap first-stage score
+        candidates = nodes
+        if self.min_first_stage_score is not None:
+            candidates = [n for n in candidates if n.score is None or n.score >= self.min_first_stage_score]
+        if self.max_candidates and len(candidates) > self.max_candidates:
+            candidates = sorted(candidates, key=lambda n: n.score or 0.0, reverse=True)[:self.max_candidates]
+        if not candidates:
+            return []
+
+        scores = self._scorer.score(
+            query_bundle.query_str,
+            [(n.node.node_id, n.node.get_content(metadata_mode=MetadataMode.EMBED)) for n in candidates],
+        )
+        reranked = [NodeWithScore(node=n.node, score=s) for n, s in zip(candidates, scores)]
+        reranked.sort(key=lambda n: n.score, reverse=True)
+        return reranked[:self.top_n]
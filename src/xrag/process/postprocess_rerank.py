@@ -2,19 +2,31 @@ from llama_index.core.postprocessor import LongContextReorder
 from llama_index.postprocessor.colbert_rerank import ColbertRerank
 from llama_index.postprocessor.cohere_rerank import CohereRerank
 from llama_index.postprocessor.flag_embedding_reranker import FlagEmbeddingReranker
+from ..utils import get_model_registry
+from .cross_encoder_rerank import CrossEncoderRerank
 
 # !pip install llama-index-postprocessor-colbert-rerank
 # !pip install llama-index-postprocessor-cohere-rerank
 
 def get_postprocessor(cfg):
-    # postprocess rerank, available: long_context_reorder, colbertv2_rerank, cohere_rerank, bge-reranker-base
+    # postprocess rerank, available: long_context_reorder, colbertv2_rerank, cohere_rerank, bge-reranker-base, cross_encoder_rerank
     if cfg.postprocess_rerank == 'long_context_reorder':
         return LongContextReorder()
     elif cfg.postprocess_rerank == 'colbertv2_rerank':
-        return ColbertRerank()
+        return get_model_registry().get("colbert-ir/colbertv2.0", ColbertRerank)
     elif cfg.postprocess_rerank == 'cohere_rerank':
         return CohereRerank()
     elif cfg.postprocess_rerank == 'bge-reranker-base':
-        return FlagEmbeddingReranker(model="BAAI/bge-reranker-base")
+        return get_model_registry().get("BAAI/bge-reranker-base",
+                                        lambda: FlagEmbeddingReranker(model="BAAI/bge-reranker-base"),
+                                        dtype="float32")
+    elif cfg.postprocess_rerank == 'cross_encoder_rerank':
+        return CrossEncoderRerank(model=getattr(cfg, 'rerank_model', 'BAAI/bge-reranker-base'),
+                                  top_n=getattr(cfg, 'rerank_top_n', 3),
+                                  max_candidates=getattr(cfg, 'rerank_max_candidates', 0),
+                                  min_first_stage_score=getattr(cfg, 'rerank_min_first_stage_score', None),
+                                  batch_size=getattr(cfg, 'rerank_batch_size', 32),
+                                  cache_size=getattr(cfg, 'rerank_cache_size', 10000),
+                                  batch_wait_ms=getattr(cfg, 'rerank_batch_wait_ms', 0.0))
     else:
         raise Exception("postprocess_rerank not supported: %s" % cfg.postprocess_rerank)
\ No newline at end of file
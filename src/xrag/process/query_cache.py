@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Optional, Tuple
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+from ..utils import get_module_logger
+from ..utils.sqlite_cache import SqliteLRUCache
+
+logger = get_module_logger(__name__)
+
+# 查询结果缓存：相同的（规范化后的）问题、相同的配置、相同版本的索引直接返回上次的回答，
+# 跳过查询转换、检索、重排和生成
+
+# 影响回答的配置段；缓存、API key 等不影响回答的键不参与指纹
+FINGERPRINT_SECTIONS = ("llm_settings", "embedding_settings", "chunk_settings", "dataset_settings",
+                        "responce_synthsizer", "retrieval_settings", "postprocessor_setting", "query_settings",
+                        "prompt")
+_IGNORED_KEY_RE = re.compile(r"(_cache(_\w+)?|^api_key|^auth_token|^metrics|^show_progress\w*|^benchmark_\w+)$")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """NFKC、大小写折叠并合并空白，只在写法上不同的问题共用一个缓存项"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", query).casefold()).strip()
+
+
+def config_fingerprint(cfg, sections=FINGERPRINT_SECTIONS) -> str:
+    """sections 中配置项（含覆盖后的值）的哈希；包含 prompt 段时提示词模板按路径和修改时间计入"""
+    values = {}
+    for section in sections:
+        for key in getattr(cfg, "config", {}).get(section, {}):
+            if not _IGNORED_KEY_RE.search(key):
+                values[key] = getattr(cfg, key, None)
+    if "prompt" in sections:
+        for key in ("text_qa_template_path", "refine_template_path"):
+            path = getattr(cfg, key, "")
+            values[key + "_mtime"] = os.path.getmtime(path) if path and os.path.exists(path) else None
+    raw = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def response_to_json(response: Response) -> dict:
+    return {
+        "response": response.response,
+        "source_nodes": [{"node": doc_to_json(n.node), "score": n.score} for n in response.source_nodes],
+        "metadata": response.metadata,
+    }
+
+
+def response_from_json(data: dict) -> Response:
+    source_nodes = [NodeWithScore(node=json_to_doc(n["node"]), score=n["score"]) for n in data["source_nodes"]]
+    return Response(response=data["response"], source_nodes=source_nodes, metadata=data.get("metadata"))
+
+
+class QueryCache(SqliteLRUCache):
+    """
+    Cache of final query responses.
+
+    Entries are keyed by (normalized query, config fingerprint, index version),
+    expire after ``ttl_seconds`` and are evicted LRU. With a path they are also
+    persisted to SQLite. A rebuilt index has a new version, so its queries never
+    hit entries of the old one.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10000, memory_entries: int = 10000,
+                 ttl_seconds: float = 0):
+        super().__init__(path, table="query_results", max_entries=max_entries, memory_entries=memory_entries)
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def make_key(query: str, fingerprint: str, index_version: str) -> str:
+        raw = json.dumps([normalize_query(query), fingerprint, index_version], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Response]:
+        value = self.get(key)
+        if value is None:
+            return None
+        created, data = json.loads(value)
+        if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+            # 过期项按未命中计
+            self.delete(key)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return response_from_json(data)
+
+    def store(self, key: str, response) -> bool:
+        # 流式回答等其他类型不缓存
+        if not isinstance(response, Response) or response.response is None:
+            return False
+        try:
+            value = json.dumps([time.time(), response_to_json(response)], ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Response not cached: {e}")
+            return False
+        self.put(key, value)
+        return True
+
+
+_query_cache: Optional[QueryCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """
+    进程内共享的查询结果缓存，由 config.toml 配置
+
+    Returns:
+        QueryCache，query_cache = false 时返回 None
+    """
+    global _query_cache
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                from ..config import Config
+
+                cfg = Config()
+                if not getattr(cfg, "query_cache", False):
+                    return None
+                max_entries = getattr(cfg, "query_cache_max_entries", 10000)
+                _query_cache = QueryCache(path=getattr(cfg, "query_cache_path", "") or None,
+                                          max_entries=max_entries,
+                                          memory_entries=max_entries,
+                                          ttl_seconds=getattr(cfg, "query_cache_ttl_seconds", 0))
+    return _query_cache
+
+
+def query_cache_key(query: str, cfg) -> Tuple[Optional[QueryCache], Optional[str]]:
+    """(cache, key)；缓存关闭时为 (None, None)"""
+    if not getattr(cfg, "query_cache", False):
+        return None, None
+    cache = get_query_cache()
+    if cache is None:
+        return None, None
+    return cache, cache.make_key(query, config_fingerprint(cfg), getattr(cfg, "index_version", ""))
@@ -1,4 +1,9 @@
+import asyncio
+import contextvars
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from llama_index.core.indices.query.query_transform import HyDEQueryTransform
 from llama_index.llms.openai import OpenAI
 from llama_index.core import PromptTemplate
@@ -6,8 +11,14 @@ from llama_index.core.prompts.prompt_type import PromptType
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.core.query_engine import SubQuestionQueryEngine
 from llama_index.question_gen.openai import OpenAIQuestionGenerator
-from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
 from llama_index.core import Settings
+from .query_cache import query_cache_key
+from .transform_cache import get_transform_cache, llm_id
+from ..utils import get_module_logger
+from ..utils.tracing import get_tracer
+
+logger = get_module_logger(__name__)
 # from ..llms import llm
 
 # 定义模板字符串
@@ -102,8 +113,113 @@ Output the list of sub questions by calling the SubQuestionList function.
 {query_str}
 """
 
+HYDE_TMPL_ZEROSHOT = (
+    "Please write a passage to answer the question\n"
+    "Try to include as many key details as possible.\n"
+    "\n"
+    "Here is your task:"
+    "Question: {context_str}\n"
+    "Passage: "
+)
+
+HYDE_TMPL_FEWSHOT = (
+    "Please write a passage to answer the question\n"
+    "Try to include as many key details as possible.\n"
+    "\n"
+    "Here are a few examples:\n"
+    "\n"
+    "\n"
+    'Passage:"""\n'
+    "1.\n"
+    "Question: What is Bel?\n"
+    "Passage: Bel is a term that has multiple meanings and can be interpreted in various ways depending on the context. In ancient Mesopotamian mythology, Bel was a prominent deity and the god of the heavens and earth. He was considered the supreme god and was often associated with the city of Babylon. Bel was believed to have control over the forces of nature and was worshipped by the Babylonians through elaborate rituals and offerings.\n\n"
+    "In addition to its mythological significance, Bel is also a title given to individuals who hold high positions of authority or leadership. For example, in the ancient Near East, the title of Bel was used to refer to the ruler or king of a city-state. This title denoted power, influence, and the ability to govern and make important decisions.\n\n"
+    "Furthermore, Bel is also a term used in the field of linguistics to refer to a unit of sound or phoneme. In phonetics, a bel represents a logarithmic unit used to measure the intensity or loudness of sound. This unit is named after Alexander Graham Bell, the inventor of the telephone, who made significant contributions to the study of sound and communication.\n\n"
+    "Overall, the term Bel encompasses a range of meanings and can refer to a mythical deity, a title of authority, or a unit of sound measurement. Its significance varies depending on the context in which it is used, highlighting the diverse nature of this term.\n"
+    "2.\n"
+    "Question: At It Again contains lyrics co-written by the singer and actor from what city?\n"
+    "Passage: The song 'At It Again' features lyrics that were co-written by the singer and actor who hail from the vibrant city of Los Angeles. This city, known for its thriving entertainment industry, has been a hub for countless talented individuals who have made their mark in music, film, and television. The singer and actor, both born and raised in Los Angeles, have been deeply influenced by the diverse and creative atmosphere of their hometown. Their collaboration on 'At It Again' showcases their unique perspectives and storytelling abilities, as they draw inspiration from their personal experiences and the rich cultural tapestry of Los Angeles. Through their lyrics, they paint a vivid picture of the city's energy, its dreams, and its challenges, capturing the essence of their beloved hometown in every verse.\n"
+    "3.\n"
+    "Question: What year was the English actor and film producer born in who also starred in an adaptation with Renee Zellweger?\n"
+    "Passage: The English actor and film producer who starred alongside Renee Zellweger in a film adaptation is Hugh Grant. Born on September 9, 1960, Grant has had a prolific career in the film industry, particularly known for his roles in romantic comedies. He is a native of Hammersmith, London, and he attended the New College at the University of Oxford, where he studied English literature.\n\n"
+    "Grant's breakthrough role came in 1994 when he starred in 'Four Weddings and a Funeral.' His performance in this film garnered him international recognition and established his reputation as a leading man in romantic comedy films. His charm and unique comedic timing resonated with audiences worldwide, making him a favorite in the genre.\n\n"
+    "In 2001, Grant starred in the film adaptation of 'Bridget Jones's Diary,' alongside American actress Renee Zellweger. The film, based on Helen Fielding's popular novel, was a commercial success, grossing over $280 million worldwide. Grant played the character of Daniel Cleaver, a charming yet unreliable publishing executive who becomes involved in a love triangle with Bridget Jones (Zellweger) and Mark Darcy (Colin Firth).\n\n"
+    "'Bridget Jones's Diary' was well-received by critics, and it led to two sequels in which Grant reprised his role. His performance in these films is often considered one of his most memorable. Despite the various challenges in his career, Hugh Grant has remained a significant figure in the film industry for over three decades. His enduring appeal and talent have ensured his place in the annals of cinematic history.\n"
+    "4.\n"
+    "Question: What is the length of the track where the 2013 Liqui Moly Bathurst 12 Hour was staged?\n"
+    "Passage: The 2013 Liqui Moly Bathurst 12 Hour race was held at the iconic Mount Panorama Circuit, situated in Bathurst, New South Wales, Australia. This particular motor racing track is known not only for its challenging layout but also for the spectacular views it offers of the surrounding countryside.\n\n"
+    "The Mount Panorama Circuit is a unique blend of seemingly contrasting elements. It is comprised of both long and short straights, fast corners, as well as dramatic ascents and descents, which demand a high level of skill and precision from the drivers. The track's total length is approximately 6.213 kilometers, or about 3.861 miles, a distance that has remained consistent over the years.\n\n"
+    "The Mount Panorama Circuit is steeped in motor racing history. It was first opened in 1938 and has since been the venue for a variety of prestigious motor racing events. These include not only the Bathurst 12 Hour, but also the Bathurst 1000, the latter of which is considered one of the most significant events in Australian motorsport.\n\n"
+    "The 2013 Liqui Moly Bathurst 12 Hour race was a significant event in the racing calendar. Teams from around the world competed in a gruelling endurance race that tested not only the performance of the cars but also the stamina and skill of the drivers. The race, which started in the early morning darkness, ran for twelve hours, with the victors crossing the finish line as the sun was setting, adding to the drama and spectacle of the event.\n\n"
+    "The Mount Panorama Circuit's unique combination of high-speed straights and tight corners, along with its significant changes in elevation, make it one of the most challenging and exciting circuits in the world. Its length and layout have remained largely unchanged since its inception, providing a consistent benchmark for drivers and teams across different racing events. It's a track that demands respect from every driver who races on it, and the 2013 Liqui Moly Bathurst 12 Hour was no exception.\n"
+    "5.\n"
+    "Question: Which event was a surprise military strike by the Imperial Japanese Navy Air Service while Magruder Hill Tuttle was a senior officer in the United States Navy?\n"
+    "Passage: The event that was a surprise military strike by the Imperial Japanese Navy Air Service while Magruder Hill Tuttle was a senior officer in the United States Navy was the infamous attack on Pearl Harbor. On the morning of December 7, 1941, the peaceful tranquility of the Hawaiian naval base was shattered as a fleet of Japanese aircraft descended upon the unsuspecting American forces stationed there. Tuttle, who held a senior position within the US Navy, found himself thrust into the chaos and confusion of the surprise attack.\n\n"
+    "The Japanese planes unleashed a devastating assault, targeting the American battleships, cruisers, and aircraft on the island. The attack was swift and relentless, catching the US Navy off guard and causing immense destruction and loss of life. Tuttle, along with his fellow officers and sailors, valiantly fought back against the overwhelming enemy forces, but the surprise nature of the attack made it difficult to mount an effective defense.\n\n"
+    "The attack on Pearl Harbor marked a turning point in World War II, propelling the United States into the conflict and forever changing the course of history.\n"
+    "\n"
+    "Here is your task:"
+    "Question: {context_str}\n"
+    "Passage: "
+)
+
+STEPBACK_TMPL_ZEROSHOT = """\
+    You are an expert at world knowledge. Your task is to step back and paraphrase a question to a more generic step-back question, which is easier to answer.
+    Just give the content of the Stepback Question.
+
+    Here is your task:
+    Original Question: {query}
+    Stepback Question: 
+    """
+
+STEPBACK_TMPL_FEWSHOT = """\
+    You are an expert at world knowledge. Your task is to step back and paraphrase a question to a more generic step-back question, which is easier to answer.
+    Just give the content of the Stepback Question.
+
+    Here are a few examples:
+
+    1.
+    Original Question: Musician and satirist Allie Goertz wrote a song about the "The Simpsons" character Milhouse, who Matt Groening named after who?
+    Stepback Question: Who are some notable figures that have influenced the names of "The Simpsons" characters?
+
+    2.
+    Original Question: Which plant's name is derived from the greek for "bee," Melittis or Hovea?
+    Stepback Question: What are the origins of the names for the plants Melittis and Hovea?
+
+    3.
+    Original Question: What American media franchise is centered on a series of monster films featuring Godzilla and King Kong?
+    Stepback Question: What are some notable American media franchises that feature monster films?
+
+    4.
+    Original Question: Tar Creed Superfund site causing toxic areas and therefore reducing the population to what number in November 2010?
+    Stepback Question: What impact has the Tar Creek Superfund site had on the population of nearby towns, such as Cardin, Oklahoma?
+
+    5.
+    Original Question: Who is likely to have represented and advanced Armenian music more, Art Laboe or Konstantin Orbelyan?
+    Stepback Question: Who are some notable figures that have significantly contributed to the representation and advancement of Armenian music?
+    
+    
+    Here is your task:
+    Original Question: {query}
+    Stepback Question: 
+    """
+
 def transform_and_query(query, cfg, query_engine):
-    """同步版本的查询转换函数"""
+    """同步版本的查询转换函数，开启 query_cache 时先查查询结果缓存"""
+    with get_tracer().span("query", query_transform=cfg.query_transform) as span:
+        cache, key = query_cache_key(query, cfg)
+        if cache is not None:
+            response = cache.lookup(key)
+            span.set("cache_hit", response is not None)
+            if response is not None:
+                return response
+        response = _transform_and_query(query, cfg, query_engine)
+        if cache is not None:
+            cache.store(key, response)
+        return response
+
+
+def _transform_and_query(query, cfg, query_engine):
     if cfg.query_transform == "subquery_zeroshot":
         return subquery_zeroshot_sync(query, query_engine)
     elif cfg.query_transform == "subquery_fewshot":
@@ -114,12 +230,31 @@ def transform_and_query(query, cfg, query_engine):
 
 async def transform_and_query_async(query, cfg, query_engine):
     """异步版本的查询转换函数"""
+    with get_tracer().span("query", query_transform=cfg.query_transform) as span:
+        cache, key = query_cache_key(query, cfg)
+        if cache is not None:
+            response = cache.lookup(key)
+            span.set("cache_hit", response is not None)
+            if response is not None:
+                return response
+        response = await _transform_and_query_async(query, cfg, query_engine)
+        if cache is not None:
+            cache.store(key, response)
+        return response
+
+
+async def _transform_and_query_async(query, cfg, query_engine):
     if cfg.query_transform == "subquery_zeroshot":
         return await subquery_zeroshot(query, query_engine)
     elif cfg.query_transform == "subquery_fewshot":
         return await subquery_fewshot(query, query_engine)
+    elif cfg.query_transform in ("hyde_zeroshot", "hyde_fewshot") \
+            and getattr(cfg, "hyde_fallback_to_query", False) and hasattr(query_engine, "asynthesize"):
+        template = HYDE_TMPL_ZEROSHOT if cfg.query_transform == "hyde_zeroshot" else HYDE_TMPL_FEWSHOT
+        return await hyde_query_with_fallback(query, template, query_engine,
+                                              getattr(cfg, "hyde_generation_timeout", 0))
     else:
-        transformed_query = transform(query, cfg)
+        transformed_query = await atransform(query, cfg)
         return await query_engine.aquery(transformed_query)
 
 
@@ -139,31 +274,131 @@ def transform(query, cfg):
         raise Exception("Unknown query transform: %s" % cfg.query_transform)
 
 
+async def atransform(query, cfg):
+    """异步版本的 transform，LLM 调用不阻塞事件循环"""
+    if cfg.query_transform == "none":
+        return query
+    elif cfg.query_transform == "hyde_zeroshot":
+        return await ahyde(query, HYDE_TMPL_ZEROSHOT)
+    elif cfg.query_transform == "hyde_fewshot":
+        return await ahyde(query, HYDE_TMPL_FEWSHOT)
+    elif cfg.query_transform == "stepback_zeroshot":
+        return await astepback(query, STEPBACK_TMPL_ZEROSHOT)
+    elif cfg.query_transform == "stepback_fewshot":
+        return await astepback(query, STEPBACK_TMPL_FEWSHOT)
+    else:
+        raise Exception("Unknown query transform: %s" % cfg.query_transform)
+
+
+# PromptTemplate / HyDEQueryTransform 每个进程只构造一次，按 (模板, LLM) 复用
+_prompt_templates = {}
+_hyde_transforms = {}
+_transform_objects_lock = threading.Lock()
+
+
+def _get_prompt_template(prompt_template_str, prompt_type=PromptType.CUSTOM):
+    key = (prompt_template_str, prompt_type)
+    with _transform_objects_lock:
+        if key not in _prompt_templates:
+            _prompt_templates[key] = PromptTemplate(prompt_template_str, prompt_type=prompt_type)
+        return _prompt_templates[key]
+
+
+def _get_hyde_transform(prompt_template_str):
+    llm = Settings.llm
+    key = (prompt_template_str, id(llm))
+    hyde_prompt = _get_prompt_template(prompt_template_str, PromptType.SUMMARY)
+    with _transform_objects_lock:
+        if key not in _hyde_transforms:
+            _hyde_transforms[key] = HyDEQueryTransform(llm=llm, include_original=True, hyde_prompt=hyde_prompt)
+        return _hyde_transforms[key]
+
+
+def _cached_transform(transform_name, prompt_template_str, query, compute):
+    cache = get_transform_cache()
+    with get_tracer().span("query_transform", transform=transform_name) as span:
+        if cache is None:
+            return compute()
+        key = cache.make_key(transform_name, prompt_template_str, llm_id(Settings.llm), query)
+        value = cache.get(key)
+        span.set("cache_hit", value is not None)
+        if value is None:
+            value = compute()
+            cache.put(key, value)
+        return value
+
+
+def hyde_passage(query, prompt_template_str):
+    """
+    HyDE 假设文档生成（带缓存）
+    """
+    hyde_transform = _get_hyde_transform(prompt_template_str)
+    return _cached_transform("hyde", prompt_template_str, query,
+                             lambda: hyde_transform.run(query).custom_embedding_strs[0])
+
+
+async def _acached_transform(transform_name, prompt_template_str, query, acompute):
+    cache = get_transform_cache()
+    with get_tracer().span("query_transform", transform=transform_name) as span:
+        if cache is None:
+            return await acompute()
+        key = cache.make_key(transform_name, prompt_template_str, llm_id(Settings.llm), query)
+        value = cache.get(key)
+        span.set("cache_hit", value is not None)
+        if value is None:
+            value = await acompute()
+            cache.put(key, value)
+        return value
+
+
+async def ahyde_passage(query, prompt_template_str):
+    """
+    HyDE 假设文档生成（异步，带缓存）
+    """
+    hyde_prompt = _get_prompt_template(prompt_template_str, PromptType.SUMMARY)
+    return await _acached_transform("hyde", prompt_template_str, query,
+                                    lambda: Settings.llm.apredict(hyde_prompt, context_str=query))
+
+
 def hyde(query, prompt_template_str):
     """
     Query改写 - HyDE
     """
-    HYDE_PROMPT = PromptTemplate(prompt_template_str, prompt_type=PromptType.SUMMARY)
-    hyde = HyDEQueryTransform(include_original=True, hyde_prompt=HYDE_PROMPT)
-    query_hyde = hyde.run(query)
-    return (
-            query_hyde.custom_embedding_strs[0] + " " + query_hyde.custom_embedding_strs[1]
-    )
+    return hyde_passage(query, prompt_template_str) + " " + query
+
+
+async def ahyde(query, prompt_template_str):
+    """
+    Query改写 - HyDE（异步）
+    """
+    return await ahyde_passage(query, prompt_template_str) + " " + query
+
+
+async def hyde_query_with_fallback(query, prompt_template_str, query_engine, generation_timeout=0):
+    """
+    带退回的 HyDE 查询，正常情况下回答与 ahyde 改写后再 aquery 相同
+
+    用“假设文档 + 原始问题”检索并合成答案；若假设文档生成失败或超过 generation_timeout 秒，
+    则改用原始问题检索并合成答案。
+    """
+    try:
+        passage_task = ahyde_passage(query, prompt_template_str)
+        passage = await (asyncio.wait_for(passage_task, generation_timeout) if generation_timeout else passage_task)
+    except Exception as e:
+        logger.warning(f"HyDE generation failed or timed out, answering the original query: {e!r}")
+        original_bundle = QueryBundle(query_str=query)
+        nodes = await query_engine.aretrieve(original_bundle)
+        return await query_engine.asynthesize(original_bundle, nodes)
+
+    hyde_bundle = QueryBundle(query_str=passage + " " + query)
+    nodes = await query_engine.aretrieve(hyde_bundle)
+    return await query_engine.asynthesize(hyde_bundle, nodes)
 
 
 def hyde_zeroshot(query):
     """
     Query改写 - HyDE - zeroshot
     """
-    HYDE_TMPL_ZEROSHOT = (
-        "Please write a passage to answer the question\n"
-        "Try to include as many key details as possible.\n"
-        "\n"
-        "Here is your task:"
-        "Question: {context_str}\n"
-        "Passage: "
-    )
-
     return hyde(query, HYDE_TMPL_ZEROSHOT)
 
 
@@ -171,134 +406,210 @@ def hyde_fewshot(query):
     """
     Query改写 - HyDE - fewshot
     """
-    HYDE_TMPL_FEWSHOT = (
-        "Please write a passage to answer the question\n"
-        "Try to include as many key details as possible.\n"
-        "\n"
-        "Here are a few examples:\n"
-        "\n"
-        "\n"
-        'Passage:"""\n'
-        "1.\n"
-        "Question: What is Bel?\n"
-        "Passage: Bel is a term that has multiple meanings and can be interpreted in various ways depending on the context. In ancient Mesopotamian mythology, Bel was a prominent deity and the god of the heavens and earth. He was considered the supreme god and was often associated with the city of Babylon. Bel was believed to have control over the forces of nature and was worshipped by the Babylonians through elaborate rituals and offerings.\n\n"
-        "In addition to its mythological significance, Bel is also a title given to individuals who hold high positions of authority or leadership. For example, in the ancient Near East, the title of Bel was used to refer to the ruler or king of a city-state. This title denoted power, influence, and the ability to govern and make important decisions.\n\n"
-        "Furthermore, Bel is also a term used in the field of linguistics to refer to a unit of sound or phoneme. In phonetics, a bel represents a logarithmic unit used to measure the intensity or loudness of sound. This unit is named after Alexander Graham Bell, the inventor of the telephone, who made significant contributions to the study of sound and communication.\n\n"
-        "Overall, the term Bel encompasses a range of meanings and can refer to a mythical deity, a title of authority, or a unit of sound measurement. Its significance varies depending on the context in which it is used, highlighting the diverse nature of this term.\n"
-        "2.\n"
-        "Question: At It Again contains lyrics co-written by the singer and actor from what city?\n"
-        "Passage: The song 'At It Again' features lyrics that were co-written by the singer and actor who hail from the vibrant city of Los Angeles. This city, known for its thriving entertainment industry, has been a hub for countless talented individuals who have made their mark in music, film, and television. The singer and actor, both born and raised in Los Angeles, have been deeply influenced by the diverse and creative atmosphere of their hometown. Their collaboration on 'At It Again' showcases their unique perspectives and storytelling abilities, as they draw inspiration from their personal experiences and the rich cultural tapestry of Los Angeles. Through their lyrics, they paint a vivid picture of the city's energy, its dreams, and its challenges, capturing the essence of their beloved hometown in every verse.\n"
-        "3.\n"
-        "Question: What year was the English actor and film producer born in who also starred in an adaptation with Renee Zellweger?\n"
-        "Passage: The English actor and film producer who starred alongside Renee Zellweger in a film adaptation is Hugh Grant. Born on September 9, 1960, Grant has had a prolific career in the film industry, particularly known for his roles in romantic comedies. He is a native of Hammersmith, London, and he attended the New College at the University of Oxford, where he studied English literature.\n\n"
-        "Grant's breakthrough role came in 1994 when he starred in 'Four Weddings and a Funeral.' His performance in this film garnered him international recognition and established his reputation as a leading man in romantic comedy films. His charm and unique comedic timing resonated with audiences worldwide, making him a favorite in the genre.\n\n"
-        "In 2001, Grant starred in the film adaptation of 'Bridget Jones's Diary,' alongside American actress Renee Zellweger. The film, based on Helen Fielding's popular novel, was a commercial success, grossing over $280 million worldwide. Grant played the character of Daniel Cleaver, a charming yet unreliable publishing executive who becomes involved in a love triangle with Bridget Jones (Zellweger) and Mark Darcy (Colin Firth).\n\n"
-        "'Bridget Jones's Diary' was well-received by critics, and it led to two sequels in which Grant reprised his role. His performance in these films is often considered one of his most memorable. Despite the various challenges in his career, Hugh Grant has remained a significant figure in the film industry for over three decades. His enduring appeal and talent have ensured his place in the annals of cinematic history.\n"
-        "4.\n"
-        "Question: What is the length of the track where the 2013 Liqui Moly Bathurst 12 Hour was staged?\n"
-        "Passage: The 2013 Liqui Moly Bathurst 12 Hour race was held at the iconic Mount Panorama Circuit, situated in Bathurst, New South Wales, Australia. This particular motor racing track is known not only for its challenging layout but also for the spectacular views it offers of the surrounding countryside.\n\n"
-        "The Mount Panorama Circuit is a unique blend of seemingly contrasting elements. It is comprised of both long and short straights, fast corners, as well as dramatic ascents and descents, which demand a high level of skill and precision from the drivers. The track's total length is approximately 6.213 kilometers, or about 3.861 miles, a distance that has remained consistent over the years.\n\n"
-        "The Mount Panorama Circuit is steeped in motor racing history. It was first opened in 1938 and has since been the venue for a variety of prestigious motor racing events. These include not only the Bathurst 12 Hour, but also the Bathurst 1000, the latter of which is considered one of the most significant events in Australian motorsport.\n\n"
-        "The 2013 Liqui Moly Bathurst 12 Hour race was a significant event in the racing calendar. Teams from around the world competed in a gruelling endurance race that tested not only the performance of the cars but also the stamina and skill of the drivers. The race, which started in the early morning darkness, ran for twelve hours, with the victors crossing the finish line as the sun was setting, adding to the drama and spectacle of the event.\n\n"
-        "The Mount Panorama Circuit's unique combination of high-speed straights and tight corners, along with its significant changes in elevation, make it one of the most challenging and exciting circuits in the world. Its length and layout have remained largely unchanged since its inception, providing a consistent benchmark for drivers and teams across different racing events. It's a track that demands respect from every driver who races on it, and the 2013 Liqui Moly Bathurst 12 Hour was no exception.\n"
-        "5.\n"
-        "Question: Which event was a surprise military strike by the Imperial Japanese Navy Air Service while Magruder Hill Tuttle was a senior officer in the United States Navy?\n"
-        "Passage: The event that was a surprise military strike by the Imperial Japanese Navy Air Service while Magruder Hill Tuttle was a senior officer in the United States Navy was the infamous attack on Pearl Harbor. On the morning of December 7, 1941, the peaceful tranquility of the Hawaiian naval base was shattered as a fleet of Japanese aircraft descended upon the unsuspecting American forces stationed there. Tuttle, who held a senior position within the US Navy, found himself thrust into the chaos and confusion of the surprise attack.\n\n"
-        "The Japanese planes unleashed a devastating assault, targeting the American battleships, cruisers, and aircraft on the island. The attack was swift and relentless, catching the US Navy off guard and causing immense destruction and loss of life. Tuttle, along with his fellow officers and sailors, valiantly fought back against the overwhelming enemy forces, but the surprise nature of the attack made it difficult to mount an effective defense.\n\n"
-        "The attack on Pearl Harbor marked a turning point in World War II, propelling the United States into the conflict and forever changing the course of history.\n"
-        "\n"
-        "Here is your task:"
-        "Question: {context_str}\n"
-        "Passage: "
-    )
-
     return hyde(query, HYDE_TMPL_FEWSHOT)
 
 
+async def astepback(query, prompt_template_str):
+    """
+    Query扩写 - Stepback（异步）
+    """
+    stepback_query_gen_prompt = _get_prompt_template(prompt_template_str)
+    stepback_query = await _acached_transform("stepback", prompt_template_str, query,
+                                              lambda: Settings.llm.apredict(stepback_query_gen_prompt, query=query))
+    return stepback_query + " " + query
+
+
 def stepback(query, prompt_template_str):
     """
     Query扩写 - Stepback
     """
-    stepback_query_gen_prompt = PromptTemplate(prompt_template_str)
-    return Settings.llm.predict(stepback_query_gen_prompt, query=query) + " " + query
+    stepback_query_gen_prompt = _get_prompt_template(prompt_template_str)
+    stepback_query = _cached_transform("stepback", prompt_template_str, query,
+                                       lambda: Settings.llm.predict(stepback_query_gen_prompt, query=query))
+    return stepback_query + " " + query
 
 
 def stepback_zeroshot(query):
     """
     Query扩写 - Stepback - zeroshot
     """
-    stepback_query_gen_str_zeroshot = """\
-    You are an expert at world knowledge. Your task is to step back and paraphrase a question to a more generic step-back question, which is easier to answer.
-    Just give the content of the Stepback Question.
-
-    Here is your task:
-    Original Question: {query}
-    Stepback Question: 
-    """
-    return stepback(query, stepback_query_gen_str_zeroshot)
+    return stepback(query, STEPBACK_TMPL_ZEROSHOT)
 
 
 def stepback_fewshot(query):
     """
     Query拆解 - Stepback - fewshot
     """
+    return stepback(query, STEPBACK_TMPL_FEWSHOT)
 
-    stepback_query_gen_str_fewshot = """\
-    You are an expert at world knowledge. Your task is to step back and paraphrase a question to a more generic step-back question, which is easier to answer.
-    Just give the content of the Stepback Question.
 
-    Here are a few examples:
-
-    1.
-    Original Question: Musician and satirist Allie Goertz wrote a song about the "The Simpsons" character Milhouse, who Matt Groening named after who?
-    Stepback Question: Who are some notable figures that have influenced the names of "The Simpsons" characters?
-
-    2.
-    Original Question: Which plant's name is derived from the greek for "bee," Melittis or Hovea?
-    Stepback Question: What are the origins of the names for the plants Melittis and Hovea?
+class CustomSubQuestionQueryEngine(SubQuestionQueryEngine):
+    """
+    SubQuestionQueryEngine，子问题并发执行（同步路径用线程池，异步路径用信号量限流），
+    并按 (工具名, 子问题) 去重：同一批查询中相同的子问题只执行一次。
+    """
 
-    3.
-    Original Question: What American media franchise is centered on a series of monster films featuring Godzilla and King Kong?
-    Stepback Question: What are some notable American media franchises that feature monster films?
+    def __init__(self, *args, max_workers=4, answer_cache_size=1000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._max_workers = max(1, max_workers)
+        self._answer_cache_size = answer_cache_size
+        self._answers = OrderedDict()
+        self._inflight = {}
+        self._answers_lock = threading.Lock()
+        self._executor = None
+        self._semaphores = {}
+
+    @classmethod
+    def from_defaults(cls, query_engine_tools, question_gen=None, response_synthesizer=None, verbose=True,
+                      use_async=False, max_workers=4, answer_cache_size=1000, **kwargs):
+        engine = super().from_defaults(query_engine_tools=query_engine_tools, question_gen=question_gen,
+                                       response_synthesizer=response_synthesizer, verbose=verbose,
+                                       use_async=use_async, **kwargs)
+        engine._max_workers = max(1, max_workers)
+        engine._answer_cache_size = answer_cache_size
+        return engine
 
-    4.
-    Original Question: Tar Creed Superfund site causing toxic areas and therefore reducing the population to what number in November 2010?
-    Stepback Question: What impact has the Tar Creek Superfund site had on the population of nearby towns, such as Cardin, Oklahoma?
+    def _construct_node(self, qa_pair):
+        node_text = f"Sub question: {qa_pair.sub_q.sub_question}\nResponse: {qa_pair.answer}"
+        if qa_pair.sources and len(qa_pair.sources) > 0:
+            metadata = qa_pair.sources[0].node.metadata.copy()
+        else:
+            metadata = {}
+        node = TextNode(text=node_text, metadata=metadata)
+        return NodeWithScore(node=node)
 
-    5.
-    Original Question: Who is likely to have represented and advanced Armenian music more, Art Laboe or Konstantin Orbelyan?
-    Stepback Question: Who are some notable figures that have significantly contributed to the representation and advancement of Armenian music?
-    
-    
-    Here is your task:
-    Original Question: {query}
-    Stepback Question: 
+    @staticmethod
+    def _answer_key(sub_q):
+        return sub_q.tool_name, " ".join(sub_q.sub_question.lower().split())
+
+    def _remember_answer(self, key, qa_pair):
+        with self._answers_lock:
+            self._inflight.pop(key, None)
+            if qa_pair is None:
+                return
+            self._answers[key] = qa_pair
+            while len(self._answers) > self._answer_cache_size:
+                self._answers.popitem(last=False)
+
+    def _dedup_query_subq(self, sub_q, color=None):
+        key = self._answer_key(sub_q)
+        with self._answers_lock:
+            if key in self._answers:
+                self._answers.move_to_end(key)
+                return self._answers[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            return future.result()
+        try:
+            qa_pair = self._query_subq(sub_q, color=color)
+        except BaseException as e:
+            self._remember_answer(key, None)
+            future.set_exception(e)
+            raise
+        self._remember_answer(key, qa_pair)
+        future.set_result(qa_pair)
+        return qa_pair
+
+    async def _dedup_aquery_subq(self, sub_q, color=None):
+        key = self._answer_key(sub_q)
+        with self._answers_lock:
+            if key in self._answers:
+                self._answers.move_to_end(key)
+                return self._answers[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            return await asyncio.wrap_future(future)
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.setdefault(id(loop), asyncio.Semaphore(self._max_workers))
+        try:
+            async with semaphore:
+                qa_pair = await self._aquery_subq(sub_q, color=color)
+        except BaseException as e:
+            self._remember_answer(key, None)
+            future.set_exception(e)
+            raise
+        self._remember_answer(key, qa_pair)
+        future.set_result(qa_pair)
+        return qa_pair
+
+    def _collect_nodes(self, qa_pairs_all):
+        qa_pairs = [pair for pair in qa_pairs_all if pair is not None]
+        nodes = [self._construct_node(pair) for pair in qa_pairs]
+        source_nodes = [node for qa_pair in qa_pairs for node in qa_pair.sources]
+        return nodes, source_nodes
+
+    def _query(self, query_bundle):
+        sub_questions = self._question_gen.generate(self._metadatas, query_bundle)
+        if self._verbose:
+            print(f"Generated {len(sub_questions)} sub questions.")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="xrag-subq")
+        # 每个子问题复制一份当前上下文，子问题的 span 挂在本次查询之下
+        futures = [self._executor.submit(contextvars.copy_context().run, self._dedup_query_subq, sub_q)
+                   for sub_q in sub_questions]
+        qa_pairs_all = [future.result() for future in futures]
+        nodes, source_nodes = self._collect_nodes(qa_pairs_all)
+        return self._response_synthesizer.synthesize(query=query_bundle, nodes=nodes,
+                                                     additional_source_nodes=source_nodes)
+
+    async def _aquery(self, query_bundle):
+        sub_questions = await self._question_gen.agenerate(self._metadatas, query_bundle)
+        if self._verbose:
+            print(f"Generated {len(sub_questions)} sub questions.")
+        qa_pairs_all = await asyncio.gather(*[self._dedup_aquery_subq(sub_q) for sub_q in sub_questions])
+        nodes, source_nodes = self._collect_nodes(qa_pairs_all)
+        return await self._response_synthesizer.asynthesize(query=query_bundle, nodes=nodes,
+                                                            additional_source_nodes=source_nodes)
+
+
+_subquery_engines_lock = threading.Lock()
+
+
+def get_subquery_engine(query_engine, prompt_template_str):
     """
-
-    return stepback(query, stepback_query_gen_str_fewshot)
+    每个 query_engine、每个模板只构造一次 SubQuestionQueryEngine，挂在 query_engine 上复用
+    """
+    with _subquery_engines_lock:
+        engines = getattr(query_engine, "_xrag_subquery_engines", None)
+        if engines is None:
+            engines = {}
+            query_engine._xrag_subquery_engines = engines
+        if prompt_template_str not in engines:
+            from ..config import Config
+
+            cfg = Config()
+            query_engine_tools = [
+                QueryEngineTool(
+                    query_engine=query_engine,
+                    metadata=ToolMetadata(
+                        name="Data Source",
+                        description="Data source for the query engine",
+                    ),
+                )
+            ]
+            engines[prompt_template_str] = CustomSubQuestionQueryEngine.from_defaults(
+                query_engine_tools=query_engine_tools,
+                use_async=False,
+                question_gen=OpenAIQuestionGenerator.from_defaults(
+                    prompt_template_str=prompt_template_str
+                ),
+                max_workers=getattr(cfg, "subquery_max_workers", 4),
+                answer_cache_size=getattr(cfg, "subquery_answer_cache_size", 1000),
+            )
+        return engines[prompt_template_str]
 
 
 def subquery_sync(query, prompt_template_str, query_engine):
     """同步版本的 subquery 函数"""
-    query_engine_tools = [
-        QueryEngineTool(
-            query_engine=query_engine,
-            metadata=ToolMetadata(
-                name="Data Source",
-                description="Data source for the query engine",
-            ),
-        )
-    ]
-
-    subquery_engine = CustomSubQuestionQueryEngine.from_defaults(
-        query_engine_tools=query_engine_tools,
-        use_async=False,
-        question_gen=OpenAIQuestionGenerator.from_defaults(
-            prompt_template_str=prompt_template_str
-        ),
-    )
-
-    return subquery_engine.query(query)
+    return get_subquery_engine(query_engine, prompt_template_str).query(query)
 
 def subquery_zeroshot_sync(query, query_engine):
     """同步版本的 subquery_zeroshot 函数"""
@@ -309,37 +620,9 @@ def subquery_fewshot_sync(query, query_engine):
     return subquery_sync(query, FEWSHOT_OPENAI_SUB_QUESTION_PROMPT_TMPL, query_engine)
 
 
-class CustomSubQuestionQueryEngine(SubQuestionQueryEngine):
-    def _construct_node(self, qa_pair):
-        node_text = f"Sub question: {qa_pair.sub_q.sub_question}\nResponse: {qa_pair.answer}"
-        if qa_pair.sources and len(qa_pair.sources) > 0:
-            metadata = qa_pair.sources[0].node.metadata.copy()
-        else:
-            metadata = {}
-        node = TextNode(text=node_text, metadata=metadata)
-        return NodeWithScore(node=node)
-
 async def subquery(query, prompt_template_str, query_engine):
     """异步版本的 subquery 函数"""
-    query_engine_tools = [
-        QueryEngineTool(
-            query_engine=query_engine,
-            metadata=ToolMetadata(
-                name="Data Source",
-                description="Data source for the query engine",
-            ),
-        )
-    ]
-
-    subquery_engine = CustomSubQuestionQueryEngine.from_defaults(
-        query_engine_tools=query_engine_tools,
-        use_async=True,
-        question_gen=OpenAIQuestionGenerator.from_defaults(
-            prompt_template_str=prompt_template_str
-        ),
-    )
-
-    return await subquery_engine.aquery(query)
+    return await get_subquery_engine(query_engine, prompt_template_str).aquery(query)
 
 async def subquery_zeroshot(query, query_engine):
     """异步版本的 subquery_zeroshot 函数"""
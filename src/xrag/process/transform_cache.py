@@ -0,0 +1,68 @@
+import hashlib
+import json
+import threading
+from typing import Optional
+
+from ..utils import get_module_logger
+from ..utils.sqlite_cache import SqliteLRUCache
+
+logger = get_module_logger(__name__)
+
+
+def template_hash(template: str) -> str:
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()[:16]
+
+
+def llm_id(llm) -> str:
+    """A stable identifier for an LLM: class name plus model name and temperature when available."""
+    if llm is None:
+        return "none"
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or ""
+    temperature = getattr(llm, "temperature", None)
+    return f"{type(llm).__name__}:{model}:{temperature}"
+
+
+class TransformCache(SqliteLRUCache):
+    """
+    Cache of LLM query transformations (HyDE passages, step-back questions).
+
+    Entries are keyed by (transform type, prompt template hash, LLM id, query),
+    kept in an in-memory LRU and persisted to a SQLite file so repeated runs of
+    the same evaluation do not call the LLM again.
+    """
+
+    def __init__(self, path: Optional[str] = "cache/query_transform.sqlite", max_entries: int = 100000,
+                 memory_entries: int = 10000):
+        super().__init__(path, table="transforms", max_entries=max_entries, memory_entries=memory_entries)
+
+    @staticmethod
+    def make_key(transform: str, template: str, llm: str, query: str) -> str:
+        raw = json.dumps([transform, template_hash(template), llm, query], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+_transform_cache: Optional[TransformCache] = None
+_transform_cache_lock = threading.Lock()
+
+
+def get_transform_cache() -> Optional[TransformCache]:
+    """
+    Get the process-wide transformation cache configured from ``config.toml``.
+
+    Returns:
+        The shared TransformCache, or None when ``transform_cache`` is disabled
+    """
+    global _transform_cache
+    if _transform_cache is None:
+        with _transform_cache_lock:
+            if _transform_cache is None:
+                from ..config import Config
+
+                cfg = Config()
+                if not getattr(cfg, "transform_cache", True):
+                    return None
+                _transform_cache = TransformCache(
+                    path=getattr(cfg, "transform_cache_path", "cache/query_transform.sqlite") or None,
+                    max_entries=getattr(cfg, "transform_cache_max_entries", 100000),
+                )
+    return _transform_cache
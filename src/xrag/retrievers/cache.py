@@ -0,0 +1,193 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core import QueryBundle, Settings
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+
+from ..process.query_cache import config_fingerprint
+from ..utils import get_module_logger
+from ..utils.tracing import current_span
+
+logger = get_module_logger(__name__)
+
+# 检索结果缓存：同一检索器配置、同一查询（文本或量化后的查询向量）、同一版本索引的检索结果只计算一次，
+# 只改变合成器或提示词的评测可以完全跳过检索
+
+# 影响检索结果的配置段
+RETRIEVAL_FINGERPRINT_SECTIONS = ("embedding_settings", "chunk_settings", "dataset_settings", "retrieval_settings")
+# 检索时调用 LLM 的检索器（生成查询、选择叶节点、关键词抽取、LLM 筛选），LLM 配置也计入指纹
+LLM_RETRIEVERS = ("Summary", "Tree", "Keyword", "QueryFusion")
+# 只依赖查询向量的检索器，可以按量化后的查询向量作键，其余检索器（BM25、混合检索等）按查询文本作键
+EMBEDDING_KEY_RETRIEVERS = ("Vector", "AutoMerging", "SentenceWindow")
+
+
+class RetrievalCache:
+    """
+    In-memory LRU of retrieval results.
+
+    Stores ``(node, score)`` pairs and hands out fresh ``NodeWithScore`` copies,
+    so postprocessors that rescore or rewrite nodes do not alter cached entries.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[NodeWithScore]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return [NodeWithScore(node=node.model_copy(), score=score) for node, score in entry]
+
+    def put(self, key: str, nodes: List[NodeWithScore]) -> None:
+        entry = [(n.node.model_copy(), n.score) for n in nodes]
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries)}
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Wraps a retriever and memoizes its results in a shared RetrievalCache.
+
+    The key is (retriever fingerprint, query, index version). The query part is
+    the query text plus the strings to embed (e.g. a HyDE passage) and any
+    precomputed query embedding, or, with
+    ``embedding_resolution`` set, the query embedding quantized to that step so
+    near-identical queries share an entry.
+    """
+
+    def __init__(self, retriever: BaseRetriever, cache: RetrievalCache, fingerprint: str, index_version: str,
+                 embedding_resolution: float = 0.0) -> None:
+        self._retriever = retriever
+        self._cache = cache
+        self._fingerprint = fingerprint
+        self._index_version = index_version
+        self._embedding_resolution = embedding_resolution
+        super().__init__()
+
+    def __getattr__(self, name):
+        # stage_metrics 等被包装检索器的属性照常可用
+        retriever = self.__dict__.get("_retriever")
+        if retriever is None:
+            raise AttributeError(name)
+        return getattr(retriever, name)
+
+    @property
+    def embed_model(self):
+        return getattr(self._retriever, "_embed_model", None) or Settings.embed_model
+
+    def _make_key(self, query_part) -> str:
+        raw = json.dumps([self._fingerprint, self._index_version, query_part], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _text_key(self, query_bundle: QueryBundle) -> str:
+        # 调用方预先算好的查询向量决定检索结果，和文本一起计入键
+        embedding = None
+        if query_bundle.embedding is not None:
+            embedding = hashlib.sha1(np.asarray(query_bundle.embedding, dtype=np.float64).tobytes()).hexdigest()
+        return self._make_key(["text", query_bundle.query_str, list(query_bundle.embedding_strs), embedding])
+
+    def _embedding_key(self, embedding) -> str:
+        codes = np.round(np.asarray(embedding, dtype=np.float64) / self._embedding_resolution).astype(np.int64)
+        return self._make_key(["embedding", self._embedding_resolution, hashlib.sha1(codes.tobytes()).hexdigest()])
+
+    def _lookup(self, key: str) -> Optional[List[NodeWithScore]]:
+        nodes = self._cache.get(key)
+        current_span().set("cache_hit", nodes is not None)
+        return nodes
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if self._embedding_resolution > 0:
+            if query_bundle.embedding is None:
+                # 计算出的向量留在 query_bundle 上，未命中时被包装的检索器直接复用
+                query_bundle.embedding = self.embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+            key = self._embedding_key(query_bundle.embedding)
+        else:
+            key = self._text_key(query_bundle)
+        nodes = self._lookup(key)
+        if nodes is None:
+            nodes = self._retriever.retrieve(query_bundle)
+            self._cache.put(key, nodes)
+        return nodes
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if self._embedding_resolution > 0:
+            if query_bundle.embedding is None:
+                query_bundle.embedding = await self.embed_model.aget_agg_embedding_from_queries(
+                    query_bundle.embedding_strs)
+            key = self._embedding_key(query_bundle.embedding)
+        else:
+            key = self._text_key(query_bundle)
+        nodes = self._lookup(key)
+        if nodes is None:
+            nodes = await self._retriever.aretrieve(query_bundle)
+            self._cache.put(key, nodes)
+        return nodes
+
+
+_retrieval_cache: Optional[RetrievalCache] = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """
+    进程内共享的检索结果缓存，由 config.toml 配置
+
+    Returns:
+        RetrievalCache，retrieval_cache = false 时返回 None
+    """
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        with _retrieval_cache_lock:
+            if _retrieval_cache is None:
+                from ..config import Config
+
+                cfg = Config()
+                if not getattr(cfg, "retrieval_cache", False):
+                    return None
+                _retrieval_cache = RetrievalCache(getattr(cfg, "retrieval_cache_max_entries", 10000))
+    return _retrieval_cache
+
+
+def cached_retriever(retriever: BaseRetriever, type: str, index, cfg) -> BaseRetriever:
+    """按配置包装 get_retriver 构造的检索器；retrieval_cache = false 时原样返回"""
+    if cfg is None or not getattr(cfg, "retrieval_cache", False):
+        return retriever
+    cache = get_retrieval_cache()
+    if cache is None:
+        return retriever
+    sections = RETRIEVAL_FINGERPRINT_SECTIONS + (("llm_settings",) if type in LLM_RETRIEVERS else ())
+    fingerprint = type + ":" + config_fingerprint(cfg, sections)
+    # build_index 记录持久化索引的版本；直接传入的索引对象按对象区分
+    index_version = getattr(cfg, "index_version", "") or f"object:{id(index)}"
+    resolution = 0.0
+    if getattr(cfg, "retrieval_cache_key", "text") == "embedding" and type in EMBEDDING_KEY_RETRIEVERS:
+        resolution = getattr(cfg, "retrieval_cache_embedding_resolution", 0.001)
+    return CachedRetriever(retriever, cache, fingerprint, index_version, resolution)
@@ -0,0 +1,214 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core import QueryBundle
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from ..utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# 级联检索：廉价的召回阶段 -> 可选的轻量双塔重打分 -> 交叉编码器精排
+# 每个阶段都有候选数预算和时间预算，并记录各阶段耗时
+
+
+class StageStats:
+    """Latency and candidate counts of one cascade stage, over the last ``window`` queries."""
+
+    def __init__(self, window: int = 1000):
+        self.latencies_ms = deque(maxlen=window)
+        self.candidates_in = deque(maxlen=window)
+        self.candidates_out = deque(maxlen=window)
+        self.budget_exhausted = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float, n_in: int, n_out: int, exhausted: bool = False):
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.candidates_in.append(n_in)
+            self.candidates_out.append(n_out)
+            self.budget_exhausted += int(exhausted)
+
+    def summary(self) -> dict:
+        with self._lock:
+            if not self.latencies_ms:
+                return {"count": 0}
+            lat = np.asarray(self.latencies_ms)
+            return {
+                "count": len(lat),
+                "p50_ms": float(np.percentile(lat, 50)),
+                "p95_ms": float(np.percentile(lat, 95)),
+                "p99_ms": float(np.percentile(lat, 99)),
+                "mean_candidates_in": float(np.mean(self.candidates_in)),
+                "mean_candidates_out": float(np.mean(self.candidates_out)),
+                "budget_exhausted": self.budget_exhausted,
+            }
+
+
+def score_with_budget(nodes: List[NodeWithScore], score_fn: Callable[[List[NodeWithScore]], List[float]],
+                      chunk_size: int, budget_ms: float) -> tuple:
+    """
+    Score nodes chunk by chunk (best first-stage nodes first) until the time budget runs out.
+
+    Nodes that could not be scored in time keep their previous order and are
+    ranked after all scored nodes. Without a budget all nodes are scored in a
+    single call, so a batching scorer sees one batch per query.
+
+    Returns:
+        (ranked nodes, whether the budget was exhausted)
+    """
+    if not budget_ms:
+        chunk_size = max(len(nodes), 1)
+    start = time.perf_counter()
+    scored = []
+    exhausted = False
+    i = 0
+    while i < len(nodes):
+        if budget_ms and (time.perf_counter() - start) * 1000 >= budget_ms:
+            exhausted = True
+            break
+        chunk = nodes[i:i + chunk_size]
+        scored.extend(NodeWithScore(node=n.node, score=s) for n, s in zip(chunk, score_fn(chunk)))
+        i += len(chunk)
+    scored.sort(key=lambda n: n.score, reverse=True)
+    return scored + nodes[i:], exhausted
+
+
+class BiEncoderScorer:
+    """Cosine rescoring with a (small) embedding model, caching node embeddings by node id."""
+
+    def __init__(self, embed_model, cache_size: int = 50000):
+        self.embed_model = embed_model
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, query: str, nodes: List[NodeWithScore]) -> List[float]:
+        vectors: Dict[str, np.ndarray] = {}
+        missing = []
+        with self._lock:
+            for n in nodes:
+                v = self._cache.get(n.node.node_id)
+                if v is None:
+                    missing.append(n)
+                else:
+                    self._cache.move_to_end(n.node.node_id)
+                    vectors[n.node.node_id] = v
+        if missing:
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [n.node.get_content(metadata_mode=MetadataMode.EMBED) for n in missing])
+            with self._lock:
+                for n, e in zip(missing, embeddings):
+                    v = np.asarray(e, dtype=np.float32)
+                    v /= max(np.linalg.norm(v), 1e-12)
+                    vectors[n.node.node_id] = v
+                    self._cache[n.node.node_id] = v
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        q = np.asarray(self.embed_model.get_query_embedding(query), dtype=np.float32)
+        q /= max(np.linalg.norm(q), 1e-12)
+        return [float(vectors[n.node.node_id] @ q) for n in nodes]
+
+
+class CascadeRetriever(BaseRetriever):
+    def __init__(
+            self,
+            recall_retriever: BaseRetriever,
+            similarity_top_k: int = 5,
+            biencoder_scorer: Optional[BiEncoderScorer] = None,
+            biencoder_top_k: int = 20,
+            biencoder_budget_ms: float = 0,
+            crossencoder_scorer=None,
+            crossencoder_budget_ms: float = 0,
+            chunk_size: int = 16,
+    ) -> None:
+        self._recall_retriever = recall_retriever
+        self._similarity_top_k = similarity_top_k
+        self._biencoder_scorer = biencoder_scorer
+        self._biencoder_top_k = biencoder_top_k
+        self._biencoder_budget_ms = biencoder_budget_ms
+        self._crossencoder_scorer = crossencoder_scorer
+        self._crossencoder_budget_ms = crossencoder_budget_ms
+        self._chunk_size = chunk_size
+        self.stage_stats = {"recall": StageStats(), "biencoder": StageStats(), "crossencoder": StageStats()}
+        super().__init__()
+
+    def stage_metrics(self) -> dict:
+        """p50/p95/p99 latency and candidate counts per stage."""
+        return {name: stats.summary() for name, stats in self.stage_stats.items()}
+
+    def _rerank(self, query_bundle: QueryBundle, candidates: List[NodeWithScore]) -> List[NodeWithScore]:
+        query = query_bundle.query_str
+        if self._biencoder_scorer is not None and candidates:
+            start = time.perf_counter()
+            ranked, exhausted = score_with_budget(candidates, lambda chunk: self._biencoder_scorer(query, chunk),
+                                                  max(self._chunk_size, 64), self._biencoder_budget_ms)
+            candidates = ranked[:self._biencoder_top_k]
+            self.stage_stats["biencoder"].record((time.perf_counter() - start) * 1000, len(ranked),
+                                                 len(candidates), exhausted)
+
+        if self._crossencoder_scorer is not None and candidates:
+            start = time.perf_counter()
+
+            def cross_score(chunk):
+                return self._crossencoder_scorer.score(
+                    query, [(n.node.node_id, n.node.get_content(metadata_mode=MetadataMode.EMBED)) for n in chunk])
+
+            ranked, exhausted = score_with_budget(candidates, cross_score, self._chunk_size,
+                                                  self._crossencoder_budget_ms)
+            candidates = ranked
+            self.stage_stats["crossencoder"].record((time.perf_counter() - start) * 1000, len(ranked),
+                                                    min(len(ranked), self._similarity_top_k), exhausted)
+        return candidates[:self._similarity_top_k]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        candidates = self._recall_retriever.retrieve(query_bundle)
+        self.stage_stats["recall"].record((time.perf_counter() - start) * 1000, 0, len(candidates))
+        return self._rerank(query_bundle, candidates)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        candidates = await self._recall_retriever.aretrieve(query_bundle)
+        self.stage_stats["recall"].record((time.perf_counter() - start) * 1000, 0, len(candidates))
+        # 双塔向量化和交叉编码器打分都是阻塞调用，放到线程中执行，不阻塞事件循环
+        return await asyncio.to_thread(self._rerank, query_bundle, candidates)
+
+
+def cascade_retriever(index, recall_retriever: BaseRetriever, similarity_top_k: int = 5,
+                      biencoder_model: str = "", biencoder_top_k: int = 20, biencoder_budget_ms: float = 0,
+                      crossencoder_model: str = "BAAI/bge-reranker-base", crossencoder_budget_ms: float = 0,
+                      crossencoder_batch_size: int = 32, chunk_size: int = 16) -> CascadeRetriever:
+    """
+    Build a cascade on top of an existing candidate retriever.
+
+    Args:
+        index: The vector index (unused, kept for symmetry with the other factories)
+        recall_retriever: Cheap first stage, e.g. BM25, Vector or Hybrid with a large top_k
+        similarity_top_k: Number of nodes returned after the last stage
+        biencoder_model: Small embedding model for the optional middle stage, empty disables it
+        biencoder_top_k: Survivors of the bi-encoder stage
+        biencoder_budget_ms: Time budget of the bi-encoder stage, 0 = unlimited
+        crossencoder_model: Cross-encoder for the final stage, empty disables it
+        crossencoder_budget_ms: Time budget of the cross-encoder stage, 0 = unlimited
+        crossencoder_batch_size: Pairs per cross-encoder forward pass
+        chunk_size: Candidates scored between two budget checks
+    """
+    biencoder_scorer = None
+    if biencoder_model:
+        from ..embs.embedding import get_embedding
+
+        biencoder_scorer = BiEncoderScorer(get_embedding(biencoder_model))
+    crossencoder_scorer = None
+    if crossencoder_model:
+        from ..process.cross_encoder_rerank import get_cross_encoder_scorer
+
+        crossencoder_scorer = get_cross_encoder_scorer(crossencoder_model, batch_size=crossencoder_batch_size)
+    return CascadeRetriever(recall_retriever, similarity_top_k=similarity_top_k,
+                            biencoder_scorer=biencoder_scorer, biencoder_top_k=biencoder_top_k,
+                            biencoder_budget_ms=biencoder_budget_ms, crossencoder_scorer=crossencoder_scorer,
+                            crossencoder_budget_ms=crossencoder_budget_ms, chunk_size=chunk_size)
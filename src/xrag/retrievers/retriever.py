@@ -1,8 +1,11 @@
 # pip install llama-index-retrievers-bm25
 
+import asyncio
+import contextvars
 import os
 import warnings
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 import openai
 from llama_index.core.base.base_retriever import BaseRetriever
@@ -34,6 +37,7 @@ from llama_index.core.node_parser import SentenceSplitter, SentenceWindowNodePar
 from llama_index.llms.openai import OpenAI
 
 from llama_index.core import get_response_synthesizer
+from .cache import cached_retriever
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logging.getLogger().handlers = []
@@ -143,13 +147,15 @@ class CustomRetriever(BaseRetriever):
     def __init__(
             self,
             vector_retriever_c: VectorIndexRetriever,
-            bm25_retriever_c: BM25Retriever,
-            keyword_retriever_c: KeywordTableSimpleRetriever,
+            bm25_retriever_c: Optional[BM25Retriever] = None,
+            keyword_retriever_c: Optional[BaseKeywordTableRetriever] = None,
             mode: str = "AND",
     ) -> None:
         self._vector_retriever = vector_retriever_c
         self._bm25_retriever = bm25_retriever_c
         self._keyword_retriever = keyword_retriever_c
+        if bm25_retriever_c is None and keyword_retriever_c is None:
+            raise ValueError("Either bm25_retriever_c or keyword_retriever_c is required.")
         if mode not in ("AND", "OR"):
             raise ValueError("Invalid mode.")
         self._mode = mode
@@ -157,7 +163,8 @@ class CustomRetriever(BaseRetriever):
 
     def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
         vector_nodes = self._vector_retriever.retrieve(query_bundle)
-        bm25_nodes = self._bm25_retriever.retrieve(query_bundle)
+        second_retriever = self._bm25_retriever if self._bm25_retriever is not None else self._keyword_retriever
+        bm25_nodes = second_retriever.retrieve(query_bundle)
 
         vector_ids = {n.node.node_id for n in vector_nodes}
         bm25_ids = {n.node.node_id for n in bm25_nodes}
@@ -174,6 +181,81 @@ class CustomRetriever(BaseRetriever):
         return retrieve_nodes
 
 
+# 混合检索器：BM25 与向量检索并发执行，按分数融合后返回去重的 top-k
+# fusion_mode: weighted 对两路 min-max 归一化后的分数加权求和; rrf 采用倒数排名融合
+class HybridRetriever(BaseRetriever):
+    def __init__(
+            self,
+            vector_retriever_h: VectorIndexRetriever,
+            bm25_retriever_h: BM25Retriever,
+            similarity_top_k: int = 3,
+            fusion_mode: str = "weighted",
+            vector_weight: float = 0.5,
+            rrf_k: int = 60,
+    ) -> None:
+        if fusion_mode not in ("weighted", "rrf"):
+            raise ValueError(f"Invalid fusion_mode: {fusion_mode}. We support weighted, rrf")
+        if not 0 <= vector_weight <= 1:
+            raise ValueError("vector_weight must be in [0, 1].")
+        self._vector_retriever = vector_retriever_h
+        self._bm25_retriever = bm25_retriever_h
+        self._similarity_top_k = similarity_top_k
+        self._fusion_mode = fusion_mode
+        self._weights = (vector_weight, 1 - vector_weight)
+        self._rrf_k = rrf_k
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="xrag-hybrid")
+        super().__init__()
+
+    @staticmethod
+    def _normalize(nodes: List[NodeWithScore]) -> Dict[str, float]:
+        scores = {n.node.node_id: (n.score or 0.0) for n in nodes}
+        if not scores:
+            return scores
+        lo, hi = min(scores.values()), max(scores.values())
+        if hi == lo:
+            return {k: 1.0 for k in scores}
+        return {k: (v - lo) / (hi - lo) for k, v in scores.items()}
+
+    def _fuse(self, vector_nodes: List[NodeWithScore], bm25_nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        node_dict = {n.node.node_id: n.node for n in bm25_nodes}
+        node_dict.update({n.node.node_id: n.node for n in vector_nodes})
+        fused = {node_id: 0.0 for node_id in node_dict}
+        for weight, nodes in zip(self._weights, (vector_nodes, bm25_nodes)):
+            if self._fusion_mode == "rrf":
+                ranked = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+                for rank, n in enumerate(ranked):
+                    fused[n.node.node_id] += weight / (self._rrf_k + rank + 1)
+            else:
+                for node_id, score in self._normalize(nodes).items():
+                    fused[node_id] += weight * score
+        top = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:self._similarity_top_k]
+        return [NodeWithScore(node=node_dict[node_id], score=score) for node_id, score in top]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # 复制当前上下文，向量检索的 span 挂在本次检索之下，而不是记为新的根 span
+        vector_future = self._executor.submit(contextvars.copy_context().run, self._vector_retriever.retrieve,
+                                              query_bundle)
+        bm25_nodes = self._bm25_retriever.retrieve(query_bundle)
+        return self._fuse(vector_future.result(), bm25_nodes)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # BM25Retriever 没有真正的异步实现，放到线程中执行，避免阻塞事件循环
+        vector_nodes, bm25_nodes = await asyncio.gather(
+            self._vector_retriever.aretrieve(query_bundle),
+            asyncio.to_thread(self._bm25_retriever.retrieve, query_bundle),
+        )
+        return self._fuse(vector_nodes, bm25_nodes)
+
+
+def hybrid_retriever(index, similarity_top_k=3, candidate_top_k=20, fusion_mode='weighted', vector_weight=0.5, rrf_k=60):
+    # 两路检索都取更深的候选集（candidate_top_k），融合后再截断为 similarity_top_k
+    candidate_top_k = max(candidate_top_k, similarity_top_k)
+    vector_r = vector_retriever(index, candidate_top_k, show_progress=False)
+    bm25_r = bm25_retriever(index, candidate_top_k)
+    return HybridRetriever(vector_retriever_h=vector_r, bm25_retriever_h=bm25_r, similarity_top_k=similarity_top_k,
+                           fusion_mode=fusion_mode.lower(), vector_weight=vector_weight, rrf_k=rrf_k)
+
+
 # 融合检索器 其将来自多个文档的索引作为输入，并自动进行问题扩充，以获得多次查询结果用于合并
 # mode: 代表融合模式. 0 代表简单合并. 1: 采用RRF倒数排名融合
 def query_fusion_retriever(index, num_queries=4, similarity_top_k=2, retriver_type_QUERYFUSION='normal', retriever_weight=None):
@@ -274,8 +356,6 @@ def sentence_window_retriever(index):
 
 def custom_retriever(index, retriver_type_CUSTOM='bm25_and'):
     vector_r = vector_retriever(index)
-    bm25_r = bm25_retriever(index)
-    keyword_r = keyword_retriever(index)
     if retriver_type_CUSTOM.lower()=='bm25_and':
         mode=0
     elif retriver_type_CUSTOM.lower()=='keyword_or':
@@ -288,9 +368,9 @@ def custom_retriever(index, retriver_type_CUSTOM='bm25_and'):
         raise ValueError("Invalid mode for custom retriever."+ str(mode))
 
     if mode == 0:
-        custom_r = CustomRetriever(vector_retriever_c=vector_r, bm25_retriever_c=bm25_r, mode="AND")
+        custom_r = CustomRetriever(vector_retriever_c=vector_r, bm25_retriever_c=bm25_retriever(index), mode="AND")
     elif mode == 1:
-        custom_r = CustomRetriever(vector_retriever_c=vector_r, keyword_retriever_c=keyword_r, mode="OR")
+        custom_r = CustomRetriever(vector_retriever_c=vector_r, keyword_retriever_c=keyword_retriever(index), mode="OR")
     return custom_r
 
 
@@ -331,6 +411,8 @@ def response_synthesizer(responce_synthsizer='refine'):
 # Summary: 汇总检索器 mode = 0 1 2 对应 最简单的文档汇总索引 基于编码的文档汇总索引 基于大模型的文档汇总索引 必须为关键字表索引 *
 # Keyword: 关键字表检索器 mode = 0 1 对应 基本关键字表检索器 GPT关键字表检索器 必须为关键字表索引 *
 # Custom
+# Hybrid: BM25 与向量检索并发执行，weighted/rrf 分数融合
+# Cascade: BM25/Vector/Hybrid 召回 -> 可选双塔重打分 -> 交叉编码器精排，每阶段有候选数和时间预算
 # QueryFusion: 融合检索器 其将来自多个文档的索引作为输入，并自动进行问题扩充，以获得多次查询结果用于合并,index需为一个list
 # mode = 0, 1 分别使用llama simple重排序方法，1采用RRF
 # AutoMerging
@@ -352,6 +434,30 @@ def get_retriver(type: str, index, mode: int = 0, node = None, hierarchical_stor
         retriever = keyword_retriever(index)
     elif type == "Custom":
         retriever = custom_retriever(index, cfg.retriver_type_CUSTOM)
+    elif type == "Hybrid":
+        retriever = hybrid_retriever(index, getattr(cfg, 'similarity_top_k_HYBRID', 3), getattr(cfg, 'candidate_top_k_HYBRID', 20),
+                                     getattr(cfg, 'fusion_mode_HYBRID', 'weighted'), getattr(cfg, 'vector_weight_HYBRID', 0.5),
+                                     getattr(cfg, 'rrf_k_HYBRID', 60))
+    elif type == "Cascade":
+        from .cascade import cascade_retriever
+
+        recall_k = getattr(cfg, 'recall_top_k_CASCADE', 100)
+        recall = getattr(cfg, 'recall_retriever_CASCADE', 'hybrid').lower()
+        if recall == 'bm25':
+            recall_r = bm25_retriever(index, recall_k)
+        elif recall == 'vector':
+            recall_r = vector_retriever(index, recall_k)
+        elif recall == 'hybrid':
+            recall_r = hybrid_retriever(index, recall_k, recall_k, getattr(cfg, 'fusion_mode_HYBRID', 'weighted'),
+                                        getattr(cfg, 'vector_weight_HYBRID', 0.5), getattr(cfg, 'rrf_k_HYBRID', 60))
+        else:
+            raise ValueError(f"cascade recall retriever not supported: {recall}")
+        retriever = cascade_retriever(index, recall_r, getattr(cfg, 'similarity_top_k_CASCADE', 5),
+                                      getattr(cfg, 'biencoder_model_CASCADE', ''), getattr(cfg, 'biencoder_top_k_CASCADE', 20),
+                                      getattr(cfg, 'biencoder_budget_ms_CASCADE', 0),
+                                      getattr(cfg, 'crossencoder_model_CASCADE', 'BAAI/bge-reranker-base'),
+                                      getattr(cfg, 'crossencoder_budget_ms_CASCADE', 0),
+                                      getattr(cfg, 'rerank_batch_size', 32))
     elif type == "QueryFusion":
         retriever = query_fusion_retriever(index, cfg.num_quries_QUERYFUSION,cfg.similarity_top_k_QUERYFUSION,cfg.retriver_type_QUERYFUSION,cfg.retriever_weight_QUERYFUSION)
     elif type == "AutoMerging":
@@ -363,7 +469,7 @@ def get_retriver(type: str, index, mode: int = 0, node = None, hierarchical_stor
     else:
         raise Exception("retriever not supported: %s" % mode)
 
-    return retriever
+    return cached_retriever(retriever, type, index, cfg)
 
 
 def query_expansion(ret, query_number=4, similarity_top_k=10):
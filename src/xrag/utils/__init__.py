@@ -4,5 +4,12 @@ XRAG utilities package.
 
 from .error_view import show_error_view
 from .logger import default_logger, get_module_logger
+from .memory import MemoryTracker, get_memory_tracker
+from .model_registry import ModelRegistry, get_model_registry
+from .profiling import PhaseProfiler, get_profiler
+from .sqlite_cache import SqliteLRUCache
+from .tracing import Tracer, get_tracer
 
-__all__ = ["show_error_view", "default_logger", "get_module_logger"]
+__all__ = ["show_error_view", "default_logger", "get_module_logger", "MemoryTracker", "get_memory_tracker",
+           "ModelRegistry", "get_model_registry", "PhaseProfiler", "get_profiler", "SqliteLRUCache", "Tracer",
+           "get_tracer"]
@@ -0,0 +1,303 @@
+"""
+Memory accounting for XRAG pipeline phases.
+
+RSS (and, optionally, the Python heap via tracemalloc) is recorded at the
+boundaries of phases such as dataset load, node parsing, embedding,
+persistence, model loads and evaluation. While any phase is active a
+background thread polls RSS, so the reported peak also covers spikes between
+boundaries that last longer than the polling interval.
+
+A soft memory budget lets long loops ask ``over_budget`` and shrink their
+batches or flush buffers instead of running into the OOM killer.
+"""
+
+import contextlib
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from .logger import get_module_logger
+from .sqlite_cache import SqliteLRUCache
+
+logger = get_module_logger(__name__)
+
+MB = 2 ** 20
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def peak_rss_bytes() -> int:
+    """Peak RSS of the process so far, 0 where ``resource`` is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size of the process.
+
+    Reads ``/proc/self/statm`` on Linux, uses psutil when installed and
+    otherwise falls back to the peak RSS, which is an upper bound.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return peak_rss_bytes()
+
+
+class PhaseSample:
+    """Memory seen during one entry of a phase."""
+
+    def __init__(self, name: str, rss: int, heap: int):
+        self.name = name
+        self.rss_start = rss
+        self.rss_peak = rss
+        self.rss_end = rss
+        self.heap_start = heap
+        self.heap_peak = heap
+
+    @property
+    def rss_increase(self) -> int:
+        return self.rss_peak - self.rss_start
+
+
+class PhaseMemory:
+    """Memory of a phase aggregated over all of its entries."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.rss_start = 0
+        self.rss_end = 0
+        self.rss_peak = 0
+        self.max_rss_increase = 0
+        self.heap_peak = 0
+
+    def add(self, sample: PhaseSample, seconds: float) -> None:
+        if not self.calls:
+            self.rss_start = sample.rss_start
+        self.calls += 1
+        self.seconds += seconds
+        self.rss_end = sample.rss_end
+        self.rss_peak = max(self.rss_peak, sample.rss_peak)
+        self.max_rss_increase = max(self.max_rss_increase, sample.rss_increase)
+        self.heap_peak = max(self.heap_peak, sample.heap_peak)
+
+    def to_dict(self) -> dict:
+        return {
+            "phase": self.name,
+            "calls": self.calls,
+            "seconds": round(self.seconds, 3),
+            "rss_start_mb": round(self.rss_start / MB, 1),
+            "rss_end_mb": round(self.rss_end / MB, 1),
+            "rss_peak_mb": round(self.rss_peak / MB, 1),
+            "max_rss_increase_mb": round(self.max_rss_increase / MB, 1),
+            "heap_peak_mb": round(self.heap_peak / MB, 1) if tracemalloc.is_tracing() else None,
+        }
+
+
+class MemoryTracker:
+    """
+    Tracks RSS and Python heap per named phase and enforces a soft memory budget.
+
+    Nested and concurrent phases are all charged with the memory seen while
+    they are active, so an outer phase's peak includes its inner phases.
+    """
+
+    def __init__(self, budget_mb: float = 0, interval_ms: float = 50.0, trace_heap: bool = False):
+        self.budget_mb = budget_mb
+        self.interval = interval_ms / 1000.0
+        self.budget_events = 0
+        self._phases: Dict[str, PhaseMemory] = {}
+        self._active: List[PhaseSample] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if trace_heap and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Record memory for the block; yields the PhaseSample of this entry."""
+        sample = PhaseSample(name, rss_bytes(), self._heap_bytes())
+        with self._lock:
+            self._fold_heap_peak()
+            self._active.append(sample)
+            self._ensure_sampler()
+            self._wake.set()
+        start = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            rss = rss_bytes()
+            with self._lock:
+                self._fold_heap_peak()
+                self._update_rss(rss)
+                sample.rss_end = rss
+                self._active.remove(sample)
+                if not self._active:
+                    self._wake.clear()
+                self._phases.setdefault(name, PhaseMemory(name)).add(sample, time.perf_counter() - start)
+
+    def over_budget(self) -> bool:
+        return bool(self.budget_mb) and rss_bytes() > self.budget_mb * MB
+
+    def reclaim(self, reason: str = "") -> int:
+        """
+        Free memory that can be dropped without losing work.
+
+        Drops the in-memory copies of disk-backed caches, evicts idle models,
+        runs the garbage collector and empties the CUDA cache.
+
+        Returns:
+            RSS in bytes afterwards
+        """
+        from .model_registry import get_model_registry
+
+        self.budget_events += 1
+        released = SqliteLRUCache.release_all_memory()
+        get_model_registry().evict_idle()
+        gc.collect()
+        # only touch torch if something already imported it
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        rss = rss_bytes()
+        logger.warning(f"RSS above the soft memory budget of {self.budget_mb} MB"
+                       f"{' during ' + reason if reason else ''}: released {released} cached entries, "
+                       f"RSS now {rss / MB:.0f} MB")
+        return rss
+
+    def report(self) -> List[dict]:
+        with self._lock:
+            return [phase.to_dict() for phase in self._phases.values()]
+
+    def peaks(self) -> Dict[str, int]:
+        """Peak RSS in bytes per phase."""
+        with self._lock:
+            return {name: phase.rss_peak for name, phase in self._phases.items()}
+
+    def print_report(self) -> None:
+        report = self.report()
+        if not report:
+            return
+        print(f"{'phase':<24}{'calls':>7}{'seconds':>10}{'rss_start_mb':>14}{'rss_end_mb':>12}{'rss_peak_mb':>13}"
+              f"{'max_incr_mb':>13}{'heap_peak_mb':>14}")
+        for row in report:
+            heap = "-" if row["heap_peak_mb"] is None else f"{row['heap_peak_mb']:.1f}"
+            print(f"{row['phase']:<24}{row['calls']:>7}{row['seconds']:>10.2f}{row['rss_start_mb']:>14.1f}"
+                  f"{row['rss_end_mb']:>12.1f}{row['rss_peak_mb']:>13.1f}{row['max_rss_increase_mb']:>13.1f}"
+                  f"{heap:>14}")
+        print(f"process peak RSS: {peak_rss_bytes() / MB:.1f} MB, "
+              f"soft budget: {self.budget_mb or '-'} MB, budget events: {self.budget_events}")
+
+    def export_json(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        data = {"phases": self.report(), "peak_rss_mb": round(peak_rss_bytes() / MB, 1),
+                "budget_mb": self.budget_mb, "budget_events": self.budget_events}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def _heap_bytes() -> int:
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def _fold_heap_peak(self) -> None:
+        # tracemalloc has a single global peak: charge it to every active phase before resetting it
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for sample in self._active:
+            sample.heap_peak = max(sample.heap_peak, peak)
+        tracemalloc.reset_peak()
+
+    def _update_rss(self, rss: int) -> None:
+        for sample in self._active:
+            sample.rss_peak = max(sample.rss_peak, rss)
+
+    def _ensure_sampler(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="xrag-memory-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            rss = rss_bytes()
+            with self._lock:
+                self._update_rss(rss)
+            time.sleep(self.interval)
+
+
+_tracker: Optional[MemoryTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_memory_tracker() -> Optional[MemoryTracker]:
+    """
+    Get the process-wide memory tracker configured from ``config.toml``.
+
+    Returns:
+        The shared MemoryTracker, or None when ``memory_tracking`` is disabled
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                from ..config import Config
+
+                cfg = Config()
+                if not getattr(cfg, "memory_tracking", False):
+                    return None
+                _tracker = MemoryTracker(budget_mb=getattr(cfg, "memory_budget_mb", 0) or 0,
+                                         interval_ms=getattr(cfg, "memory_sample_interval_ms", 50.0),
+                                         trace_heap=getattr(cfg, "memory_tracemalloc", False))
+    return _tracker
+
+
+def memory_phase(name: str):
+    """``with memory_phase("embedding"):`` records memory for the block when tracking is enabled."""
+    tracker = get_memory_tracker()
+    return tracker.phase(name) if tracker is not None else contextlib.nullcontext()
+
+
+def memory_pressure() -> bool:
+    """True when RSS is above the soft memory budget."""
+    tracker = get_memory_tracker()
+    return tracker is not None and tracker.over_budget()
+
+
+def report_memory() -> Optional[List[dict]]:
+    """Print the per-phase memory table and write ``memory_report_path`` if configured."""
+    tracker = get_memory_tracker()
+    if tracker is None:
+        return None
+    tracker.print_report()
+    from ..config import Config
+
+    path = getattr(Config(), "memory_report_path", "")
+    if path:
+        tracker.export_json(path)
+        logger.info(f"Memory report written to {path}")
+    return tracker.report()
@@ -0,0 +1,263 @@
+"""
+Process-wide model registry for XRAG.
+
+Embedding models, generator LLMs, local judge models and rerankers are all
+loaded through this registry so that a given set of weights is only loaded
+once per process, no matter how many components ask for it.
+"""
+
+import gc
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .logger import get_module_logger
+from .memory import MB, memory_phase
+
+logger = get_module_logger(__name__)
+
+ModelKey = Tuple[str, str, str]
+
+
+def _module_nbytes(module) -> int:
+    """Sum parameter and buffer sizes of a torch ``nn.Module``."""
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def estimate_nbytes(obj, _depth: int = 0) -> int:
+    """
+    Best-effort estimate of the memory held by a loaded model object.
+
+    Handles raw torch modules, tuples such as ``(tokenizer, model)`` and the
+    LlamaIndex / FlagEmbedding wrappers that keep the actual module in a
+    ``_model`` / ``model`` attribute.
+
+    Args:
+        obj: The object returned by a loader
+
+    Returns:
+        Estimated size in bytes, 0 if nothing measurable was found
+    """
+    if obj is None or _depth > 3:
+        return 0
+    if hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+        try:
+            return _module_nbytes(obj)
+        except Exception:
+            return 0
+    if isinstance(obj, (tuple, list)):
+        return sum(estimate_nbytes(o, _depth + 1) for o in obj)
+    for attr in ("_model", "model", "_client"):
+        inner = getattr(obj, attr, None)
+        if inner is not None and inner is not obj:
+            size = estimate_nbytes(inner, _depth + 1)
+            if size:
+                return size
+    return 0
+
+
+class _Entry:
+    def __init__(self, key: ModelKey):
+        self.key = key
+        self.lock = threading.Lock()
+        self.model = None
+        self.loaded = False
+        self.nbytes = 0
+        self.load_seconds = 0.0
+        self.hits = 0
+        self.last_used = 0.0
+
+
+class ModelRegistry:
+    """
+    Deduplicates model loads by ``(model name, dtype, device)``.
+
+    Models are loaded lazily on the first :meth:`get` call for their key and
+    reused afterwards. When a memory budget is configured, the least recently
+    used models are dropped from the registry once the budget is exceeded.
+    Evicting only releases the registry's reference; memory is returned once
+    no other component holds the model either.
+    """
+
+    def __init__(self, memory_budget_mb: float = 0, idle_seconds: float = 0):
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_seconds = idle_seconds
+        self._entries: Dict[ModelKey, _Entry] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(name: str, dtype: Optional[str] = None, device: Optional[str] = None) -> ModelKey:
+        return (str(name), str(dtype or "auto"), str(device or "auto"))
+
+    def get(self, name: str, loader: Callable[[], Any], dtype: Optional[str] = None,
+            device: Optional[str] = None) -> Any:
+        """
+        Return the model for ``(name, dtype, device)``, loading it on first use.
+
+        Args:
+            name (str): Model name or path
+            loader (callable): Zero-argument function that loads the model
+            dtype (str, optional): Precision label, part of the cache key
+            device (str, optional): Device label, part of the cache key
+
+        Returns:
+            The object produced by ``loader``
+        """
+        key = self.make_key(name, dtype, device)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(key)
+                self._entries[key] = entry
+
+        with entry.lock:
+            if not entry.loaded:
+                start = time.perf_counter()
+                with memory_phase("model_load") as sample:
+                    entry.model = loader()
+                entry.load_seconds = time.perf_counter() - start
+                entry.nbytes = estimate_nbytes(entry.model)
+                entry.loaded = True
+                rss = f", RSS +{sample.rss_increase / MB:.1f} MB" if sample is not None else ""
+                logger.info(f"Loaded model {key} in {entry.load_seconds:.1f}s "
+                            f"({entry.nbytes / 2 ** 20:.1f} MB{rss})")
+            else:
+                entry.hits += 1
+                logger.debug(f"Reusing model {key}")
+            entry.last_used = time.monotonic()
+            model = entry.model
+
+        self._enforce_budget(protect=key)
+        return model
+
+    def is_loaded(self, name: str, dtype: Optional[str] = None, device: Optional[str] = None) -> bool:
+        entry = self._entries.get(self.make_key(name, dtype, device))
+        return entry is not None and entry.loaded
+
+    def loaded_models(self, prefix: str = "") -> List[Tuple[ModelKey, Any]]:
+        """(key, model) pairs of the loaded models whose name starts with ``prefix``."""
+        with self._lock:
+            return [(e.key, e.model) for e in self._entries.values() if e.loaded and e.key[0].startswith(prefix)]
+
+    def evict(self, name: str, dtype: Optional[str] = None, device: Optional[str] = None) -> bool:
+        """Drop one model from the registry. Returns True if it was loaded."""
+        return self._evict_key(self.make_key(name, dtype, device))
+
+    def evict_idle(self, idle_seconds: Optional[float] = None) -> List[ModelKey]:
+        """Drop every model that has not been used for ``idle_seconds``."""
+        idle_seconds = self.idle_seconds if idle_seconds is None else idle_seconds
+        if not idle_seconds:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            stale = [k for k, e in self._entries.items()
+                     if e.loaded and now - e.last_used > idle_seconds]
+        return [k for k in stale if self._evict_key(k)]
+
+    def clear(self) -> None:
+        with self._lock:
+            keys = list(self._entries.keys())
+        for key in keys:
+            self._evict_key(key)
+
+    def total_nbytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values() if e.loaded)
+
+    def memory_report(self) -> List[dict]:
+        """
+        Per-model memory and usage statistics, largest first.
+
+        Returns:
+            A list of dicts with name, dtype, device, size_mb, load_seconds,
+            hits and idle_seconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.loaded]
+        report = [{
+            "name": e.key[0],
+            "dtype": e.key[1],
+            "device": e.key[2],
+            "size_mb": round(e.nbytes / 2 ** 20, 1),
+            "load_seconds": round(e.load_seconds, 2),
+            "hits": e.hits,
+            "idle_seconds": round(now - e.last_used, 1),
+        } for e in entries]
+        report.sort(key=lambda r: r["size_mb"], reverse=True)
+        return report
+
+    def log_memory_report(self) -> None:
+        report = self.memory_report()
+        if not report:
+            return
+        logger.info(f"Model registry: {len(report)} models, {self.total_nbytes() / 2 ** 20:.1f} MB")
+        for r in report:
+            logger.info(f"  {r['name']} [{r['dtype']}, {r['device']}]: {r['size_mb']} MB, "
+                        f"hits={r['hits']}, idle={r['idle_seconds']}s")
+
+    def _evict_key(self, key: ModelKey) -> bool:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or not entry.loaded:
+            return False
+        with entry.lock:
+            entry.model = None
+            entry.loaded = False
+        logger.info(f"Evicted model {key} ({entry.nbytes / 2 ** 20:.1f} MB)")
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        return True
+
+    def _enforce_budget(self, protect: ModelKey) -> None:
+        self.evict_idle()
+        if not self.memory_budget_mb:
+            return
+        budget = self.memory_budget_mb * 2 ** 20
+        while self.total_nbytes() > budget:
+            with self._lock:
+                candidates = sorted((e for k, e in self._entries.items() if e.loaded and k != protect),
+                                    key=lambda e: e.last_used)
+            if not candidates:
+                logger.warning(f"Model registry exceeds memory budget of {self.memory_budget_mb} MB "
+                               f"but nothing else can be evicted")
+                return
+            self._evict_key(candidates[0].key)
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Get the process-wide model registry, configured from ``config.toml``.
+
+    Returns:
+        The shared ModelRegistry instance
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                memory_budget_mb = 0
+                idle_seconds = 0
+                try:
+                    from ..config import Config
+
+                    cfg = Config()
+                    memory_budget_mb = getattr(cfg, "model_memory_budget_mb", 0) or 0
+                    idle_seconds = getattr(cfg, "model_idle_seconds", 0) or 0
+                except Exception:
+                    # If config loading fails, run without a budget
+                    pass
+                _registry = ModelRegistry(memory_budget_mb=memory_budget_mb, idle_seconds=idle_seconds)
+    return _registry
@@ -0,0 +1,322 @@
+"""
+On-demand profiling of XRAG pipeline phases.
+
+Two profilers are available:
+
+* ``cprofile`` - deterministic cProfile of the thread that enters the phase,
+  written as ``<phase>.prof`` (readable with pstats, snakeviz, ...).
+* ``sampling`` - a background thread samples the stacks of all threads every
+  few milliseconds and writes them in the folded format used by py-spy and
+  flamegraph.pl (``<phase>.folded``). It also sees work done in thread pools;
+  threads blocked in waits or selects are skipped.
+
+Each phase is accumulated over all of its entries, and ``dump`` writes one file
+per phase plus ``summary.txt`` with the top functions by cumulative time.
+"""
+
+import asyncio
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .logger import get_module_logger
+
+logger = get_module_logger(__name__)
+
+PROFILE_MODES = ("cprofile", "sampling")
+
+# leaf frames of threads that are blocked rather than working (like py-spy without --idle)
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+# sampler threads never sample each other
+_sampler_threads = set()
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _is_idle(code) -> bool:
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of all threads while started.
+
+    The sampler thread is created on the first ``start`` and keeps running
+    until ``close``; while stopped it waits without sampling.
+    """
+
+    def __init__(self, interval_ms: float = 5.0):
+        self.interval = interval_ms / 1000.0
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._depth = 0
+        self._active = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="xrag-sampling-profiler", daemon=True)
+                self._thread.start()
+            # several threads may be inside the same phase, sampling stops when the last one leaves
+            self._depth += 1
+            self._active.set()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._depth = max(0, self._depth - 1)
+            if self._depth == 0:
+                self._active.clear()
+
+    def close(self) -> None:
+        self._closed = True
+        self._active.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        _sampler_threads.add(threading.get_ident())
+        try:
+            while True:
+                self._active.wait()
+                if self._closed:
+                    return
+                self._sample()
+                time.sleep(self.interval)
+        finally:
+            _sampler_threads.discard(threading.get_ident())
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            self.samples += 1
+            for thread_id, frame in frames.items():
+                if thread_id in _sampler_threads or _is_idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: str) -> None:
+        """One ``frame;frame;frame count`` line per distinct stack (flamegraph.pl / speedscope input)."""
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+
+    def top(self, n: int = 30) -> List[Tuple[str, int, int]]:
+        """(function, self samples, cumulative samples), by cumulative samples."""
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        with self._lock:
+            stacks = list(self.stacks.items())
+        for stack, count in stacks:
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                cumulative[label] += count
+        return [(label, own[label], count) for label, count in cumulative.most_common(n)]
+
+    def summary(self, n: int = 30) -> str:
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms (all non-idle threads)",
+                 f"{'cumulative':>10} {'self':>8}  function"]
+        for label, own, cumulative in self.top(n):
+            lines.append(f"{cumulative:>10} {own:>8}  {label}")
+        return "\n".join(lines)
+
+
+class PhaseProfiler:
+    """
+    Profiles named pipeline phases (e.g. ``index_build``, ``query``, ``eval``).
+
+    A phase entered while another phase is active in the same thread is
+    counted in the outer phase.
+    """
+
+    def __init__(self, output_dir: str = "profiles", mode: str = "cprofile", top_n: int = 30,
+                 interval_ms: float = 5.0):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"profile mode {mode} not supported, use one of {PROFILE_MODES}.")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.top_n = top_n
+        self.interval_ms = interval_ms
+        self.seconds: Dict[str, float] = {}
+        self._profiles: Dict[str, object] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_profile(self, name: str):
+        with self._lock:
+            if name not in self._profiles:
+                self._profiles[name] = (cProfile.Profile() if self.mode == "cprofile"
+                                        else SamplingProfiler(self.interval_ms))
+            return self._profiles[name]
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if getattr(self._local, "active", None) is not None:
+            yield
+            return
+        profile = self._get_profile(name)
+        try:
+            if self.mode == "cprofile":
+                profile.enable()
+            else:
+                profile.start()
+        except ValueError as e:
+            # another profiler is already active in this thread (e.g. an outer cProfile run)
+            logger.warning(f"Could not profile phase {name}: {e}")
+            yield
+            return
+        self._local.active = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.mode == "cprofile":
+                profile.disable()
+            else:
+                profile.stop()
+            self._local.active = None
+            with self._lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def dump(self, prefix: str = "") -> str:
+        """
+        Write one profile file per phase and ``summary.txt``.
+
+        Returns:
+            The summary text
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        with self._lock:
+            profiles = dict(self._profiles)
+            seconds = dict(self.seconds)
+        sections = []
+        for name, profile in profiles.items():
+            header = f"=== phase {name}: {seconds.get(name, 0.0):.2f}s wall ({self.mode}) ==="
+            if self.mode == "cprofile":
+                path = os.path.join(self.output_dir, f"{prefix}{name}.prof")
+                profile.dump_stats(path)
+                sections.append(f"{header}\n{cprofile_summary(profile, self.top_n)}")
+            else:
+                path = os.path.join(self.output_dir, f"{prefix}{name}.folded")
+                profile.write_folded(path)
+                sections.append(f"{header}\n{profile.summary(self.top_n)}")
+            logger.info(f"Profile of phase {name} written to {path}")
+        summary = "\n\n".join(sections)
+        with open(os.path.join(self.output_dir, f"{prefix}summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary + "\n")
+        return summary
+
+
+def cprofile_summary(profile: cProfile.Profile, top_n: int = 30) -> str:
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(top_n)
+    return stream.getvalue()
+
+
+async def capture_profile(seconds: float, mode: str = "sampling", output_dir: str = "profiles", top_n: int = 30,
+                          interval_ms: float = 5.0, prefix: str = "live") -> Tuple[str, str]:
+    """
+    Profile whatever the process does during the next ``seconds``.
+
+    ``sampling`` covers all threads. ``cprofile`` is enabled on the calling
+    (event loop) thread, so it sees every coroutine on the loop but not work
+    handed off to thread pools.
+
+    Returns:
+        (path of the written profile, summary text)
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"profile mode {mode} not supported, use one of {PROFILE_MODES}.")
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        path = os.path.join(output_dir, f"{prefix}-{stamp}.prof")
+        profile.dump_stats(path)
+        summary = cprofile_summary(profile, top_n)
+    else:
+        sampler = SamplingProfiler(interval_ms)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+            sampler.close()
+        path = os.path.join(output_dir, f"{prefix}-{stamp}.folded")
+        sampler.write_folded(path)
+        summary = sampler.summary(top_n)
+    summary = f"=== {prefix}: {seconds:g}s ({mode}) ===\n{summary}"
+    with open(os.path.join(output_dir, f"{prefix}-{stamp}-summary.txt"), "w", encoding="utf-8") as f:
+        f.write(summary + "\n")
+    logger.info(f"Live profile written to {path}")
+    return path, summary
+
+
+_profiler: Optional[PhaseProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[PhaseProfiler]:
+    """
+    Get the process-wide phase profiler configured from ``config.toml``.
+
+    Returns:
+        The shared PhaseProfiler, or None when ``profile`` is disabled
+    """
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                from ..config import Config
+
+                cfg = Config()
+                if not getattr(cfg, "profile", False):
+                    return None
+                _profiler = PhaseProfiler(output_dir=getattr(cfg, "profile_dir", "profiles"),
+                                          mode=getattr(cfg, "profile_mode", "cprofile"),
+                                          top_n=getattr(cfg, "profile_top_n", 30),
+                                          interval_ms=getattr(cfg, "profile_sample_interval_ms", 5.0))
+    return _profiler
+
+
+def profile_phase(name: str):
+    """``with profile_phase("query"):`` profiles the block when profiling is enabled."""
+    profiler = get_profiler()
+    return profiler.phase(name) if profiler is not None else contextlib.nullcontext()
+
+
+def dump_profiles() -> Optional[str]:
+    profiler = get_profiler()
+    if profiler is None:
+        return None
+    summary = profiler.dump()
+    print(f"Profiles written to {profiler.output_dir}")
+    return summary
@@ -0,0 +1,105 @@
+"""
+Small persistent key/value cache used by XRAG's result caches.
+
+Values are strings kept in an in-memory LRU in front of a SQLite table.
+When ``max_entries`` is set the least recently used rows are evicted from
+disk as well.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+
+class SqliteLRUCache:
+    _instances: "weakref.WeakSet[SqliteLRUCache]" = weakref.WeakSet()
+
+    def __init__(self, path: Optional[str], table: str = "cache", max_entries: int = 100000,
+                 memory_entries: int = 10000):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                               "(key TEXT PRIMARY KEY, value TEXT, last_used REAL)")
+            self._conn.commit()
+        SqliteLRUCache._instances.add(self)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            elif self._conn is not None:
+                row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._conn.commit()
+                    self._remember(key, value)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._remember(key, value)
+            if self._conn is None:
+                return
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, last_used) VALUES (?, ?, ?)",
+                               (key, value, time.time()))
+            if self.max_entries:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+                                   "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute(f"DELETE FROM {self.table}")
+                self._conn.commit()
+
+    def release_memory(self) -> int:
+        """Drop the in-memory LRU if every entry is also on disk. Returns the number of entries dropped."""
+        with self._lock:
+            if self._conn is None:
+                return 0
+            n = len(self._memory)
+            self._memory.clear()
+            return n
+
+    @classmethod
+    def release_all_memory(cls) -> int:
+        return sum(cache.release_memory() for cache in list(cls._instances))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def _remember(self, key: str, value: str) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
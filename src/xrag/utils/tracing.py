@@ -0,0 +1,423 @@
+"""
+Lightweight tracing for the XRAG pipeline.
+
+A span records the monotonic wall time of one pipeline stage together with
+optional attributes such as token counts and cache hits. Finished spans are
+aggregated per stage into latency percentiles and can be exported as JSON or
+CSV. LlamaIndex's own instrumentation (retrievers, node postprocessors,
+response synthesizers, embeddings and LLM calls) is forwarded into the same
+tracer, so explicit spans only wrap the stages XRAG implements itself.
+"""
+
+import bisect
+import contextlib
+import csv
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+TOKEN_ATTRS = ("prompt_tokens", "completion_tokens")
+# upper bounds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "parent", "start", "end", "attrs")
+
+    def __init__(self, name: str, trace_id: int, parent: Optional["Span"] = None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = attrs
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def add(self, key: str, value: float) -> None:
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+class _NullSpan:
+    """Returned by a disabled tracer so instrumented code does not need to check."""
+
+    name = ""
+    attrs: Dict[str, Any] = {}
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_current_span: ContextVar[Optional[Span]] = ContextVar("xrag_current_span", default=None)
+
+
+class _StageStats:
+    __slots__ = ("durations", "buckets", "count", "total_ms", "errors", "cache_lookups", "cache_hits", "tokens")
+
+    def __init__(self, window: int):
+        self.durations = deque(maxlen=window)
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.errors = 0
+        self.cache_lookups = 0
+        self.cache_hits = 0
+        self.tokens = {key: 0 for key in TOKEN_ATTRS}
+
+
+class Tracer:
+    """
+    Collects spans per stage.
+
+    Percentiles are computed over the last ``window`` spans of every stage;
+    counts, totals, errors, cache hits and token counts cover all spans since
+    the last ``reset``. At most ``max_spans`` finished spans are kept for export.
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 10000, max_spans: int = 100000):
+        self.enabled = enabled
+        self.window = window
+        self._stages: Dict[str, _StageStats] = {}
+        self._spans = deque(maxlen=max_spans)
+        self._trace_ids = itertools.count(1)
+        self._epoch = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attrs) -> Span:
+        parent = parent if parent is not None else _current_span.get()
+        trace_id = parent.trace_id if parent is not None else next(self._trace_ids)
+        return Span(name, trace_id, parent, **attrs)
+
+    def finish_span(self, span: Span, error: bool = False) -> None:
+        span.end = time.perf_counter()
+        # token counts roll up so a query span reports the tokens of all its LLM calls
+        if span.parent is not None:
+            for key in TOKEN_ATTRS:
+                if key in span.attrs:
+                    span.parent.add(key, span.attrs[key])
+        self._record(span.name, span.duration_ms, span.trace_id, span.parent,
+                     (span.start - self._epoch) * 1000, error, span.attrs)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """
+        Time a block as one span of stage ``name``; nested spans become its children.
+
+        Usage::
+
+            with get_tracer().span("query_transform") as span:
+                span.set("cache_hit", True)
+        """
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+        span = self.start_span(name, **attrs)
+        token = _current_span.set(span)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish_span(span, error)
+
+    def record(self, name: str, duration_ms: float, **attrs) -> None:
+        """Record a span that was timed elsewhere."""
+        if not self.enabled:
+            return
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent is not None else next(self._trace_ids)
+        start_ms = (time.perf_counter() - self._epoch) * 1000 - duration_ms
+        self._record(name, duration_ms, trace_id, parent, start_ms, False, attrs)
+
+    def _record(self, name, duration_ms, trace_id, parent, start_ms, error, attrs) -> None:
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = _StageStats(self.window)
+            stats.durations.append(duration_ms)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.errors += int(error)
+            if "cache_hit" in attrs:
+                stats.cache_lookups += 1
+                stats.cache_hits += int(bool(attrs["cache_hit"]))
+            stats.cache_lookups += attrs.get("cache_lookups", 0)
+            stats.cache_hits += attrs.get("cache_hits", 0)
+            for key in TOKEN_ATTRS:
+                stats.tokens[key] += attrs.get(key, 0)
+            record = {"name": name, "trace_id": trace_id, "parent": parent.name if parent is not None else None,
+                      "start_ms": round(start_ms, 3), "duration_ms": round(duration_ms, 3), "error": error}
+            record.update(attrs)
+            self._spans.append(record)
+
+    def stage_summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Latency percentiles and counters per stage.
+
+        Returns:
+            {stage: {count, p50_ms, p95_ms, p99_ms, mean_ms, total_ms, errors,
+                     cache_hit_rate, prompt_tokens, completion_tokens}}
+        """
+        with self._lock:
+            stages = {name: (np.array(stats.durations), stats.count, stats.total_ms, stats.errors,
+                             stats.cache_lookups, stats.cache_hits, dict(stats.tokens))
+                      for name, stats in self._stages.items()}
+        summary = {}
+        for name, (durations, count, total_ms, errors, lookups, hits, tokens) in sorted(stages.items()):
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99]) if len(durations) else (0.0, 0.0, 0.0)
+            summary[name] = {
+                "count": count,
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "mean_ms": round(total_ms / count, 3) if count else 0.0,
+                "total_ms": round(total_ms, 3),
+                "errors": errors,
+                "cache_hit_rate": round(hits / lookups, 4) if lookups else None,
+                **tokens,
+            }
+        return summary
+
+    def histograms(self) -> Dict[str, dict]:
+        """
+        Cumulative latency histograms per stage since the last reset.
+
+        Returns:
+            {stage: {"buckets": [(upper_bound_ms, cumulative_count), ..., (inf, count)],
+                     "sum_ms", "count", "prompt_tokens", "completion_tokens"}}
+        """
+        with self._lock:
+            stages = {name: (list(stats.buckets), stats.total_ms, stats.count, dict(stats.tokens))
+                      for name, stats in self._stages.items()}
+        histograms = {}
+        for name, (buckets, total_ms, count, tokens) in sorted(stages.items()):
+            cumulative = list(itertools.accumulate(buckets))
+            histograms[name] = {
+                "buckets": list(zip(LATENCY_BUCKETS_MS + (float("inf"),), cumulative)),
+                "sum_ms": total_ms,
+                "count": count,
+                **tokens,
+            }
+        return histograms
+
+    def spans(self) -> List[dict]:
+        with self._lock:
+            return list(self._spans)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._spans.clear()
+
+    def export_json(self, path: str, include_spans: bool = True) -> None:
+        data = {"stages": self.stage_summary()}
+        if include_spans:
+            data["spans"] = self.spans()
+        _makedirs(path)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def export_csv(self, path: str) -> None:
+        """Write the per-stage summary, one row per stage."""
+        summary = self.stage_summary()
+        fields = ["stage", "count", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "total_ms", "errors",
+                  "cache_hit_rate", *TOKEN_ATTRS]
+        _makedirs(path)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for name, row in summary.items():
+                writer.writerow({"stage": name, **row})
+
+
+def _makedirs(path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+
+# LlamaIndex span names are "<Class>.<method>-<uuid>"; methods are mapped to XRAG stages
+_LLAMA_INDEX_STAGES = {
+    "BaseRetriever.retrieve": "retrieval",
+    "BaseRetriever.aretrieve": "retrieval",
+    "_postprocess_nodes": "postprocess",
+    "BaseSynthesizer.synthesize": "synthesis",
+    "BaseSynthesizer.asynthesize": "synthesis",
+    "BaseEmbedding.get_query_embedding": "query_embedding",
+    "BaseEmbedding.aget_query_embedding": "query_embedding",
+    "BaseEmbedding.get_text_embedding_batch": "embedding",
+    "BaseEmbedding.aget_text_embedding_batch": "embedding",
+    "predict": "llm",
+    "apredict": "llm",
+    "chat": "llm",
+    "achat": "llm",
+    "complete": "llm",
+    "acomplete": "llm",
+}
+
+
+def current_span():
+    """The innermost open span of this context (e.g. the ``retrieval`` span inside a retriever), or a no-op span."""
+    span = _current_span.get()
+    return span if span is not None else _NULL_SPAN
+
+
+def llama_index_stage(span_id: str) -> Optional[str]:
+    qualname = span_id.rsplit("-", 5)[0]
+    stage = _LLAMA_INDEX_STAGES.get(qualname)
+    if stage is None:
+        stage = _LLAMA_INDEX_STAGES.get(qualname.rsplit(".", 1)[-1])
+    return stage
+
+
+def _usage_tokens(response) -> Dict[str, int]:
+    """Token counts reported by the LLM backend (OpenAI-style usage or Ollama counters)."""
+    raw = getattr(response, "raw", None) or {}
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is not None:
+        get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+        if get("prompt_tokens") is not None:
+            return {"prompt_tokens": get("prompt_tokens") or 0, "completion_tokens": get("completion_tokens") or 0}
+    if isinstance(raw, dict) and "prompt_eval_count" in raw:
+        return {"prompt_tokens": raw.get("prompt_eval_count") or 0, "completion_tokens": raw.get("eval_count") or 0}
+    return {}
+
+
+def _estimate_tokens(text: str) -> int:
+    from llama_index.core.utils import get_tokenizer
+
+    return len(get_tokenizer()(text or ""))
+
+
+def install_llama_index_hooks(tracer: "Tracer") -> None:
+    """Forward LlamaIndex instrumentation spans and LLM token usage into ``tracer``."""
+    from llama_index.core.instrumentation import get_dispatcher
+    from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+    from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMCompletionEndEvent
+    from llama_index.core.instrumentation.span_handlers import NullSpanHandler
+
+    class XragSpanHandler(NullSpanHandler):
+        """Turns the LlamaIndex spans of known stages into XRAG spans; the outermost span of a stage wins."""
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "XragSpanHandler"
+
+        def span_enter(self, id_, bound_args, instance=None, parent_id=None, tags=None, **kwargs) -> None:
+            if not tracer.enabled:
+                return
+            stage = llama_index_stage(id_)
+            parent = _current_span.get()
+            if stage is None or (parent is not None and parent.name == stage):
+                return
+            span = tracer.start_span(stage, parent)
+            _open_spans[id_] = (span, _current_span.set(span))
+
+        def span_exit(self, id_, bound_args, instance=None, result=None, **kwargs) -> None:
+            self._finish(id_, False)
+
+        def span_drop(self, id_, bound_args, instance=None, err=None, **kwargs) -> None:
+            self._finish(id_, True)
+
+        @staticmethod
+        def _finish(id_, error) -> None:
+            entry = _open_spans.pop(id_, None)
+            if entry is None:
+                return
+            span, token = entry
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # exited in a different context (e.g. a generator finished elsewhere)
+                pass
+            tracer.finish_span(span, error)
+
+    class XragTokenHandler(BaseEventHandler):
+        @classmethod
+        def class_name(cls) -> str:
+            return "XragTokenHandler"
+
+        def handle(self, event, **kwargs) -> None:
+            if not tracer.enabled or not isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+                return
+            span = _current_span.get()
+            if span is None or event.response is None:
+                return
+            tokens = _usage_tokens(event.response)
+            if not tokens:
+                if isinstance(event, LLMChatEndEvent):
+                    prompt = "\n".join(str(m.content or "") for m in event.messages)
+                    completion = event.response.message.content or ""
+                else:
+                    prompt, completion = event.prompt, event.response.text
+                tokens = {"prompt_tokens": _estimate_tokens(prompt), "completion_tokens": _estimate_tokens(completion)}
+            for key, value in tokens.items():
+                span.add(key, value)
+
+    _open_spans: Dict[str, tuple] = {}
+    dispatcher = get_dispatcher()
+    dispatcher.add_span_handler(XragSpanHandler())
+    dispatcher.add_event_handler(XragTokenHandler())
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Get the process-wide tracer configured from ``config.toml``.
+
+    The tracer is always returned; with ``tracing = false`` it is disabled and
+    spans cost a single attribute check.
+    """
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                from ..config import Config
+
+                cfg = Config()
+                tracer = Tracer(enabled=getattr(cfg, "tracing", True),
+                                window=getattr(cfg, "trace_window", 10000),
+                                max_spans=getattr(cfg, "trace_max_spans", 100000))
+                if tracer.enabled:
+                    install_llama_index_hooks(tracer)
+                _tracer = tracer
+    return _tracer
+
+
+def export_trace(tracer: Optional[Tracer] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Export the trace to the paths configured in ``config.toml`` and return the stage summary.
+    """
+    from ..config import Config
+
+    cfg = Config()
+    tracer = tracer or get_tracer()
+    json_path = getattr(cfg, "trace_export_json", "")
+    csv_path = getattr(cfg, "trace_export_csv", "")
+    if json_path:
+        tracer.export_json(json_path)
+    if csv_path:
+        tracer.export_csv(csv_path)
+    return tracer.stage_summary()
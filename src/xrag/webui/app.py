@@ -9,7 +9,7 @@ from xrag.eval.evaluate_rag import evaluating
 from xrag.launcher import run
 from xrag.eval.evaluate_rag import EvaluationResult
 from xrag.process.query_transform import transform_and_query
-from xrag.launcher import build_index, build_query_engine
+from xrag.launcher import build_index, build_query_engine, score_run
 from xrag.data.qa_loader import get_qa_dataset
 
 AVAILABLE_METRICS = [
@@ -155,8 +155,8 @@ DATASETS_INFO = {
 
 # frontend dataset options
 FRONTEND_DATASET_OPTIONS = [DATASET_DISPLAY_MAP.get(ds, ds) for ds in DATASET_OPTIONS]
-RETRIEVER_OPTIONS = ["BM25", "Vector", "Summary", "Tree", "Keyword", "Custom", "QueryFusion", "AutoMerging", "Recursive", "SentenceWindow"]  # Add more as needed
-POSTPROCESS_RERANK_OPTIONS = ["none","long_context_reorder", "colbertv2_rerank","bge-reranker-base"]  # Add more as needed
+RETRIEVER_OPTIONS = ["BM25", "Vector", "Summary", "Tree", "Keyword", "Custom", "QueryFusion", "AutoMerging", "Recursive", "SentenceWindow", "Hybrid", "Cascade"]  # Add more as needed
+POSTPROCESS_RERANK_OPTIONS = ["none","long_context_reorder", "colbertv2_rerank","bge-reranker-base","cross_encoder_rerank"]  # Add more as needed
 QUERY_TRANSFORM_OPTIONS = ["none", "hyde_zeroshot", "hyde_fewshot","stepback_zeroshot","stepback_fewshot"]  # Add more as needed
 
 # follow the order listed in the docs
@@ -600,6 +600,16 @@ def main():
             st.success("Evaluation complete!")
             st.session_state.evaluation_results = evaluateResults
 
+        # 对已保存的运行文件打分，不重新查询
+        with st.expander("Score a saved run file"):
+            run_file = st.text_input("Run file path (.jsonl / .parquet)", value=getattr(cfg, "run_file", ""))
+            if st.button("Score Run File") and run_file:
+                with st.spinner("Scoring run file..."):
+                    evaluateResults = score_run(run_file, metrics=cfg.metrics.copy())
+                st.markdown(evaluateResults.get_results_str())
+                st.success("Evaluation complete!")
+                st.session_state.evaluation_results = evaluateResults
+
     # if st.session_state.step == 5:
     #     st.header("Evaluation Results")
     #     if 'evaluation_results' in st.session_state: